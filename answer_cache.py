@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from qa_index import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# Context fields that change the system prompt and therefore the answer
+PERSONA_FIELDS = ('name', 'role', 'creator', 'location')
+
+
+# Key identifying everything that determines an upstream answer: the
+# normalized question, persona, max_tokens, model and chat history
+# (with its summary, for server-side conversations)
+def answer_request_key(question, context, max_tokens, model):
+    parts = {
+        'question': normalize_question(question),
+        'persona': [context.get(field) for field in PERSONA_FIELDS],
+        'max_tokens': max_tokens,
+        'model': model,
+        'chat_history': context.get('chat_history') or [],
+    }
+    # Only when set, so keys of answers saved before summaries existed still match
+    if context.get('chat_summary'):
+        parts['chat_summary'] = context['chat_summary']
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Cache key for an upstream answer, or None when the answer should not be
+# cached. Answers that depend on chat_history are follow-ups in a specific
+# conversation, so they bypass the cache rather than being keyed on it.
+def answer_cache_key(question, context, max_tokens, model):
+    if context.get('chat_history') or context.get('chat_summary'):
+        return None
+    return answer_request_key(question, context, max_tokens, model)
+
+
+# Size-bounded LRU cache with a per-entry TTL for upstream answers.
+# Expiry uses wall-clock time so entries saved to disk stay valid across
+# restarts. When a path is given the cache is loaded from it on start-up and
+# written back (atomically, at most every save_interval seconds) after puts.
+class AnswerCache:
+    def __init__(self, max_entries=1000, ttl=86400, path=None, save_interval=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Whether an unexpired answer is stored under key, without counting a
+    # lookup or refreshing its place in the LRU order
+    def __contains__(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            return item is not None and item[0] > time.time()
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if key is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+        if self.path and time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error('Error loading answer cache from %s: %s', self.path, e)
+            return
+        now = time.time()
+        # Saved oldest-first, so the most recently used entries survive the size bound
+        for key, expires_at, value in saved[-self.max_entries:] if self.max_entries > 0 else []:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+        logger.info('Loaded %s cached answers from %s', len(self._entries), self.path)
+
+    # Write the cache to disk via a temporary file and rename, so a crash
+    # mid-write never leaves a truncated cache file behind
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            saved = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items() if expires_at > now]
+            self._dirty = False
+            self._last_save = now
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error('Error saving answer cache to %s: %s', self.path, e)
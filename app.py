@@ -1,99 +1,368 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
+import hashlib
 import json
 import os
+import re
+import time
+import uuid
 import logging
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
-import uuid
 from dotenv import load_dotenv
-import requests
+from qa_store import QAStore
+from qa_storage import backend_from_env
+from qa_bulk import BulkRowError, iter_bulk_rows, prepare_row
+from media_catalog import MediaCatalog
+from media_delivery import IMMUTABLE, fingerprint, send_media
+from media_jobs import DerivativeJobs
+from chunked_upload import CHUNK_SIZE as UPLOAD_CHUNK_SIZE, ChunkedUploads, UploadError, valid_sha256
+from responses import BadRequest, listing_args, page_info, select_fields, versioned_json
+from answer_cache import PERSONA_FIELDS, AnswerCache, answer_cache_key, answer_request_key
+from upstream import PerplexityClient
+from singleflight import SingleFlight
+from metrics import Registry
+from logging_setup import configure_logging, elapsed_ms, request_id_var
+from compression import Compressor
+from conversations import ConversationStore
+from resilience import CircuitBreaker, CircuitOpenError, UpstreamGuard
+from hot_questions import HotQuestions, PrecomputeJob
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
+# Queue handler of the logging pipeline, set up by create_app()
+log_handler = None
+# extra= for info lines that may be sampled away
+SAMPLED = {'sample': True}
 
 # File to store questions and answers
 DATA_FILE = 'qa_data.json'
+# Model used for answers that are not in the custom Q&A
+PERPLEXITY_MODEL = 'mistral-7b-instruct'
 # Directories for uploaded videos and images
 VIDEO_UPLOAD_FOLDER = 'static/uploads/videos'
 IMAGE_UPLOAD_FOLDER = 'static/uploads/images'
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'webm', 'ogg'}
 ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
 
-# Ensure upload folders exist
-for folder in [VIDEO_UPLOAD_FOLDER, IMAGE_UPLOAD_FOLDER]:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
-
 app.config['VIDEO_UPLOAD_FOLDER'] = VIDEO_UPLOAD_FOLDER
 app.config['IMAGE_UPLOAD_FOLDER'] = IMAGE_UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # Limit uploads to 100MB
+# Minimum confidence (0-1) for a fuzzy custom Q&A match to be used instead of the API
+app.config['QA_MATCH_THRESHOLD'] = float(os.getenv('QA_MATCH_THRESHOLD', '0.7'))
+
+# Prometheus metrics served at /metrics (see metrics.py). Each process writes
+# its values to METRICS_DIR and a scrape adds up all of them, so every
+# gunicorn worker of one deployment must share the same directory.
+metrics = Registry(os.getenv('METRICS_DIR'))
+REQUEST_LATENCY = metrics.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route, method and status',
+    ('route', 'method', 'status'))
+ANSWERS = metrics.counter(
+    'answers_total', 'Answers by endpoint and source (custom, cache, perplexity, fallback or error)',
+    ('endpoint', 'source'))
+UPSTREAM_LATENCY = metrics.histogram(
+    'upstream_request_duration_seconds',
+    'Perplexity API call duration, by mode (ask or stream) and outcome (ok, error or rejected by the breaker)',
+    ('mode', 'outcome'))
+BREAKER_TRANSITIONS = metrics.counter(
+    'upstream_breaker_transitions_total', 'Upstream circuit breaker state changes, by new state', ('state',))
+BREAKER_REJECTIONS = metrics.counter(
+    'upstream_breaker_rejections_total', 'Perplexity API calls not made because the circuit breaker was open')
+UPSTREAM_HEDGES = metrics.counter(
+    'upstream_hedged_requests_total', 'Hedged Perplexity API calls, by whether the hedge won', ('outcome',))
+PRECOMPUTED_ANSWERS = metrics.counter(
+    'precomputed_answers_total', 'Answers fetched ahead of time for frequently missed questions')
+PERSIST_LATENCY = metrics.histogram(
+    'qa_persist_duration_seconds', 'Time to write Q&A changes to storage, by operation', ('operation',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+UPLOAD_BYTES = metrics.counter('upload_bytes_total', 'Bytes received by media uploads, by method', ('method',))
+
+# Entry points that import `app` without calling create_app() (e.g.
+# `gunicorn app:app`) are set up on their first request
+@app.before_request
+def ensure_app_initialized():
+    if not app_initialized:
+        create_app()
+
+# A client-supplied X-Request-ID is reused when it looks like an ID
+REQUEST_ID_PATTERN = re.compile(r'^[\w.:-]{1,128}$')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method,
+                                status=response.status_code)
+        logger.info('%s %s %s', request.method, request.path, response.status_code,
+                    extra={**SAMPLED, 'duration_ms': elapsed_ms(start), 'route': route})
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
+
+# gzip/brotli for HTML, CSS and JSON responses of at least COMPRESS_MIN_SIZE
+# bytes (see compression.py); compressed bodies of responses with an ETag are
+# cached up to COMPRESS_CACHE_BYTES
+compressor = Compressor(int(os.getenv('COMPRESS_MIN_SIZE', '1024')),
+                        int(os.getenv('COMPRESS_CACHE_BYTES', str(8 * 1024 * 1024))))
+app.after_request(compressor.after_request)
 
 # Check if file extension is allowed
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-# Load existing Q&A data and assign IDs to entries without them
+
+# Media delivery (see media_delivery.py): files under MEDIA_ROOT are served
+# from /media/<fingerprint>/<path> with immutable caching and Range support.
+# MEDIA_OFFLOAD hands the body to the front server: "x-accel" for nginx
+# (MEDIA_ACCEL_PREFIX is the internal location mapped to MEDIA_ROOT) or
+# "x-sendfile" for Apache/lighttpd.
+app.config['MEDIA_ROOT'] = app.static_folder
+app.config['MEDIA_OFFLOAD'] = os.getenv('MEDIA_OFFLOAD') or None
+app.config['MEDIA_ACCEL_PREFIX'] = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media')
+
+# Fingerprinted URL of a file under MEDIA_ROOT, e.g. asset_url('images/logo.png')
+@app.template_global()
+def asset_url(filename):
+    path = os.path.join(app.config['MEDIA_ROOT'], filename)
+    if not os.path.isfile(path):
+        return f"/static/{filename}"
+    return f"/media/{fingerprint(path)}/{filename}"
+
+# Catalog of uploaded media (stored name, size, MIME type, upload time and a
+# stable display number), so uploads and listings never scan the folders
+MEDIA_CATALOG_DB = os.getenv('MEDIA_CATALOG_DB', 'media_catalog.db')
+video_catalog = MediaCatalog(MEDIA_CATALOG_DB, 'video', VIDEO_UPLOAD_FOLDER, ALLOWED_VIDEO_EXTENSIONS)
+image_catalog = MediaCatalog(MEDIA_CATALOG_DB, 'image', IMAGE_UPLOAD_FOLDER, ALLOWED_IMAGE_EXTENSIONS)
+
+# Thumbnails, responsive widths and the header animation are produced in a
+# background process pool (see media_jobs.py) with job state shared through
+# the catalog database
+DERIVATIVES_FOLDER = 'static/uploads/derivatives'
+HEADER_ANIMATION = 'images/your-gif.gif'
+derivative_jobs = DerivativeJobs(MEDIA_CATALOG_DB, int(os.getenv('MEDIA_JOB_WORKERS', '1')))
+
+# Queue thumbnails and responsive widths for a catalogued image
+def queue_image_derivatives(catalog, item):
+    if not derivative_jobs.available or item['derivatives']:
+        return False
+    stored_name = item['stored_name']
+    return derivative_jobs.submit(
+        'image', stored_name,
+        (os.path.join(catalog.folder, stored_name), DERIVATIVES_FOLDER, os.path.splitext(stored_name)[0]),
+        on_done=lambda derivatives: catalog.set_derivatives(stored_name, derivatives))
+
+# Queue the animated WebP/MP4 version of the header GIF once per process;
+# the job key includes the GIF's fingerprint so a new GIF is converted again
+header_animation_queued = False
+
+def queue_header_animation():
+    global header_animation_queued
+    if header_animation_queued or not derivative_jobs.available:
+        return
+    header_animation_queued = True
+    source = os.path.join(app.static_folder, HEADER_ANIMATION)
+    if os.path.exists(source):
+        derivative_jobs.submit(
+            'animation', f"{HEADER_ANIMATION}@{fingerprint(source)}",
+            (source, os.path.join(os.path.dirname(source), 'derived'),
+             os.path.splitext(os.path.basename(source))[0]))
+
+# Remove the derivative files of an image that is being deleted
+def remove_derivatives(item):
+    derivatives = item['derivatives'] or {}
+    for variant in [derivatives.get('thumbnail')] + derivatives.get('widths', []):
+        for name in (variant or {}).get('webp'), (variant or {}).get('jpeg'):
+            if name and os.path.exists(os.path.join(DERIVATIVES_FOLDER, name)):
+                os.remove(os.path.join(DERIVATIVES_FOLDER, name))
+    derivative_jobs.forget('image', item['stored_name'])
+
+@app.template_global()
+def asset_exists(filename):
+    return os.path.isfile(os.path.join(app.config['MEDIA_ROOT'], filename))
+
+# Resumable chunked uploads (see chunked_upload.py). Partial files live
+# outside static/ so they are never served; keep the folder on the same
+# filesystem as the upload folders so finished files are moved, not copied.
+UPLOAD_TMP_FOLDER = os.getenv('UPLOAD_TMP_FOLDER', 'upload_parts')
+chunked_uploads = ChunkedUploads(UPLOAD_TMP_FOLDER, app.config['MAX_CONTENT_LENGTH'])
+
+# Catalog, display label, URL folder and allowed extensions of a media kind
+def media_kind(kind):
+    if kind == 'video':
+        return video_catalog, 'Video', VIDEO_UPLOAD_FOLDER, ALLOWED_VIDEO_EXTENSIONS
+    if kind == 'image':
+        return image_catalog, 'Image', IMAGE_UPLOAD_FOLDER, ALLOWED_IMAGE_EXTENSIONS
+    raise UploadError(f"Unknown media kind: {kind}")
+
+# Hash a single-request upload while writing it and store it by content;
+# returns (item, duplicate)
+def save_upload(catalog, file):
+    path, sha256 = chunked_uploads.receive(file.stream)
+    UPLOAD_BYTES.inc(os.path.getsize(path), method='multipart')
+    return catalog.adopt(path, secure_filename(file.filename), sha256)
+
+# Success response for a stored upload. Content that was already uploaded
+# returns the existing file with duplicate set.
+def upload_response(item, label, folder, duplicate):
+    return {
+        'status': 'success',
+        'message': f"{label} already uploaded" if duplicate else f"{label} uploaded successfully",
+        'filename': item['stored_name'],
+        'url': media_url(item, folder),
+        'display_name': f"{label} {item['number']}",
+        'duplicate': duplicate,
+    }
+
+def upload_error(e):
+    body = {'status': 'error', 'message': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+# URL of a catalogued media file; content-addressed files get a fingerprinted
+# URL that can be cached forever
+def media_url(item, folder):
+    if not item['sha256']:
+        return f"/{folder}/{item['stored_name']}"
+    relative = os.path.relpath(os.path.join(folder, item['stored_name']), 'static').replace(os.sep, '/')
+    return f"/media/{item['sha256'][:16]}/{relative}"
+
+# Derivative URLs of an image: a thumbnail and srcset strings of the
+# responsive widths, in WebP and JPEG; None until the job has finished
+def derivative_urls(item):
+    derivatives = item['derivatives']
+    if not derivatives:
+        return None
+
+    def url(name):
+        return media_url({'sha256': item['sha256'], 'stored_name': name}, DERIVATIVES_FOLDER)
+
+    thumbnail = derivatives['thumbnail']
+    return {
+        'thumbnail': {'webp': url(thumbnail['webp']), 'jpeg': url(thumbnail['jpeg']),
+                      'width': thumbnail['width'], 'height': thumbnail['height']},
+        'srcset': {fmt: ', '.join(f"{url(w[fmt])} {w['width']}w" for w in derivatives['widths'])
+                   for fmt in ('webp', 'jpeg')},
+    }
+
+# Listing entry for a catalogued media file
+def media_listing_item(item, label, folder):
+    return {
+        'id': item['stored_name'],
+        'display_name': f"{label} {item['number']}",
+        'url': media_url(item, folder),
+        'size': item['size'],
+        'mime_type': item['mime_type'],
+        'uploaded_at': item['uploaded_at'],
+        'original_name': item['original_name'],
+        'sha256': item['sha256'],
+    }
+
+# Q&A data lives in a process-resident store that only reloads when the
+# storage changes. QA_STORAGE selects the backend: "json" (DATA_FILE, the
+# default) or "sqlite" (QA_DB_FILE, migrated from DATA_FILE on first start).
+qa_store = QAStore(backend=backend_from_env(DATA_FILE),
+                   persist_timer=lambda operation: PERSIST_LATENCY.time(operation=operation))
+
+# Load existing Q&A data (IDs are assigned to entries missing them)
 def load_qa_data():
     try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-            # Assign IDs to entries missing them
-            modified = False
-            for qa in data:
-                if 'id' not in qa:
-                    qa['id'] = str(uuid.uuid4())
-                    modified = True
-            # Save updated data if IDs were added
-            if modified:
-                try:
-                    with open(DATA_FILE, 'w') as f:
-                        json.dump(data, f, indent=2)
-                    logger.info("Assigned IDs to Q&A entries and saved updated qa_data.json")
-                except Exception as e:
-                    logger.error(f"Error saving updated Q&A data with IDs: {str(e)}")
-            logger.debug(f"Loaded Q&A data: {data}")
-            return data
-        logger.debug("No Q&A file found, returning empty list")
-        return []
+        return qa_store.all()
     except Exception as e:
-        logger.error(f"Error loading Q&A data: {str(e)}")
+        logger.error('Error loading Q&A data: %s', e)
         return []
 
 # Save Q&A data
 def save_qa_data(data):
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-        logger.debug(f"Saved Q&A data: {data}")
+        qa_store.replace(data)
+        logger.debug('Saved %s Q&A entries', len(data))
     except Exception as e:
-        logger.error(f"Error saving Q&A data: {str(e)}")
+        logger.error('Error saving Q&A data: %s', e)
 
-@app.route('/')
-def index():
+# Cache of upstream answers. Set ANSWER_CACHE_FILE to keep it across restarts.
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv('ANSWER_CACHE_SIZE', '1000')),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', '86400')),
+    path=os.getenv('ANSWER_CACHE_FILE') or None,
+)
+atexit.register(answer_cache.save)
+
+# Pooled, keep-alive client for the Perplexity API (PERPLEXITY_BASE_URL
+# points it somewhere else, e.g. a local stub)
+upstream_client = PerplexityClient(model=PERPLEXITY_MODEL)
+
+# Concurrent identical questions share one upstream call. Callers waiting on
+# someone else's call give up after UPSTREAM_COALESCE_TIMEOUT seconds.
+upstream_calls = SingleFlight()
+app.config['UPSTREAM_COALESCE_TIMEOUT'] = float(os.getenv('UPSTREAM_COALESCE_TIMEOUT', '30'))
+
+def record_guard_event(event, value):
+    if event == 'state':
+        BREAKER_TRANSITIONS.inc(state=value)
+    elif event == 'rejected':
+        BREAKER_REJECTIONS.inc()
+    elif event == 'hedge':
+        UPSTREAM_HEDGES.inc(outcome=value)
+
+# Circuit breaker and hedging around API calls (see resilience.py): after
+# UPSTREAM_BREAKER_FAILURES failures in a row calls fail at once for
+# UPSTREAM_BREAKER_RESET seconds, and a call still running after the
+# UPSTREAM_HEDGE_PERCENTILE of recent durations gets a second, hedged call
+# (for at most UPSTREAM_HEDGE_MAX_RATIO of calls). State is at /upstream_status.
+upstream_guard = UpstreamGuard(
+    breaker=CircuitBreaker(int(os.getenv('UPSTREAM_BREAKER_FAILURES', '5')),
+                           float(os.getenv('UPSTREAM_BREAKER_RESET', '30')), listener=record_guard_event),
+    hedge_percentile=float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', '95')),
+    hedge_max_ratio=float(os.getenv('UPSTREAM_HEDGE_MAX_RATIO', '0.1')),
+    listener=record_guard_event,
+)
+# Lowest custom Q&A match score used as a fallback answer when the API fails.
+# Unrelated questions sharing a few words ("where is the library" and "where
+# is the cafeteria") score up to about 0.55, so the default stays above that.
+app.config['FALLBACK_MIN_CONFIDENCE'] = float(os.getenv('FALLBACK_MIN_CONFIDENCE', '0.6'))
+
+# Ask the upstream API, sharing the call with identical in-flight requests
+def ask_upstream(question, context, max_tokens):
+    key = answer_request_key(question, context, max_tokens, upstream_client.model)
+    return upstream_calls.do(
+        key,
+        lambda: timed_upstream_ask(question, context, max_tokens),
+        timeout=app.config['UPSTREAM_COALESCE_TIMEOUT'],
+    )
+
+# One API call, with its duration and outcome recorded
+def timed_upstream_ask(question, context, max_tokens):
+    start = time.perf_counter()
+    outcome = 'error'
     try:
-        logger.info("Attempting to render index.html")
-        templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
-        index_file = os.path.join(templates_dir, 'index.html')
-        logger.info(f"Templates directory: {templates_dir}")
-        logger.info(f"Templates directory exists: {os.path.exists(templates_dir)}")
-        logger.info(f"Index file exists: {os.path.exists(index_file)}")
-        
-        if os.path.exists(index_file):
-            return render_template('index.html')
-        else:
-            return """
+        answer = upstream_guard.call(lambda: upstream_client.ask(question, context, max_tokens))
+        outcome = 'ok'
+        return answer
+    except CircuitOpenError:
+        outcome = 'rejected'
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, mode='ask', outcome=outcome)
+
+# The index template is looked up once at startup rather than on every view
+INDEX_FILE = os.path.join(os.path.dirname(__file__), 'templates', 'index.html')
+INDEX_FILE_EXISTS = os.path.exists(INDEX_FILE)
+
+# Served when templates/index.html is missing
+FALLBACK_INDEX_HTML = """
             <!DOCTYPE html>
             <html lang="en">
             <head>
@@ -158,17 +427,51 @@ def index():
                             headerGif.classList.remove('listening');
                             
                             try {
-                                const res = await fetch('/get_answer', {
+                                // Stream the answer and speak each sentence as soon as it is complete
+                                const res = await fetch('/get_answer_stream', {
                                     method: 'POST',
                                     headers: { 'Content-Type': 'application/json' },
                                     body: JSON.stringify({ question })
                                 });
-                                const data = await res.json();
-                                response.textContent = `Answer: ${data.answer}`;
-                                
-                                const utterance = new SpeechSynthesisUtterance(data.answer);
-                                utterance.lang = 'en-US';
-                                window.speechSynthesis.speak(utterance);
+                                const reader = res.body.getReader();
+                                const decoder = new TextDecoder();
+                                let buffer = '';
+                                let pending = '';
+                                let shown = '';
+                                let spoken = false;
+                                const speak = (text) => {
+                                    if (!text.trim()) return;
+                                    const utterance = new SpeechSynthesisUtterance(text.trim());
+                                    utterance.lang = 'en-US';
+                                    window.speechSynthesis.speak(utterance);
+                                };
+                                while (true) {
+                                    const { value, done } = await reader.read();
+                                    if (done) break;
+                                    buffer += decoder.decode(value, { stream: true });
+                                    let boundary;
+                                    while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                                        const block = buffer.slice(0, boundary);
+                                        buffer = buffer.slice(boundary + 2);
+                                        const eventName = (block.match(/^event: (.*)$/m) || [])[1];
+                                        const data = JSON.parse((block.match(/^data: (.*)$/m) || [])[1] || '{}');
+                                        if (eventName === 'delta') {
+                                            shown += data.text;
+                                            pending += data.text;
+                                            response.textContent = `Answer: ${shown}`;
+                                            let match;
+                                            while ((match = pending.match(/[.!?]+\\s+/))) {
+                                                const end = match.index + match[0].length;
+                                                speak(pending.slice(0, end));
+                                                pending = pending.slice(end);
+                                                spoken = true;
+                                            }
+                                        } else {
+                                            response.textContent = `Answer: ${data.answer}`;
+                                            speak(spoken ? pending : data.answer);
+                                        }
+                                    }
+                                }
                             } catch (error) {
                                 response.textContent = 'Error getting answer. Please try again.';
                             }
@@ -193,31 +496,88 @@ def index():
             </body>
             </html>
             """
+
+# The landing page is rendered once (at warm-up, or by the first view) and
+# served from memory with an ETag. It is re-rendered at most every INDEX_REFRESH seconds so that
+# asset fingerprints and the header animation's WebP, written later by a
+# background job, are picked up without a restart.
+INDEX_REFRESH = 30
+index_page = None
+
+# (rendered_at, body, etag) of a fresh rendering of the landing page
+def render_index_page():
+    with app.app_context():
+        html = render_template('index.html') if INDEX_FILE_EXISTS else FALLBACK_INDEX_HTML
+    body = html.encode('utf-8')
+    return time.monotonic(), body, hashlib.sha1(body).hexdigest()
+
+def current_index_page():
+    global index_page
+    page = index_page
+    if page is None or time.monotonic() - page[0] > INDEX_REFRESH:
+        page = index_page = render_index_page()
+    return page
+
+@app.route('/')
+def index():
+    try:
+        if INDEX_FILE_EXISTS:
+            queue_header_animation()
+        _, body, etag = current_index_page()
+        headers = {'Cache-Control': 'no-cache'}
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(body, mimetype='text/html', headers=headers)
+        response.set_etag(etag)
+        return response
     except Exception as e:
-        logger.error(f"Error in index route: {str(e)}")
+        logger.error('Error in index route: %s', e)
         return f"Error: {str(e)}", 500
 
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Voice Q&A App is running'})
 
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({
+        'status': 'success',
+        'answer_cache': answer_cache.stats(),
+        'upstream_calls': upstream_calls.stats(),
+        'compression': compressor.stats(),
+        'conversations': conversations.stats(),
+    })
+
+@app.route('/upstream_status')
+def upstream_status():
+    return jsonify({'status': 'success', **upstream_guard.stats()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/media_jobs')
+def media_jobs_status():
+    return jsonify({'status': 'success', 'jobs': derivative_jobs.stats()})
+
 @app.route('/test')
 def test_page():
     try:
         logger.info("Rendering test.html")
         return render_template('test.html')
     except Exception as e:
-        logger.error(f"Error rendering test.html: {str(e)}")
+        logger.error('Error rendering test.html: %s', e)
         return f"Error: {str(e)}", 500
 
 @app.errorhandler(404)
 def not_found_error(error):
-    logger.warning(f"404 error: {request.url}")
+    logger.warning('404 error: %s', request.url)
     return jsonify({'error': 'Not found'}), 404
 
 @app.errorhandler(500)
 def internal_error(error):
-    logger.error(f"500 error: {str(error)}")
+    logger.error('500 error: %s', error)
     return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/add_qa', methods=['POST'])
@@ -230,25 +590,29 @@ def add_qa():
             logger.warning("Empty question or answer received")
             return jsonify({'status': 'error', 'message': 'Question and answer cannot be empty'}), 400
         
-        qa_data = load_qa_data()
-        qa_id = str(uuid.uuid4())
-        qa_data.append({'id': qa_id, 'question': question, 'answer': answer})
-        save_qa_data(qa_data)
+        qa = qa_store.add(question, answer)
         
-        logger.info(f"Added Q&A: {question} -> {answer} with ID: {qa_id}")
+        logger.info('Added Q&A: %s -> %s with ID: %s', question, answer, qa['id'])
         return jsonify({'status': 'success', 'message': 'Question and answer added successfully'})
     except Exception as e:
-        logger.error(f"Error in add_qa: {str(e)}")
+        logger.error('Error in add_qa: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/get_qas', methods=['GET'])
 def get_qas():
     try:
-        qa_data = load_qa_data()
-        logger.info(f"Retrieved {len(qa_data)} Q&A pairs")
-        return jsonify({'status': 'success', 'qas': qa_data})
+        limit, offset, fields = listing_args()
+        
+        def build():
+            qa_data, total = qa_store.page(offset, limit)
+            logger.info('Retrieved %s of %s Q&A pairs', len(qa_data), total, extra=SAMPLED)
+            return {'status': 'success', 'qas': select_fields(qa_data, fields), **page_info(total, limit, offset, len(qa_data))}
+        
+        return versioned_json(qa_store.data_version(), build)
+    except BadRequest as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error in get_qas: {str(e)}")
+        logger.error('Error in get_qas: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/update_qa/<qa_id>', methods=['PUT'])
@@ -262,104 +626,480 @@ def update_qa(qa_id):
             logger.warning("Empty question or answer in update request")
             return jsonify({'status': 'error', 'message': 'Question and answer cannot be empty'}), 400
         
-        qa_data = load_qa_data()
-        qa_found = False
-        for qa in qa_data:
-            if qa['id'] == qa_id:
-                qa['question'] = new_question
-                qa['answer'] = new_answer
-                qa_found = True
-                break
-        
-        if not qa_found:
-            logger.warning(f"Q&A not found for ID: {qa_id}")
+        if qa_store.update(qa_id, new_question, new_answer) is None:
+            logger.warning('Q&A not found for ID: %s', qa_id)
             return jsonify({'status': 'error', 'message': 'Q&A not found'}), 404
         
-        save_qa_data(qa_data)
-        logger.info(f"Updated Q&A with ID: {qa_id}")
+        logger.info('Updated Q&A with ID: %s', qa_id)
         return jsonify({'status': 'success', 'message': 'Q&A updated successfully'})
     except Exception as e:
-        logger.error(f"Error in update_qa: {str(e)}")
+        logger.error('Error in update_qa: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/delete_qa/<qa_id>', methods=['DELETE'])
 def delete_qa(qa_id):
     try:
-        qa_data = load_qa_data()
-        initial_length = len(qa_data)
-        qa_data = [qa for qa in qa_data if qa['id'] != qa_id]
-        
-        if len(qa_data) == initial_length:
-            logger.warning(f"Q&A not found for ID: {qa_id}")
+        if not qa_store.delete(qa_id):
+            logger.warning('Q&A not found for ID: %s', qa_id)
             return jsonify({'status': 'error', 'message': 'Q&A not found'}), 404
         
-        save_qa_data(qa_data)
-        logger.info(f"Deleted Q&A with ID: {qa_id}")
+        logger.info('Deleted Q&A with ID: %s', qa_id)
         return jsonify({'status': 'success', 'message': 'Q&A deleted successfully'})
     except Exception as e:
-        logger.error(f"Error in delete_qa: {str(e)}")
+        logger.error('Error in delete_qa: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# Apply many Q&A inserts/upserts/deletes in one go. The body is either NDJSON
+# (Content-Type: application/x-ndjson) or a JSON array of rows like
+# {"op": "insert" | "upsert" | "delete", "id": ..., "question": ..., "answer": ...}.
+# Rows are parsed as they stream in, applied in a single transaction, and
+# rows that could not be applied are reported with their row number.
+@app.route('/bulk_qa', methods=['POST'])
+def bulk_qa():
+    try:
+        changes = []
+        errors = []
+        for row_number, row in iter_bulk_rows(request.stream, request.content_type):
+            try:
+                if isinstance(row, BulkRowError):
+                    raise row
+                op, data = prepare_row(row)
+                changes.append((row_number, op, data))
+            except BulkRowError as e:
+                errors.append((row_number, str(e)))
+        
+        counts, apply_errors = qa_store.bulk(changes)
+        errors = sorted(errors + apply_errors)
+        
+        logger.info('Bulk Q&A: %s inserted, %s updated, %s deleted, %s errors',
+                    counts['inserted'], counts['updated'], counts['deleted'], len(errors))
+        return jsonify({
+            'status': 'partial' if errors else 'success',
+            **counts,
+            'errors': [{'row': row_number, 'message': message} for row_number, message in errors],
+        })
+    except Exception as e:
+        logger.error('Error in bulk_qa: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# Stream all Q&A pairs out as NDJSON (default) or, with ?format=json, as a
+# JSON array; rows are serialized one at a time as the response is sent
+@app.route('/export_qa', methods=['GET'])
+def export_qa():
+    try:
+        entries = qa_store.all()
+        if request.args.get('format') == 'json':
+            def generate():
+                yield '['
+                for i, qa in enumerate(entries):
+                    yield (',\n  ' if i else '\n  ') + json.dumps(qa)
+                yield '\n]\n'
+            mimetype, filename = 'application/json', 'qa_data.json'
+        else:
+            def generate():
+                for qa in entries:
+                    yield json.dumps(qa) + '\n'
+            mimetype, filename = 'application/x-ndjson', 'qa_data.ndjson'
+        logger.info('Exporting %s Q&A pairs', len(entries))
+        return Response(generate(), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    except Exception as e:
+        logger.error('Error in export_qa: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# Answers sent when no answer could be produced
+NO_API_KEY_ANSWER = 'Error: Perplexity API key not configured.'
+UPSTREAM_FAILED_ANSWER = 'Sorry, I couldn\'t fetch an answer from the API.'
+REQUEST_FAILED_ANSWER = 'An error occurred while processing your request.'
+
+# Server-side conversations (see conversations.py): bodies that carry a
+# "session_id" have their history kept here and get a token-budgeted window
+# of it as chat_history, so requests and prompts stay the same size however
+# long the conversation gets. Sessions live in the worker's memory.
+conversations = ConversationStore(
+    max_sessions=int(os.getenv('CONVERSATION_MAX_SESSIONS', '10000')),
+    idle_ttl=float(os.getenv('CONVERSATION_IDLE_TTL', '1800')),
+    history_tokens=int(os.getenv('CONVERSATION_HISTORY_TOKENS', '400')),
+)
+
+# max_tokens of an answer request: a positive integer, 15 when not given
+def max_tokens_field(data):
+    max_tokens = data.get('max_tokens', 15)
+    if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens <= 0:
+        raise BadRequest('max_tokens must be a positive integer')
+    return max_tokens
+
+# Question, context and max_tokens of a get_answer style JSON body
+def question_fields(data):
+    question = data.get('question', '').lower().strip()
+    context = data.get('context', {})
+    return question, context, max_tokens_field(data)
+
+# Session ID of a get_answer style body and the context to answer it with.
+# With "session_id" the stored history replaces the client's chat_history;
+# an empty or invalid ID starts a new session. Without it the body keeps
+# sending its own chat_history and the session ID is None.
+def conversation_context(data, context):
+    if 'session_id' not in data:
+        return None, context
+    session_id = data['session_id']
+    if not isinstance(session_id, str) or not REQUEST_ID_PATTERN.match(session_id):
+        session_id = conversations.new_id()
+    history, summary = conversations.window(session_id)
+    context = {key: value for key, value in context.items() if key not in ('chat_history', 'chat_summary')}
+    context['chat_history'] = history
+    if summary:
+        context['chat_summary'] = summary
+    return session_id, context
+
+# Response body with the session ID added, for clients using sessions
+def with_session(result, session_id):
+    return {**result, 'session_id': session_id} if session_id else result
+
+# Store an answered question in its session; returns the response body
+def record_turn(session_id, question, result):
+    if session_id:
+        conversations.append(session_id, question, result['answer'])
+    return with_session(result, session_id)
+
+def parse_question_request():
+    data = request.json
+    question, context, max_tokens = question_fields(data)
+    session_id, context = conversation_context(data, context)
+    return question, context, max_tokens, session_id
+
+# Store the API's answer to a frequently missed question in the answer
+# cache, unless it is already cached or now matches a custom Q&A entry.
+# Returns whether an answer was stored.
+def precompute_answer(question, context, max_tokens):
+    cache_key = answer_cache_key(question, context, max_tokens, upstream_client.model)
+    if cache_key in answer_cache or not upstream_client.api_key:
+        return False
+    if qa_store.match(question, app.config['QA_MATCH_THRESHOLD'])[0] is not None:
+        return False
+    answer_cache.put(cache_key, ask_upstream(question, context, max_tokens))
+    PRECOMPUTED_ANSWERS.inc()
+    logger.info("Precomputed answer for hot question '%s'", question)
+    return True
+
+# Most asked questions, split by custom Q&A hit or miss, in bounded memory
+# (HOT_QUESTIONS_CAPACITY per kind; see hot_questions.py), listed at
+# /hot_questions. With PRECOMPUTE_INTERVAL set, every that many seconds
+# the PRECOMPUTE_TOP most asked misses (asked at least PRECOMPUTE_MIN_COUNT
+# times) are answered ahead of time into the answer cache, so they become
+# cache hits. Counts and the job are per worker.
+hot_questions = HotQuestions(int(os.getenv('HOT_QUESTIONS_CAPACITY', '1000')))
+precompute_job = PrecomputeJob(
+    hot_questions, precompute_answer,
+    interval=float(os.getenv('PRECOMPUTE_INTERVAL', '0')),
+    top_n=int(os.getenv('PRECOMPUTE_TOP', '20')),
+    min_count=int(os.getenv('PRECOMPUTE_MIN_COUNT', '3')),
+)
+
+# Count a question for /hot_questions. Misses that can be cached keep the
+# persona and max_tokens they were asked with, for precomputing.
+def record_question(question, hit, context, max_tokens, cache_key):
+    request = None
+    if not hit and cache_key is not None:
+        persona = {field: context[field] for field in PERSONA_FIELDS if field in context}
+        request = (question, persona, max_tokens)
+    hot_questions.record(question, hit, request)
+    precompute_job.ensure_running()
+
+# Answer from custom Q&A or the answer cache without calling the API.
+# Returns the response body (None on a miss) and the answer cache key.
+def local_answer(question, context, max_tokens):
+    # Check custom Q&A: normalized exact match first, then fuzzy match
+    qa, score = qa_store.match(question, app.config['QA_MATCH_THRESHOLD'])
+    if qa is not None:
+        logger.info("Found answer for question in custom Q&A: %s (matched '%s', score %.2f)",
+                    question, qa['question'], score, extra=SAMPLED)
+        record_question(question, True, context, max_tokens, None)
+        return {'answer': qa['answer'], 'source': 'custom', 'score': round(score, 3)}, None
+    
+    # Repeated questions with the same persona are served from the answer cache
+    cache_key = answer_cache_key(question, context, max_tokens, upstream_client.model)
+    record_question(question, False, context, max_tokens, cache_key)
+    cached_answer = answer_cache.get(cache_key)
+    if cached_answer is not None:
+        logger.info('Found answer for question in answer cache: %s', question, extra=SAMPLED)
+        return {'answer': cached_answer, 'source': 'cache'}, cache_key
+    return None, cache_key
+
+# Answer to give when the API cannot answer (failed, or the circuit breaker
+# is open): the cached answer to the same question asked without
+# conversation history, else the closest custom Q&A entry scoring at least
+# FALLBACK_MIN_CONFIDENCE. Both are marked low_confidence, since neither
+# answers the question as asked. None when there is neither.
+def fallback_answer(question, context, max_tokens):
+    if context.get('chat_history') or context.get('chat_summary'):
+        plain = {key: value for key, value in context.items() if key not in ('chat_history', 'chat_summary')}
+        cached = answer_cache.get(answer_cache_key(question, plain, max_tokens, upstream_client.model))
+        if cached is not None:
+            logger.warning("Falling back to the answer cached without history for '%s'", question, extra=SAMPLED)
+            return {'answer': cached, 'source': 'fallback', 'fallback': 'cache', 'low_confidence': True}
+    qa, score = qa_store.match(question, app.config['FALLBACK_MIN_CONFIDENCE'])
+    if qa is not None:
+        logger.warning("Falling back to custom Q&A for '%s' (matched '%s', score %.2f)",
+                       question, qa['question'], score, extra=SAMPLED)
+        return {'answer': qa['answer'], 'source': 'fallback', 'fallback': 'custom', 'score': round(score, 3),
+                'low_confidence': True}
+    return None
+
 @app.route('/get_answer', methods=['POST'])
 def get_answer():
     try:
-        data = request.json
-        question = data.get('question', '').lower().strip()
-        context = data.get('context', {})
-        max_tokens = data.get('max_tokens', 15)
+        question, context, max_tokens, session_id = parse_question_request()
         
-        # Load custom Q&A data
-        qa_data = load_qa_data()
-        
-        # Check for exact match in custom Q&A
-        for qa in qa_data:
-            if qa['question'] == question:
-                logger.info(f"Found answer for question in custom Q&A: {question}")
-                return jsonify({'answer': qa['answer']})
+        result, cache_key = local_answer(question, context, max_tokens)
+        if result is not None:
+            ANSWERS.inc(endpoint='get_answer', source=result['source'])
+            return jsonify(record_turn(session_id, question, result))
         
         # If no match, query Perplexity API
-        api_key = os.getenv('PERPLEXITY_API_KEY')
-        if not api_key:
+        if not upstream_client.api_key:
+            logger.error("Perplexity API key not configured")
+            ANSWERS.inc(endpoint='get_answer', source='error')
+            return jsonify(with_session({'answer': NO_API_KEY_ANSWER}, session_id)), 500
+
+        try:
+            answer = ask_upstream(question, context, max_tokens)
+            logger.info("Perplexity API response for question '%s': %s", question, answer, extra=SAMPLED)
+            answer_cache.put(cache_key, answer)
+            ANSWERS.inc(endpoint='get_answer', source='perplexity')
+            return jsonify(record_turn(session_id, question, {'answer': answer, 'source': 'perplexity'}))
+        except Exception as e:
+            logger.error('Error with Perplexity API: %s', e)
+            fallback = fallback_answer(question, context, max_tokens)
+            if fallback is not None:
+                ANSWERS.inc(endpoint='get_answer', source='fallback')
+                return jsonify(record_turn(session_id, question, fallback))
+            ANSWERS.inc(endpoint='get_answer', source='error')
+            return jsonify(with_session({'answer': UPSTREAM_FAILED_ANSWER}, session_id))
+    except BadRequest as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error('Error in get_answer: %s', e)
+        ANSWERS.inc(endpoint='get_answer', source='error')
+        return jsonify({'answer': REQUEST_FAILED_ANSWER})
+
+# Format one server-sent event
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streaming variant of get_answer using server-sent events.
+# Custom Q&A and cache hits are sent as a single "answer" event; upstream
+# answers are relayed as "delta" events while they are generated, followed
+# by an "answer" event with the full text. When the API fails before
+# sending anything the fallback answer is sent as the "answer" event;
+# other failures send an "error" event with get_answer's apology text.
+# Streams are not hedged.
+@app.route('/get_answer_stream', methods=['POST'])
+def get_answer_stream():
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    try:
+        question, context, max_tokens, session_id = parse_question_request()
+        
+        result, cache_key = local_answer(question, context, max_tokens)
+        if result is not None:
+            ANSWERS.inc(endpoint='get_answer_stream', source=result['source'])
+            return Response(sse_event('answer', record_turn(session_id, question, result)),
+                            mimetype='text/event-stream', headers=headers)
+        
+        if not upstream_client.api_key:
             logger.error("Perplexity API key not configured")
-            return jsonify({'answer': 'Error: Perplexity API key not configured.'}), 500
+            ANSWERS.inc(endpoint='get_answer_stream', source='error')
+            return Response(sse_event('error', with_session({'answer': NO_API_KEY_ANSWER}, session_id)),
+                            mimetype='text/event-stream', headers=headers)
+    except BadRequest as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error('Error in get_answer_stream: %s', e)
+        ANSWERS.inc(endpoint='get_answer_stream', source='error')
+        return Response(sse_event('error', {'answer': REQUEST_FAILED_ANSWER}),
+                        mimetype='text/event-stream', headers=headers)
 
+    def generate():
+        parts = []
+        start = time.perf_counter()
         try:
-            response = requests.post(
-                'https://api.perplexity.ai/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json'
-                },
-                json={
-                    'model': 'mistral-7b-instruct',
-                    'messages': [
-                        {
-                            'role': 'system',
-                            'content': (
-                                f"You are {context.get('name', 'Teena')}, a {context.get('role', 'Personal AI robot')} "
-                                f"created by {context.get('creator', 'I Robotics')} in {context.get('location', 'Coimbatore')}. "
-                                f"Answer questions based on the following chat history: {json.dumps(context.get('chat_history', []))}. "
-                                f"Keep responses concise, up to {max_tokens} tokens."
-                            )
-                        },
-                        {
-                            'role': 'user',
-                            'content': question
-                        }
-                    ],
-                    'max_tokens': max_tokens
-                }
-            )
-            response.raise_for_status()
-            answer = response.json()['choices'][0]['message']['content']
-            logger.info(f"Perplexity API response for question '{question}': {answer}")
-            return jsonify({'answer': answer})
+            upstream_guard.stream_started()
+            for text in upstream_client.stream(question, context, max_tokens):
+                parts.append(text)
+                yield sse_event('delta', {'text': text})
+        except GeneratorExit:
+            upstream_guard.stream_cancelled()
+            raise
         except Exception as e:
-            logger.error(f"Error with Perplexity API: {str(e)}")
-            return jsonify({'answer': 'Sorry, I couldn\'t fetch an answer from the API.'})
+            logger.error('Error with Perplexity API stream: %s', e)
+            rejected = isinstance(e, CircuitOpenError)
+            if not rejected:
+                upstream_guard.stream_finished(e)
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, mode='stream',
+                                     outcome='rejected' if rejected else 'error')
+            fallback = None if parts else fallback_answer(question, context, max_tokens)
+            if fallback is not None:
+                ANSWERS.inc(endpoint='get_answer_stream', source='fallback')
+                yield sse_event('answer', record_turn(session_id, question, fallback))
+                return
+            ANSWERS.inc(endpoint='get_answer_stream', source='error')
+            yield sse_event('error', with_session({'answer': UPSTREAM_FAILED_ANSWER}, session_id))
+            return
+        upstream_guard.stream_finished()
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, mode='stream', outcome='ok')
+        answer = ''.join(parts)
+        logger.info("Perplexity API streamed response for question '%s': %s", question, answer, extra=SAMPLED)
+        answer_cache.put(cache_key, answer)
+        ANSWERS.inc(endpoint='get_answer_stream', source='perplexity')
+        yield sse_event('answer', record_turn(session_id, question, {'answer': answer, 'source': 'perplexity'}))
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+# Batch answers (/get_answers): at most BATCH_MAX_QUESTIONS questions per
+# request, of which up to BATCH_UPSTREAM_CONCURRENCY misses are asked at once
+app.config['BATCH_MAX_QUESTIONS'] = int(os.getenv('BATCH_MAX_QUESTIONS', '100'))
+app.config['BATCH_UPSTREAM_CONCURRENCY'] = int(os.getenv('BATCH_UPSTREAM_CONCURRENCY', '8'))
+
+# Questions, shared context and max_tokens of a /get_answers body
+def batch_fields(data):
+    if not isinstance(data, dict) or not isinstance(data.get('questions'), list):
+        raise BadRequest('questions must be a list')
+    questions = data['questions']
+    if not questions:
+        raise BadRequest('questions must not be empty')
+    if len(questions) > app.config['BATCH_MAX_QUESTIONS']:
+        raise BadRequest(f"At most {app.config['BATCH_MAX_QUESTIONS']} questions per batch")
+    if not all(isinstance(question, str) for question in questions):
+        raise BadRequest('questions must be strings')
+    context = data.get('context') or {}
+    if not isinstance(context, dict):
+        raise BadRequest('context must be an object')
+    if 'session_id' in data or context.get('chat_history'):
+        raise BadRequest('Batches are answered without chat history')
+    return [question.lower().strip() for question in questions], context, max_tokens_field(data)
+
+# First pass of a batch: answer everything the custom Q&A or the answer
+# cache can. Returns the items (None for misses) and the misses grouped by
+# upstream request, as {request key: (question, cache key, [positions])}.
+def batch_local_answers(questions, context, max_tokens):
+    items = [None] * len(questions)
+    misses = {}
+    for position, question in enumerate(questions):
+        start = time.perf_counter()
+        if not question:
+            items[position] = batch_item(question, {'answer': REQUEST_FAILED_ANSWER, 'source': 'error',
+                                                    'error': 'Empty question'}, elapsed_ms(start))
+            continue
+        result, cache_key = local_answer(question, context, max_tokens)
+        if result is not None:
+            items[position] = batch_item(question, result, elapsed_ms(start))
+            continue
+        key = answer_request_key(question, context, max_tokens, upstream_client.model)
+        misses.setdefault(key, (question, cache_key, []))[2].append(position)
+    return items, misses
+
+def batch_item(question, result, latency_ms):
+    ANSWERS.inc(endpoint='get_answers', source=result['source'])
+    return {'question': question, **result, 'latency_ms': latency_ms}
+
+# Item for a batch question sent upstream, caching a successful answer
+def batch_upstream_item(question, context, max_tokens, cache_key, answer, error, latency_ms):
+    if error is not None:
+        logger.error('Error with Perplexity API in batch: %s', error)
+        result = fallback_answer(question, context, max_tokens) or {'answer': UPSTREAM_FAILED_ANSWER,
+                                                                      'source': 'error'}
+        return batch_item(question, {**result, 'error': str(error)}, latency_ms)
+    answer_cache.put(cache_key, answer)
+    return batch_item(question, {'answer': answer, 'source': 'perplexity'}, latency_ms)
+
+# Answer many questions with one shared context. Custom Q&A and cached
+# answers are resolved first; the remaining distinct questions go to the
+# API concurrently. Items come back in order with their source and latency,
+# and a failed item does not fail the batch.
+@app.route('/get_answers', methods=['POST'])
+def get_answers():
+    try:
+        start = time.perf_counter()
+        questions, context, max_tokens = batch_fields(request.get_json(silent=True))
+        items, misses = batch_local_answers(questions, context, max_tokens)
+
+        request_id = g.request_id
+
+        # (answer, error, latency in ms from the start of the batch's API calls)
+        def ask(question, submitted):
+            # Log lines from the pool threads carry the batch's request ID
+            request_id_var.set(request_id)
+            try:
+                if not upstream_client.api_key:
+                    raise RuntimeError('Perplexity API key not configured')
+                return ask_upstream(question, context, max_tokens), None, elapsed_ms(submitted)
+            except Exception as e:
+                return None, e, elapsed_ms(submitted)
+
+        if misses:
+            workers = min(app.config['BATCH_UPSTREAM_CONCURRENCY'], len(misses))
+            submitted = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                calls = [(executor.submit(ask, question, submitted), cache_key, positions)
+                         for question, cache_key, positions in misses.values()]
+                for future, cache_key, positions in calls:
+                    answer, error, latency = future.result()
+                    for position in positions:
+                        items[position] = batch_upstream_item(questions[position], context, max_tokens,
+                                                              cache_key, answer, error, latency)
+
+        logger.info('Answered batch of %s questions (%s sent upstream) in %.1f ms',
+                    len(items), len(misses), elapsed_ms(start))
+        return jsonify({'status': 'success', 'answers': items, 'upstream_calls': len(misses),
+                        'latency_ms': elapsed_ms(start)})
+    except BadRequest as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error('Error in get_answers: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# Most asked questions, most frequent first: ?kind=miss (default, questions
+# the custom Q&A did not answer) or ?kind=hit, paged like the listings
+# (20 by default). Counts are upper bounds, at most `error` above the true
+# count.
+@app.route('/hot_questions', methods=['GET'])
+def list_hot_questions():
+    try:
+        kind = request.args.get('kind', 'miss')
+        if kind not in ('hit', 'miss'):
+            raise BadRequest('kind must be hit or miss')
+        limit, offset, fields = listing_args()
+        questions = hot_questions.top(kind, offset + (limit or 20))[offset:]
+        return jsonify({'status': 'success', 'kind': kind, 'questions': select_fields(questions, fields),
+                        **hot_questions.stats(), 'precompute': precompute_job.stats()})
+    except BadRequest as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error('Error in list_hot_questions: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# Precompute answers for the hottest misses now, whether or not the
+# background job is enabled
+@app.route('/hot_questions/precompute', methods=['POST'])
+def precompute_hot_questions():
+    try:
+        stored = precompute_job.run_once()
+        return jsonify({'status': 'success', 'precomputed': stored, 'precompute': precompute_job.stats()})
+    except Exception as e:
+        logger.error('Error in precompute_hot_questions: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# End a conversation session, e.g. when the kiosk returns to its idle screen
+@app.route('/conversations/<session_id>', methods=['DELETE'])
+def end_conversation(session_id):
+    try:
+        if not conversations.end(session_id):
+            return jsonify({'status': 'error', 'message': 'Session not found'}), 404
+        logger.info('Ended conversation session %s', session_id)
+        return jsonify({'status': 'success', 'message': 'Session ended'})
     except Exception as e:
-        logger.error(f"Error in get_answer: {str(e)}")
-        return jsonify({'answer': 'An error occurred while processing your request.'})
+        logger.error('Error in end_conversation: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/upload_video', methods=['POST'])
 def upload_video():
@@ -374,28 +1114,16 @@ def upload_video():
             return jsonify({'status': 'error', 'message': 'No selected file'}), 400
         
         if file and allowed_file(file.filename, ALLOWED_VIDEO_EXTENSIONS):
-            filename = secure_filename(file.filename)
-            base, ext = os.path.splitext(filename)
-            counter = 1
-            new_filename = filename
-            while os.path.exists(os.path.join(app.config['VIDEO_UPLOAD_FOLDER'], new_filename)):
-                new_filename = f"{base}_{counter}{ext}"
-                counter += 1
-            file.save(os.path.join(app.config['VIDEO_UPLOAD_FOLDER'], new_filename))
-            video_count = len([f for f in os.listdir(app.config['VIDEO_UPLOAD_FOLDER']) if allowed_file(f, ALLOWED_VIDEO_EXTENSIONS)])
-            logger.info(f"Video uploaded: {new_filename}, URL: /{VIDEO_UPLOAD_FOLDER}/{new_filename}")
-            return jsonify({
-                'status': 'success',
-                'message': 'Video uploaded successfully',
-                'filename': new_filename,
-                'url': f"/{VIDEO_UPLOAD_FOLDER}/{new_filename}",
-                'display_name': f"Video {video_count}"
-            })
+            item, duplicate = save_upload(video_catalog, file)
+            new_filename = item['stored_name']
+            logger.info('Video uploaded: %s, URL: /%s/%s, duplicate: %s',
+                        new_filename, VIDEO_UPLOAD_FOLDER, new_filename, duplicate)
+            return jsonify(upload_response(item, 'Video', VIDEO_UPLOAD_FOLDER, duplicate))
         else:
             logger.warning("Invalid file type")
             return jsonify({'status': 'error', 'message': 'Invalid file type. Only mp4, webm, and ogg are allowed.'}), 400
     except Exception as e:
-        logger.error(f"Error in upload_video: {str(e)}")
+        logger.error('Error in upload_video: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/upload_image', methods=['POST'])
@@ -411,83 +1139,238 @@ def upload_image():
             return jsonify({'status': 'error', 'message': 'No selected file'}), 400
         
         if file and allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS):
-            filename = secure_filename(file.filename)
-            base, ext = os.path.splitext(filename)
-            counter = 1
-            new_filename = filename
-            while os.path.exists(os.path.join(app.config['IMAGE_UPLOAD_FOLDER'], new_filename)):
-                new_filename = f"{base}_{counter}{ext}"
-                counter += 1
-            file.save(os.path.join(app.config['IMAGE_UPLOAD_FOLDER'], new_filename))
-            image_count = len([f for f in os.listdir(app.config['IMAGE_UPLOAD_FOLDER']) if allowed_file(f, ALLOWED_IMAGE_EXTENSIONS)])
-            logger.info(f"Image uploaded: {new_filename}, URL: /{IMAGE_UPLOAD_FOLDER}/{new_filename}")
-            return jsonify({
-                'status': 'success',
-                'message': 'Image uploaded successfully',
-                'filename': new_filename,
-                'url': f"/{IMAGE_UPLOAD_FOLDER}/{new_filename}",
-                'display_name': f"Image {image_count}"
-            })
+            item, duplicate = save_upload(image_catalog, file)
+            queue_image_derivatives(image_catalog, item)
+            new_filename = item['stored_name']
+            logger.info('Image uploaded: %s, URL: /%s/%s, duplicate: %s',
+                        new_filename, IMAGE_UPLOAD_FOLDER, new_filename, duplicate)
+            return jsonify(upload_response(item, 'Image', IMAGE_UPLOAD_FOLDER, duplicate))
         else:
             logger.warning("Invalid file type")
             return jsonify({'status': 'error', 'message': 'Invalid file type. Only jpg, jpeg, png, and gif are allowed.'}), 400
     except Exception as e:
-        logger.error(f"Error in upload_image: {str(e)}")
+        logger.error('Error in upload_image: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# Fingerprinted media. An outdated fingerprint still gets the current file,
+# just without the immutable caching.
+@app.route('/media/<fingerprint_value>/<path:filename>', methods=['GET'])
+def serve_media(fingerprint_value, filename):
+    try:
+        path = safe_join(app.config['MEDIA_ROOT'], filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({'status': 'error', 'message': 'File not found'}), 404
+        cache_control = IMMUTABLE if fingerprint_value == fingerprint(path) else 'no-cache'
+        accel_path = f"{app.config['MEDIA_ACCEL_PREFIX'].rstrip('/')}/{filename}"
+        return send_media(path, cache_control, app.config['MEDIA_OFFLOAD'], accel_path)
+    except Exception as e:
+        logger.error('Error in serve_media: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# Chunked upload protocol: POST /uploads starts an upload, PATCH appends a
+# chunk at the offset given in the Upload-Offset header, GET reports the
+# offset to resume from and POST /uploads/<id>/finalize catalogs the file.
+@app.route('/uploads', methods=['POST'])
+def start_upload():
+    try:
+        data = request.get_json(silent=True) or {}
+        catalog, label, folder, allowed_extensions = media_kind(data.get('kind'))
+        filename = secure_filename(str(data.get('filename', '')))
+        if not allowed_file(filename, allowed_extensions):
+            logger.warning("Invalid file type")
+            return jsonify({'status': 'error', 'message': 'Invalid file type'}), 400
+        sha256 = data.get('sha256')
+        # Content that is already stored needs no upload at all
+        if valid_sha256(sha256):
+            existing = catalog.find_by_hash(sha256)
+            if existing is not None:
+                logger.info('Upload of %s matches existing %s', filename, existing['stored_name'])
+                return jsonify({**upload_response(existing, label, folder, True), 'complete': True})
+        session = chunked_uploads.create(data['kind'], filename, data.get('size'), sha256)
+        logger.info('Upload %s started: %s, %s bytes', session['id'], filename, session['size'])
+        return jsonify({
+            'status': 'success',
+            'complete': False,
+            'upload_id': session['id'],
+            'offset': 0,
+            'size': session['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE
+        }), 201
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        logger.error('Error in start_upload: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    try:
+        session = chunked_uploads.status(upload_id)
+        return jsonify({'status': 'success', 'upload_id': upload_id, 'offset': session['offset'], 'size': session['size']})
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        logger.error('Error in upload_status: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    try:
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Upload-Offset header must be an integer'}), 400
+        new_offset = chunked_uploads.append(upload_id, offset, request.stream)
+        UPLOAD_BYTES.inc(new_offset - offset, method='chunked')
+        offset = new_offset
+        return jsonify({'status': 'success', 'upload_id': upload_id, 'offset': offset})
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        logger.error('Error in append_upload: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    try:
+        session, path, sha256 = chunked_uploads.finish(upload_id)
+        catalog, label, folder, _ = media_kind(session['kind'])
+        item, duplicate = catalog.adopt(path, session['filename'], sha256)
+        chunked_uploads.discard(upload_id)
+        if session['kind'] == 'image':
+            queue_image_derivatives(catalog, item)
+        logger.info('Upload %s finished as %s, duplicate: %s', upload_id, item['stored_name'], duplicate)
+        return jsonify({**upload_response(item, label, folder, duplicate), 'complete': True})
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        logger.error('Error in finalize_upload: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    try:
+        if chunked_uploads.discard(upload_id):
+            logger.info('Upload %s cancelled', upload_id)
+            return jsonify({'status': 'success', 'message': 'Upload cancelled'})
+        return jsonify({'status': 'error', 'message': 'Upload not found'}), 404
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        logger.error('Error in cancel_upload: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/get_videos', methods=['GET'])
 def get_videos():
     try:
-        video_files = [f for f in os.listdir(VIDEO_UPLOAD_FOLDER) if allowed_file(f, ALLOWED_VIDEO_EXTENSIONS)]
-        videos = [{'id': f, 'display_name': f"Video {i+1}", 'url': f"/{VIDEO_UPLOAD_FOLDER}/{f}"} for i, f in enumerate(video_files)]
-        logger.info(f"Retrieved {len(videos)} videos: {video_files}")
-        return jsonify({'status': 'success', 'videos': videos})
+        limit, offset, fields = listing_args()
+        
+        def build():
+            page, total = video_catalog.page(offset, limit)
+            videos = [media_listing_item(item, 'Video', VIDEO_UPLOAD_FOLDER) for item in page]
+            logger.info('Retrieved %s of %s videos', len(videos), total, extra=SAMPLED)
+            return {'status': 'success', 'videos': select_fields(videos, fields), **page_info(total, limit, offset, len(videos))}
+        
+        return versioned_json(video_catalog.version(), build)
+    except BadRequest as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error in get_videos: {str(e)}")
+        logger.error('Error in get_videos: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/get_images', methods=['GET'])
 def get_images():
     try:
-        image_files = [f for f in os.listdir(IMAGE_UPLOAD_FOLDER) if allowed_file(f, ALLOWED_IMAGE_EXTENSIONS)]
-        logger.debug(f"Scanning folder {IMAGE_UPLOAD_FOLDER}: Found files {image_files}")
-        images = [{'id': f, 'display_name': f"Image {i+1}", 'url': f"/{IMAGE_UPLOAD_FOLDER}/{f}"} for i, f in enumerate(image_files)]
-        logger.info(f"Retrieved {len(images)} images: {image_files}")
-        return jsonify({'status': 'success', 'images': images})
+        limit, offset, fields = listing_args()
+        
+        def build():
+            page, total = image_catalog.page(offset, limit)
+            images = [{**media_listing_item(item, 'Image', IMAGE_UPLOAD_FOLDER), 'derivatives': derivative_urls(item)}
+                      for item in page]
+            logger.info('Retrieved %s of %s images', len(images), total, extra=SAMPLED)
+            return {'status': 'success', 'images': select_fields(images, fields), **page_info(total, limit, offset, len(images))}
+        
+        return versioned_json(image_catalog.version(), build)
+    except BadRequest as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error in get_images: {str(e)}")
+        logger.error('Error in get_images: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/delete_video/<filename>', methods=['DELETE'])
 def delete_video(filename):
     try:
-        file_path = os.path.join(app.config['VIDEO_UPLOAD_FOLDER'], secure_filename(filename))
-        if os.path.exists(file_path):
+        filename = secure_filename(filename)
+        file_path = os.path.join(app.config['VIDEO_UPLOAD_FOLDER'], filename)
+        in_catalog = video_catalog.remove(filename)
+        on_disk = os.path.exists(file_path)
+        if on_disk:
             os.remove(file_path)
-            logger.info(f"Video deleted: {filename}")
+        if in_catalog or on_disk:
+            logger.info('Video deleted: %s', filename)
             return jsonify({'status': 'success', 'message': 'Video deleted successfully'})
         else:
-            logger.warning(f"Video not found: {filename}")
+            logger.warning('Video not found: %s', filename)
             return jsonify({'status': 'error', 'message': 'Video not found'}), 404
     except Exception as e:
-        logger.error(f"Error in delete_video: {str(e)}")
+        logger.error('Error in delete_video: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/delete_image/<filename>', methods=['DELETE'])
 def delete_image(filename):
     try:
-        file_path = os.path.join(app.config['IMAGE_UPLOAD_FOLDER'], secure_filename(filename))
-        if os.path.exists(file_path):
+        filename = secure_filename(filename)
+        file_path = os.path.join(app.config['IMAGE_UPLOAD_FOLDER'], filename)
+        item = image_catalog.get(filename)
+        if item is not None:
+            remove_derivatives(item)
+        in_catalog = image_catalog.remove(filename)
+        on_disk = os.path.exists(file_path)
+        if on_disk:
             os.remove(file_path)
-            logger.info(f"Image deleted: {filename}")
+        if in_catalog or on_disk:
+            logger.info('Image deleted: %s', filename)
             return jsonify({'status': 'success', 'message': 'Image deleted successfully'})
         else:
-            logger.warning(f"Image not found: {filename}")
+            logger.warning('Image not found: %s', filename)
             return jsonify({'status': 'error', 'message': 'Image not found'}), 404
     except Exception as e:
-        logger.error(f"Error in delete_image: {str(e)}")
+        logger.error('Error in delete_image: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# Importing this module only defines the app and reads its settings;
+# create_app() sets up logging (see logging_setup.py) and the upload folders.
+# With warm=True it also loads what the first requests would otherwise load.
+# gunicorn.conf.py preloads create_app(warm=True) in the master, so workers
+# fork with the Q&A indexes and landing page already in memory. Safe to call
+# more than once.
+app_initialized = False
+
+def create_app(warm=False):
+    global app_initialized, log_handler
+    if not app_initialized:
+        app_initialized = True
+        log_handler = configure_logging(
+            level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+            fmt=os.getenv('LOG_FORMAT', 'text'),
+            sample_rate=float(os.getenv('LOG_SAMPLE_RATE', '1.0')),
+        )
+        for folder in [VIDEO_UPLOAD_FOLDER, IMAGE_UPLOAD_FOLDER]:
+            os.makedirs(folder, exist_ok=True)
+        logger.info('Index file %s exists: %s', INDEX_FILE, INDEX_FILE_EXISTS)
+    if warm:
+        warm_up()
+    return app
+
+# Load the Q&A data and its indexes, the HTTP client libraries and the
+# landing page now rather than on the first requests that need them
+def warm_up():
+    start = time.perf_counter()
+    entries = len(qa_store.all())
+    upstream_client.preload()
+    current_index_page()
+    logger.info('Warmed up in %.1f ms (%s Q&A entries)', elapsed_ms(start), entries)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    create_app(warm=True).run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Async serving mode.
+
+The answer routes (/get_answer, /get_answer_stream and /get_answers) run as
+coroutines on an event loop and call Perplexity with the asyncio client, so
+one worker process overlaps the network waits of many waiting clients.
+Custom Q&A matching (a BM25 search, and a reload of the Q&A file when
+another worker has changed it) runs in the default thread pool, so it never
+holds up the other coroutines on the loop. Every other route is the regular
+Flask app, run in a pool of ASGI_WSGI_THREADS threads, so file uploads, media
+and the Q&A admin routes keep working unchanged and are never queued behind
+a slow answer.
+
+Run: gunicorn --workers 1 -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:$PORT asgi:application
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+import logging
+from a2wsgi import WSGIMiddleware
+import app as app_module
+from answer_cache import answer_request_key
+from logging_setup import elapsed_ms, request_id_var
+from resilience import CircuitOpenError
+from responses import BadRequest
+from singleflight import AsyncSingleFlight
+from upstream import AsyncPerplexityClient
+
+logger = logging.getLogger(__name__)
+
+# Largest JSON body accepted by the async answer routes
+MAX_BODY_SIZE = 1024 * 1024
+
+upstream_client = AsyncPerplexityClient(model=app_module.PERPLEXITY_MODEL,
+                                        pool_size=int(os.getenv('ASGI_UPSTREAM_CONNECTIONS', '100')))
+upstream_calls = AsyncSingleFlight()
+# Set up and warm the app here: the async routes bypass Flask's hooks, and
+# under gunicorn's preload this runs once in the master before forking
+app_module.create_app(warm=True)
+upstream_client.preload()
+wsgi_app = WSGIMiddleware(app_module.app, workers=int(os.getenv('ASGI_WSGI_THREADS', '10')))
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise RequestError('Client disconnected')
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise RequestError('Request body too large', 413)
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+# One API call, with its duration and outcome recorded
+async def timed_upstream_ask(question, context, max_tokens):
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        answer = await app_module.upstream_guard.call_async(
+            lambda: upstream_client.ask(question, context, max_tokens))
+        outcome = 'ok'
+        return answer
+    except CircuitOpenError:
+        outcome = 'rejected'
+        raise
+    finally:
+        app_module.UPSTREAM_LATENCY.observe(time.perf_counter() - start, mode='ask', outcome=outcome)
+
+
+# Ask the upstream API, sharing the call with identical in-flight requests
+async def ask_upstream(question, context, max_tokens):
+    key = answer_request_key(question, context, max_tokens, upstream_client.model)
+    return await upstream_calls.do(
+        key,
+        lambda: timed_upstream_ask(question, context, max_tokens),
+        timeout=app_module.app.config['UPSTREAM_COALESCE_TIMEOUT'],
+    )
+
+
+async def single_body(body):
+    yield body
+
+
+# Async version of app.get_answer; returns (status, content type, body chunks)
+async def get_answer(data):
+    try:
+        question, context, max_tokens = app_module.question_fields(data)
+        session_id, context = app_module.conversation_context(data, context)
+
+        result, cache_key = await asyncio.to_thread(app_module.local_answer, question, context, max_tokens)
+        if result is not None:
+            app_module.ANSWERS.inc(endpoint='get_answer', source=result['source'])
+            result = app_module.record_turn(session_id, question, result)
+            return 200, 'application/json', single_body(json.dumps(result).encode('utf-8'))
+
+        if not upstream_client.api_key:
+            logger.error("Perplexity API key not configured")
+            app_module.ANSWERS.inc(endpoint='get_answer', source='error')
+            body = json.dumps(app_module.with_session({'answer': app_module.NO_API_KEY_ANSWER}, session_id))
+            return 500, 'application/json', single_body(body.encode('utf-8'))
+
+        try:
+            answer = await ask_upstream(question, context, max_tokens)
+            logger.info("Perplexity API response for question '%s': %s", question, answer,
+                        extra=app_module.SAMPLED)
+            app_module.answer_cache.put(cache_key, answer)
+            app_module.ANSWERS.inc(endpoint='get_answer', source='perplexity')
+            result = app_module.record_turn(session_id, question, {'answer': answer, 'source': 'perplexity'})
+        except Exception as e:
+            logger.error('Error with Perplexity API: %s', e)
+            result = await asyncio.to_thread(app_module.fallback_answer, question, context, max_tokens)
+            if result is not None:
+                app_module.ANSWERS.inc(endpoint='get_answer', source='fallback')
+                result = app_module.record_turn(session_id, question, result)
+            else:
+                app_module.ANSWERS.inc(endpoint='get_answer', source='error')
+                result = app_module.with_session({'answer': app_module.UPSTREAM_FAILED_ANSWER}, session_id)
+    except BadRequest as e:
+        raise RequestError(str(e))
+    except Exception as e:
+        logger.error('Error in get_answer: %s', e)
+        app_module.ANSWERS.inc(endpoint='get_answer', source='error')
+        result = {'answer': app_module.REQUEST_FAILED_ANSWER}
+    return 200, 'application/json', single_body(json.dumps(result).encode('utf-8'))
+
+
+# Async version of app.get_answer_stream, with the same events
+async def get_answer_stream(data):
+    def event(name, payload):
+        return single_body(app_module.sse_event(name, payload).encode('utf-8'))
+
+    try:
+        question, context, max_tokens = app_module.question_fields(data)
+        session_id, context = app_module.conversation_context(data, context)
+
+        result, cache_key = await asyncio.to_thread(app_module.local_answer, question, context, max_tokens)
+        if result is not None:
+            app_module.ANSWERS.inc(endpoint='get_answer_stream', source=result['source'])
+            return 200, 'text/event-stream', event('answer', app_module.record_turn(session_id, question, result))
+
+        if not upstream_client.api_key:
+            logger.error("Perplexity API key not configured")
+            app_module.ANSWERS.inc(endpoint='get_answer_stream', source='error')
+            return 200, 'text/event-stream', event(
+                'error', app_module.with_session({'answer': app_module.NO_API_KEY_ANSWER}, session_id))
+    except BadRequest as e:
+        raise RequestError(str(e))
+    except Exception as e:
+        logger.error('Error in get_answer_stream: %s', e)
+        app_module.ANSWERS.inc(endpoint='get_answer_stream', source='error')
+        return 200, 'text/event-stream', event('error', {'answer': app_module.REQUEST_FAILED_ANSWER})
+
+    async def generate():
+        parts = []
+        start = time.perf_counter()
+        guard = app_module.upstream_guard
+        try:
+            guard.stream_started()
+            async for text in upstream_client.stream(question, context, max_tokens):
+                parts.append(text)
+                yield app_module.sse_event('delta', {'text': text}).encode('utf-8')
+        except (GeneratorExit, asyncio.CancelledError):
+            guard.stream_cancelled()
+            raise
+        except Exception as e:
+            logger.error('Error with Perplexity API stream: %s', e)
+            rejected = isinstance(e, CircuitOpenError)
+            if not rejected:
+                guard.stream_finished(e)
+            app_module.UPSTREAM_LATENCY.observe(time.perf_counter() - start, mode='stream',
+                                                outcome='rejected' if rejected else 'error')
+            fallback = None
+            if not parts:
+                fallback = await asyncio.to_thread(app_module.fallback_answer, question, context, max_tokens)
+            if fallback is not None:
+                app_module.ANSWERS.inc(endpoint='get_answer_stream', source='fallback')
+                result = app_module.record_turn(session_id, question, fallback)
+                yield app_module.sse_event('answer', result).encode('utf-8')
+                return
+            app_module.ANSWERS.inc(endpoint='get_answer_stream', source='error')
+            failed = app_module.with_session({'answer': app_module.UPSTREAM_FAILED_ANSWER}, session_id)
+            yield app_module.sse_event('error', failed).encode('utf-8')
+            return
+        guard.stream_finished()
+        app_module.UPSTREAM_LATENCY.observe(time.perf_counter() - start, mode='stream', outcome='ok')
+        answer = ''.join(parts)
+        logger.info("Perplexity API streamed response for question '%s': %s", question, answer,
+                    extra=app_module.SAMPLED)
+        app_module.answer_cache.put(cache_key, answer)
+        app_module.ANSWERS.inc(endpoint='get_answer_stream', source='perplexity')
+        result = app_module.record_turn(session_id, question, {'answer': answer, 'source': 'perplexity'})
+        yield app_module.sse_event('answer', result).encode('utf-8')
+
+    return 200, 'text/event-stream', generate()
+
+
+# Async version of app.get_answers: the misses are asked on the event loop,
+# at most BATCH_UPSTREAM_CONCURRENCY at a time
+async def get_answers(data):
+    try:
+        start = time.perf_counter()
+        questions, context, max_tokens = app_module.batch_fields(data)
+        items, misses = await asyncio.to_thread(app_module.batch_local_answers, questions, context, max_tokens)
+        limit = asyncio.Semaphore(app_module.app.config['BATCH_UPSTREAM_CONCURRENCY'])
+        submitted = time.perf_counter()
+
+        async def ask(question):
+            async with limit:
+                try:
+                    if not upstream_client.api_key:
+                        raise RuntimeError('Perplexity API key not configured')
+                    return await ask_upstream(question, context, max_tokens), None, elapsed_ms(submitted)
+                except Exception as e:
+                    return None, e, elapsed_ms(submitted)
+
+        results = await asyncio.gather(*(ask(question) for question, _, _ in misses.values()))
+        for (_, cache_key, positions), (answer, error, latency) in zip(misses.values(), results):
+            for position in positions:
+                items[position] = app_module.batch_upstream_item(questions[position], context, max_tokens,
+                                                                 cache_key, answer, error, latency)
+
+        logger.info('Answered batch of %s questions (%s sent upstream) in %.1f ms',
+                    len(items), len(misses), elapsed_ms(start))
+        status, body = 200, {'status': 'success', 'answers': items, 'upstream_calls': len(misses),
+                             'latency_ms': elapsed_ms(start)}
+    except BadRequest as e:
+        status, body = 400, {'status': 'error', 'message': str(e)}
+    except Exception as e:
+        logger.error('Error in get_answers: %s', e)
+        status, body = 500, {'status': 'error', 'message': str(e)}
+    return status, 'application/json', single_body(json.dumps(body).encode('utf-8'))
+
+
+# Routes served on the event loop, by (method, path)
+ASYNC_ROUTES = {
+    ('POST', '/get_answer'): get_answer,
+    ('POST', '/get_answer_stream'): get_answer_stream,
+    ('POST', '/get_answers'): get_answers,
+}
+
+
+async def handle_async_route(handler, scope, receive, send):
+    start = time.perf_counter()
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    request_id = headers.get('x-request-id', '')
+    if not app_module.REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        try:
+            status, content_type, chunks = await handler(json.loads(await read_body(receive) or b'null') or {})
+        except RequestError as e:
+            status, content_type = e.status, 'application/json'
+            chunks = single_body(json.dumps({'status': 'error', 'message': str(e)}).encode('utf-8'))
+        except ValueError:
+            status, content_type = 200, 'application/json'
+            chunks = single_body(json.dumps({'answer': app_module.REQUEST_FAILED_ANSWER}).encode('utf-8'))
+        response_headers = [(b'content-type', content_type.encode('latin-1')),
+                            (b'x-request-id', request_id.encode('latin-1'))]
+        if content_type == 'text/event-stream':
+            response_headers += [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+        app_module.REQUEST_LATENCY.observe(time.perf_counter() - start, route=scope['path'],
+                                           method=scope['method'], status=status)
+        logger.info('%s %s %s', scope['method'], scope['path'], status,
+                    extra={**app_module.SAMPLED, 'duration_ms': elapsed_ms(start), 'route': scope['path']})
+    finally:
+        request_id_var.reset(token)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream_client.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    handler = ASYNC_ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if handler is not None:
+        await handle_async_route(handler, scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
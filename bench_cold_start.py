@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: time from a fresh interpreter to the first response.
+
+In-process mode starts a new Python process per run and times importing
+app.py, create_app() (with and without warm-up) and the first requests,
+answered through the test client. With --gunicorn it starts gunicorn with
+gunicorn.conf.py and times process start to the first HTTP response.
+Medians over --runs are printed; --json writes every run to a file.
+
+Usage: python bench_cold_start.py [--runs 5] [--gunicorn] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUESTION = 'What is your name?'
+
+# Runs in a fresh interpreter and prints its timings as JSON
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app_module.create_app(warm={warm})
+created = time.perf_counter()
+client = app_module.app.test_client()
+answer = client.post('/get_answer', json={{'question': {question!r}}})
+answered = time.perf_counter()
+page = client.get('/')
+paged = time.perf_counter()
+assert answer.status_code == 200 and page.status_code == 200
+ms = lambda a, b: round((b - a) * 1000, 2)
+print(json.dumps({{
+    'import_ms': ms(start, imported),
+    'create_app_ms': ms(imported, created),
+    'first_answer_ms': ms(created, answered),
+    'first_page_ms': ms(answered, paged),
+    'total_ms': ms(start, paged),
+}}))
+"""
+
+
+def run_probe(warm):
+    env = {**os.environ, 'LOG_LEVEL': 'WARNING'}
+    output = subprocess.run([sys.executable, '-c', PROBE.format(warm=warm, question=QUESTION)],
+                            cwd=HERE, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Seconds from starting gunicorn to the first successful GET of `path`
+def run_gunicorn(path, timeout=60):
+    port = free_port()
+    env = {**os.environ, 'PORT': str(port), 'LOG_LEVEL': 'WARNING'}
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=HERE, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+                    if response.status == 200:
+                        return {'first_response_ms': round((time.perf_counter() - start) * 1000, 2)}
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"gunicorn did not answer {path} within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summarize(name, runs):
+    print(f"\n{name} (median of {len(runs)} runs)")
+    for key in runs[0]:
+        print(f"  {key:<18} {statistics.median(run[key] for run in runs):>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import-to-first-response time')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--gunicorn', action='store_true', help='also time a gunicorn start with gunicorn.conf.py')
+    parser.add_argument('--path', default='/health', help='path requested from gunicorn')
+    parser.add_argument('--json', help='write all runs to this file')
+    args = parser.parse_args()
+
+    results = {
+        'lazy': [run_probe(False) for _ in range(args.runs)],
+        'warm': [run_probe(True) for _ in range(args.runs)],
+    }
+    summarize('create_app()', results['lazy'])
+    summarize('create_app(warm=True)', results['warm'])
+    if args.gunicorn:
+        results['gunicorn'] = [run_gunicorn(args.path) for _ in range(args.runs)]
+        summarize(f"gunicorn -c gunicorn.conf.py, GET {args.path}", results['gunicorn'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Wrote {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Synthetic data for the benchmarks and the load test.
+
+Generates Q&A corpora of any size with kiosk-style questions, paraphrases
+of them (for fuzzy matches), questions that match nothing, and folders of
+media files named the way uploads are stored. Everything is deterministic
+for a given seed, so runs on different commits see the same data.
+"""
+
+import hashlib
+import json
+import os
+import random
+import uuid
+
+SUBJECTS = [
+    'the robot', 'your battery', 'the charging dock', 'the main office', 'the library', 'the cafeteria',
+    'the parking lot', 'the science lab', 'the auditorium', 'the reception', 'the wifi', 'the lift',
+    'the exam schedule', 'the admission process', 'the fee payment', 'the bus service', 'the hostel',
+    'the sports ground', 'the canteen menu', 'the lost and found', 'the first aid room', 'the workshop',
+    'the principal', 'the placement cell', 'the computer lab', 'the museum', 'the gift shop', 'the garden',
+]
+ASPECTS = [
+    'opening hours', 'location', 'phone number', 'price', 'rules', 'manager', 'address', 'capacity',
+    'history', 'email', 'timetable', 'best feature', 'entry fee', 'dress code', 'floor', 'size',
+]
+TEMPLATES = [
+    'what is the {aspect} of {subject}',
+    'where can i find the {aspect} of {subject}',
+    'can you tell me the {aspect} of {subject}',
+    'who knows the {aspect} of {subject}',
+    'how do i check the {aspect} of {subject}',
+    'i want to know the {aspect} of {subject}',
+]
+QUALIFIERS = ['today', 'on weekends', 'for visitors', 'for students', 'in summer', 'during exams',
+              'for staff', 'after six', 'on holidays', 'for parents', 'this month', 'next week']
+# Words that appear in no generated question
+NONSENSE = ['zorbit', 'quaffle', 'plinth', 'gloam', 'snarkle', 'vexillum', 'brindle', 'fjord',
+            'ottoman', 'tundra', 'wombat', 'kazoo', 'lichen', 'marimba', 'nebula', 'quokka']
+
+
+# `count` distinct Q&A entries ({'id', 'question', 'answer'}) in the format
+# of qa_data.json
+def synthetic_qa(count, seed=0):
+    rng = random.Random(seed)
+    entries = []
+    seen = set()
+    while len(entries) < count:
+        question = rng.choice(TEMPLATES).format(aspect=rng.choice(ASPECTS), subject=rng.choice(SUBJECTS))
+        if rng.random() < 0.7 or question in seen:
+            question = f"{question} {rng.choice(QUALIFIERS)}"
+        if question in seen:
+            question = f"{question} number {len(entries)}"
+        seen.add(question)
+        answer = f"Answer {len(entries)}: " + ' '.join(rng.choice(ASPECTS) for _ in range(rng.randint(5, 25)))
+        entries.append({'id': str(uuid.UUID(int=rng.getrandbits(128))), 'question': question, 'answer': answer})
+    return entries
+
+
+def write_qa_file(path, entries):
+    with open(path, 'w') as f:
+        json.dump(entries, f)
+
+
+# Words a kiosk user may leave out without changing the question
+FILLER = {'the', 'of', 'can', 'you', 'me', 'i', 'do', 'to', 'is', 'what', 'where', 'how', 'who'}
+
+
+# A reworded version of a question: one filler word dropped, so it misses
+# the exact index but still fuzzy-matches its original above the default
+# QA_MATCH_THRESHOLD
+def paraphrase(question, rng):
+    words = question.split()
+    fillers = [i for i, word in enumerate(words) if word in FILLER]
+    if fillers:
+        del words[rng.choice(fillers)]
+    return ' '.join(words).capitalize() + '?'
+
+
+# A question that matches no generated entry; distinct for each n
+def miss_question(n, rng):
+    return f"{' '.join(rng.sample(NONSENSE, 3))} {n}"
+
+
+# `count` (question, kind) pairs for requests: kind is "exact", "fuzzy" or
+# "miss" with the given shares
+def question_mix(entries, count, seed=0, exact=0.5, fuzzy=0.2):
+    rng = random.Random(seed)
+    mix = []
+    for n in range(count):
+        roll = rng.random()
+        if roll < exact:
+            mix.append((rng.choice(entries)['question'], 'exact'))
+        elif roll < exact + fuzzy:
+            mix.append((paraphrase(rng.choice(entries)['question'], rng), 'fuzzy'))
+        else:
+            mix.append((miss_question(n, rng), 'miss'))
+    return mix
+
+
+# Small file bodies; content-addressed names keep them unique
+def media_body(n, size, seed=0):
+    rng = random.Random(f"{seed}-{n}")
+    return rng.randbytes(size)
+
+
+# Fill `folder` with `count` files named <sha256><extension>, like stored
+# uploads. Returns the file names.
+def synthetic_media_dir(folder, count, extension='.jpg', size=512, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for n in range(count):
+        body = media_body(n, size, seed)
+        name = hashlib.sha256(body).hexdigest() + extension
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(body)
+        names.append(name)
+    return names
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the Q&A and media code paths at realistic scale.
+
+For each corpus size a synthetic Q&A file and image folder (see
+bench_data.py) are generated in a temporary directory, the app is pointed at
+them and the Perplexity client is replaced by an in-process mock. Routes
+are timed through the Flask test client (route/...) and the functions
+behind them directly (core/...). Results are written as JSON; --compare
+prints the change of every median against an earlier results file and
+exits with 1 when one got slower than --threshold.
+
+Usage: python bench_micro.py [--sizes 1000,10000,100000] [--output bench.json] [--compare old.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix='tina-bench-')
+# Keep the app quiet and its metrics out of the deployment's folder
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'tina-bench-metrics'))
+
+import app as app_module
+from answer_cache import AnswerCache
+from bench_data import miss_question, paraphrase, synthetic_media_dir, synthetic_qa, write_qa_file
+from media_catalog import MediaCatalog
+from qa_storage import JSONFileBackend, SQLiteBackend
+from qa_store import QAStore
+
+
+# Stands in for PerplexityClient: answers at once, without the network
+class MockUpstream:
+    model = 'mock-model'
+    api_key = 'mock-key'
+
+    def __init__(self):
+        self.calls = 0
+
+    def ask(self, question, context, max_tokens):
+        self.calls += 1
+        return f"mock answer to {question}"
+
+    def stream(self, question, context, max_tokens):
+        self.calls += 1
+        yield 'mock answer to '
+        yield question
+
+    def preload(self):
+        pass
+
+
+# Per-call durations in seconds of `runs` calls of fn(i)
+def measure(fn, runs):
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name, size, timings):
+    ordered = sorted(timings)
+    micros = [t * 1e6 for t in ordered]
+    return {
+        'benchmark': name,
+        'size': size,
+        'runs': len(timings),
+        'min_us': round(micros[0], 2),
+        'median_us': round(statistics.median(micros), 2),
+        'mean_us': round(statistics.fmean(micros), 2),
+        'p95_us': round(micros[min(len(micros) - 1, int(len(micros) * 0.95))], 2),
+        'ops_per_sec': round(len(timings) / sum(timings), 1),
+    }
+
+
+def check(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.path} returned {response.status_code}: {response.get_data(as_text=True)}")
+    return response
+
+
+# Point the app at the generated data; returns a function undoing it
+def install(store, catalog, upstream):
+    names = ('qa_store', 'image_catalog', 'upstream_client', 'answer_cache')
+    saved = {name: getattr(app_module, name) for name in names}
+    app_module.qa_store = store
+    app_module.image_catalog = catalog
+    app_module.upstream_client = upstream
+    app_module.answer_cache = AnswerCache(max_entries=100000)
+
+    def restore():
+        for name, value in saved.items():
+            setattr(app_module, name, value)
+    return restore
+
+
+def make_backend(kind, folder, entries):
+    json_path = os.path.join(folder, 'qa_data.json')
+    write_qa_file(json_path, entries)
+    if kind == 'sqlite':
+        return SQLiteBackend(os.path.join(folder, 'qa_data.db'), migrate_from=json_path)
+    return JSONFileBackend(json_path)
+
+
+def bench_size(size, args):
+    folder = os.path.join(WORK_DIR, str(size))
+    os.makedirs(folder)
+    rng = random.Random(size)
+    entries = synthetic_qa(size, seed=size)
+    backend = make_backend(args.storage, folder, entries)
+    image_folder = os.path.join(folder, 'images')
+    synthetic_media_dir(image_folder, size if args.media else 0, seed=size)
+    catalog_db = os.path.join(folder, 'catalog.db')
+    results = []
+
+    def run(name, fn, runs):
+        if args.filter and args.filter not in name:
+            return
+        results.append(summarize(name, size, measure(fn, runs)))
+        print(f"  {name:<32} {results[-1]['median_us']:>12.1f} us  (p95 {results[-1]['p95_us']:.1f})")
+
+    print(f"\n{size} entries / files ({args.storage} storage)")
+    reads, writes, slow = args.repeat, args.write_repeat, max(3, args.write_repeat // 4)
+
+    # Core: loading, matching and paging without HTTP
+    run('core/qa_load', lambda i: QAStore(backend=backend).all(), slow)
+    store = QAStore(backend=backend)
+    store.all()
+    # Inputs are drawn up front so only the code under test is timed
+    exact = [rng.choice(entries)['question'] for _ in range(reads)]
+    fuzzy = [paraphrase(rng.choice(entries)['question'], rng) for _ in range(reads)]
+    misses = [miss_question(i, rng) for i in range(reads)]
+    update_ids = [rng.choice(entries)['id'] for _ in range(writes)]
+    run('core/match_exact', lambda i: store.match(exact[i], 0.7), reads)
+    run('core/match_fuzzy', lambda i: store.match(fuzzy[i], 0.7), reads)
+    run('core/match_miss', lambda i: store.match(misses[i], 0.7), reads)
+    run('core/qa_page_50', lambda i: store.page(i * 50 % max(1, size - 50), 50), reads)
+    run('core/catalog_rebuild',
+        lambda i: MediaCatalog(f"{catalog_db}.{i}", 'image', image_folder, app_module.ALLOWED_IMAGE_EXTENSIONS),
+        slow)
+    catalog = MediaCatalog(catalog_db, 'image', image_folder, app_module.ALLOWED_IMAGE_EXTENSIONS)
+    run('core/catalog_page_50', lambda i: catalog.page(i * 50 % max(1, size - 50), 50), reads)
+
+    # Routes, through the test client
+    upstream = MockUpstream()
+    restore = install(store, catalog, upstream)
+    try:
+        client = app_module.app.test_client()
+
+        def ask(question):
+            return check(client.post('/get_answer', json={'question': question})).get_json()
+
+        run('route/get_answer_exact', lambda i: ask(exact[i]), reads)
+        run('route/get_answer_fuzzy', lambda i: ask(fuzzy[i]), reads)
+        # Misses go to the mock upstream once each; asked again they are cache hits
+        run('route/get_answer_miss', lambda i: ask(misses[i]), reads)
+        run('route/get_answer_cached', lambda i: ask(misses[i]), reads)
+        run('route/get_qas_page_50', lambda i: check(client.get(f"/get_qas?limit=50&offset={i % size}")), reads)
+        run('route/get_qas_all', lambda i: check(client.get('/get_qas')), slow)
+        run('route/get_images_page_50', lambda i: check(client.get(f"/get_images?limit=50&offset={i % size}")), reads)
+        run('route/get_images_all', lambda i: check(client.get('/get_images')), slow)
+
+        added = []
+
+        def add(i):
+            check(client.post('/add_qa', data={'question': f"benchmark question {i}", 'answer': 'benchmark answer'}))
+            added.append(store.find_by_question(f"benchmark question {i}")['id'])
+
+        run('route/add_qa', add, writes)
+        run('route/update_qa', lambda i: check(client.put(
+            f"/update_qa/{update_ids[i]}",
+            json={'question': f"updated question {i}", 'answer': 'updated answer'})), writes)
+        if added:
+            run('route/delete_qa', lambda i: check(client.delete(f"/delete_qa/{added[i]}")), len(added))
+    finally:
+        restore()
+    shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Print the change of each median against an earlier run; returns the
+# benchmarks that got slower than threshold times the old median
+def compare(old, new, threshold):
+    before = {(r['benchmark'], r['size']): r['median_us'] for r in old['results']}
+    regressions = []
+    print(f"\nCompared with {old['meta'].get('commit')} (threshold {threshold:.2f}x)")
+    for r in new['results']:
+        previous = before.get((r['benchmark'], r['size']))
+        if not previous:
+            continue
+        ratio = r['median_us'] / previous
+        flag = ''
+        if ratio > threshold:
+            flag = '  ⚠️ slower'
+            regressions.append(f"{r['benchmark']}@{r['size']}")
+        print(f"  {r['benchmark']:<32} {r['size']:>7}  {previous:>10.1f} -> {r['median_us']:>10.1f} us  "
+              f"{ratio:5.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Q&A and media code paths')
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated corpus sizes')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--repeat', type=int, default=200, help='runs of each read benchmark')
+    parser.add_argument('--write-repeat', type=int, default=20, help='runs of each write benchmark')
+    parser.add_argument('--no-media', dest='media', action='store_false', help='skip generating media files')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = []
+    try:
+        for size in sizes:
+            results.extend(bench_size(size, args))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': args.storage,
+            'sizes': sizes,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Wrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"❌ Slower than {args.threshold:.2f}x: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, single worker only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks copied from the request body to disk
+COPY_SIZE = 64 * 1024
+# Chunk size suggested to clients
+CHUNK_SIZE = 8 * 1024 * 1024
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def valid_sha256(value):
+    return isinstance(value, str) and bool(_SHA256.match(value))
+
+
+# Stream `source` into the open file `target` in blocks, feeding each block to
+# `hasher` once it is written. Reads at most `limit` bytes and returns the
+# number of bytes copied.
+def copy_stream(source, target, hasher, limit=None):
+    copied = 0
+    while limit is None or copied < limit:
+        block = source.read(COPY_SIZE if limit is None else min(COPY_SIZE, limit - copied))
+        if not block:
+            break
+        target.write(block)
+        hasher.update(block)
+        copied += len(block)
+    return copied
+
+
+# Resumable uploads written straight to disk in chunks.
+# Each upload is a `<id>.part` file plus a `<id>.json` sidecar with the
+# declared filename, size and (optional) SHA-256. The part file's size is the
+# acknowledged offset, so any worker can continue an upload another worker
+# started, and bytes written before a dropped connection are kept. Appends to
+# one upload are serialized with an flock on the part file. The content hash
+# is computed as chunks arrive; a worker that has not seen the earlier chunks
+# catches up by hashing what is already on disk. The folder is created when
+# the first upload starts, not when the object is made.
+class ChunkedUploads:
+    def __init__(self, folder, max_size, max_age=24 * 3600):
+        self.folder = folder
+        self.max_size = max_size
+        self.max_age = max_age
+        self._hashers = {}
+        self._lock = threading.Lock()
+
+    def _path(self, upload_id, suffix):
+        if not _UPLOAD_ID.match(upload_id):
+            raise UploadError('Upload not found', 404)
+        return os.path.join(self.folder, f"{upload_id}{suffix}")
+
+    def create(self, kind, filename, size, sha256=None):
+        if not isinstance(size, int) or size < 0:
+            raise UploadError('size must be a non-negative integer')
+        if size > self.max_size:
+            raise UploadError(f"Upload is larger than {self.max_size} bytes", 413)
+        if sha256 is not None and not valid_sha256(sha256):
+            raise UploadError('sha256 must be 64 lowercase hex characters')
+        os.makedirs(self.folder, exist_ok=True)
+        self.purge()
+        upload_id = uuid.uuid4().hex
+        session = {'id': upload_id, 'kind': kind, 'filename': filename, 'size': size,
+                   'sha256': sha256, 'created_at': time.time()}
+        open(self._path(upload_id, '.part'), 'wb').close()
+        meta_path = self._path(upload_id, '.json')
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump(session, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        return {**session, 'offset': 0}
+
+    def status(self, upload_id):
+        try:
+            with open(self._path(upload_id, '.json')) as f:
+                session = json.load(f)
+            offset = os.path.getsize(self._path(upload_id, '.part'))
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+        return {**session, 'offset': offset}
+
+    @contextmanager
+    def _locked(self, upload_id):
+        with open(self._path(upload_id, '.part'), 'ab') as part:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError('Another chunk of this upload is being written', 409)
+            yield part
+
+    # Hasher holding exactly the first `offset` bytes of the upload
+    def _hasher(self, upload_id, offset):
+        with self._lock:
+            cached = self._hashers.pop(upload_id, None)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        with open(self._path(upload_id, '.part'), 'rb') as f:
+            copy_stream(f, _NullWriter, hasher, offset)
+        return hasher
+
+    # Append the request body at `offset`, which must be the current offset.
+    # Returns the new offset.
+    def append(self, upload_id, offset, stream):
+        session = self.status(upload_id)
+        with self._locked(upload_id) as part:
+            current = os.fstat(part.fileno()).st_size
+            if offset != current:
+                raise UploadError(f"Expected offset {current}", 409, current)
+            hasher = self._hasher(upload_id, current)
+            remaining = session['size'] - current
+            try:
+                copied = copy_stream(stream, part, hasher, remaining)
+            except Exception:
+                part.flush()
+                # Keep whatever reached the disk; the hasher is rebuilt next time
+                logger.warning('Upload %s chunk interrupted at %s bytes',
+                               upload_id, os.fstat(part.fileno()).st_size)
+                raise
+            part.flush()
+            if copied == remaining and stream.read(1):
+                part.truncate(current)
+                raise UploadError('Chunk goes past the declared upload size', 400, current)
+            offset = current + copied
+            with self._lock:
+                self._hashers[upload_id] = (offset, hasher)
+            return offset
+
+    # Check that an upload is complete and return (session, part_path, sha256).
+    # A declared hash that does not match discards the upload.
+    def finish(self, upload_id):
+        session = self.status(upload_id)
+        if session['offset'] != session['size']:
+            raise UploadError(f"Upload incomplete: {session['offset']} of {session['size']} bytes", 409, session['offset'])
+        with self._locked(upload_id):
+            digest = self._hasher(upload_id, session['size']).hexdigest()
+        if session['sha256'] and session['sha256'] != digest:
+            self.discard(upload_id)
+            raise UploadError('Uploaded content does not match the declared sha256', 422)
+        return session, self._path(upload_id, '.part'), digest
+
+    # Write a whole stream (a single-request upload) to a temporary file in
+    # the upload folder and return (path, sha256)
+    def receive(self, stream):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(uuid.uuid4().hex, '.part')
+        hasher = hashlib.sha256()
+        try:
+            with open(path, 'wb') as f:
+                copy_stream(stream, f, hasher)
+        except Exception:
+            os.remove(path)
+            raise
+        return path, hasher.hexdigest()
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        found = False
+        for suffix in ('.part', '.json'):
+            try:
+                os.remove(self._path(upload_id, suffix))
+                found = True
+            except FileNotFoundError:
+                pass
+        return found
+
+    # Remove uploads (and leftovers of interrupted single-request uploads)
+    # whose part file has not been touched for max_age seconds
+    def purge(self):
+        if not os.path.isdir(self.folder):
+            return
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.folder):
+            upload_id, _, suffix = entry.name.partition('.')
+            if suffix not in ('json', 'part') or not _UPLOAD_ID.match(upload_id):
+                continue
+            part_path = self._path(upload_id, '.part')
+            try:
+                touched = os.path.getmtime(part_path if os.path.exists(part_path) else entry.path)
+            except FileNotFoundError:
+                continue
+            if touched < cutoff:
+                logger.info('Removing abandoned upload %s', upload_id)
+                self.discard(upload_id)
+
+
+# File-like sink for re-hashing a part file without copying it anywhere
+class _NullWriter:
+    @staticmethod
+    def write(block):
+        pass
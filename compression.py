@@ -0,0 +1,111 @@
+import gzip
+import threading
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is offered alone without it
+    brotli = None
+
+# Response types worth compressing
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+}
+# Levels for bodies compressed once and cached, and for one-off bodies where
+# compression time counts against the request
+CACHED_LEVELS = {'br': 11, 'gzip': 9}
+DYNAMIC_LEVELS = {'br': 5, 'gzip': 6}
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+# after_request hook compressing HTML, CSS and JSON bodies of at least
+# min_size bytes with brotli or gzip, as negotiated by Accept-Encoding.
+# Bodies of responses with a strong ETag (the index page, versioned listings)
+# are static for that ETag, so their compressed form is kept in an LRU cache
+# of at most cache_bytes. Streamed and file responses are left alone; files
+# come precompressed from media_delivery instead. The ETag of a compressed
+# response is made weak, since the bytes differ from the identity body.
+class Compressor:
+    def __init__(self, min_size=1024, cache_bytes=8 * 1024 * 1024):
+        self.min_size = min_size
+        self.cache_bytes = cache_bytes
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _cached(self, key):
+        with self._lock:
+            body = self._cache.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def _store(self, key, body):
+        # A single entry may take at most a quarter of the cache
+        if len(body) * 4 > self.cache_bytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = body
+            self._cache_size += len(body)
+            while self._cache_size > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_size -= len(evicted)
+
+    def after_request(self, response):
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers):
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        etag, weak = response.get_etag()
+        key = (etag, encoding) if etag and not weak else None
+        body = self._cached(key) if key else None
+        if body is None:
+            body = compress(data, encoding, (CACHED_LEVELS if key else DYNAMIC_LEVELS)[encoding])
+            if key:
+                self._store(key, body)
+        with self._lock:
+            self.bytes_in += len(data)
+            self.bytes_out += len(body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                'encodings': self.encodings,
+                'min_size': self.min_size,
+                'cache_entries': len(self._cache),
+                'cache_bytes': self._cache_size,
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+            }
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Shared fixtures: the app with fresh per-test state and a fake upstream.
+A test module changes what it needs by defining its own `upstream` or
+`qa_pairs` fixture, or a `client` fixture that takes this one.
+"""
+
+import pytest
+import app as app_module
+from answer_cache import AnswerCache
+from conversations import ConversationStore
+from qa_store import QAStore
+from resilience import UpstreamGuard
+from singleflight import SingleFlight
+
+class EchoUpstream:
+    """Answers every question at once and records what it was asked"""
+    model = 'test-model'
+    api_key = 'test'
+
+    def __init__(self):
+        self.calls = []
+
+    def ask(self, question, context, max_tokens):
+        self.calls.append(question)
+        return f"answer to {question}"
+
+@pytest.fixture
+def upstream():
+    return EchoUpstream()
+
+# (question, answer) pairs the custom Q&A starts with
+@pytest.fixture
+def qa_pairs():
+    return []
+
+@pytest.fixture
+def app_state(monkeypatch, tmp_path, upstream, qa_pairs):
+    """The app module with an empty Q&A file, caches, sessions and breaker, answering through `upstream`"""
+    monkeypatch.setattr(app_module, 'qa_store', QAStore(str(tmp_path / 'qa.json')))
+    monkeypatch.setattr(app_module, 'answer_cache', AnswerCache(max_entries=100))
+    monkeypatch.setattr(app_module, 'conversations', ConversationStore())
+    monkeypatch.setattr(app_module, 'upstream_client', upstream)
+    monkeypatch.setattr(app_module, 'upstream_calls', SingleFlight())
+    monkeypatch.setattr(app_module, 'upstream_guard', UpstreamGuard())
+    for question, answer in qa_pairs:
+        app_module.qa_store.add(question, answer)
+    return app_module
+
+@pytest.fixture
+def client(app_state, upstream):
+    with app_state.app.test_client() as client:
+        client.upstream = upstream
+        yield client
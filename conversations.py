@@ -0,0 +1,139 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# Rough token count of English text (about four characters per token), so
+# the history budget needs no tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+# Shorten text to about `tokens` tokens, cutting at a word boundary
+def truncate_tokens(text, tokens):
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:max(0, limit - 1)].rsplit(' ', 1)[0]
+    return cut + '…'
+
+
+# One conversation: the last max_turns question/answer pairs
+class Conversation:
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.last_used = time.monotonic()
+
+
+# Server-side conversation history, kept per session ID in memory.
+# Sessions idle for longer than idle_ttl seconds are dropped, and at most
+# max_sessions are kept (least recently used go first), so memory stays
+# bounded however many kiosks come and go. window() gives the history that
+# fits in history_tokens, newest turns first to be kept; turns that no
+# longer fit are reduced to a one-line summary of the questions asked.
+class ConversationStore:
+    def __init__(self, max_sessions=10000, idle_ttl=1800, max_turns=50, history_tokens=400,
+                 summary_tokens=60):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        # Ordered by last use, so idle sessions are found at the front
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def _expire(self, now):
+        while self._sessions:
+            session_id, conversation = next(iter(self._sessions.items()))
+            if now - conversation.last_used < self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def _touch(self, session_id, create):
+        now = time.monotonic()
+        self._expire(now)
+        conversation = self._sessions.get(session_id)
+        if conversation is None:
+            if not create:
+                return None
+            conversation = self._sessions[session_id] = Conversation(self.max_turns)
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        conversation.last_used = now
+        self._sessions.move_to_end(session_id)
+        return conversation
+
+    # (history, summary) to send with the next question: the most recent
+    # turns within the token budget as [{'role', 'content'}] oldest first,
+    # and a summary of the older ones ('' when everything fit)
+    def window(self, session_id):
+        with self._lock:
+            conversation = self._touch(session_id, create=True)
+            turns = list(conversation.turns)
+        history = []
+        budget = self.history_tokens
+        kept = 0
+        for question, answer in reversed(turns):
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if cost > budget:
+                # The latest turn is kept even when it alone is over budget
+                if not history and budget > 0:
+                    half = budget // 2
+                    history = [{'role': 'user', 'content': truncate_tokens(question, half)},
+                               {'role': 'assistant', 'content': truncate_tokens(answer, budget - half)}]
+                    kept = 1
+                break
+            history[:0] = [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+            budget -= cost
+            kept += 1
+        older = turns[:len(turns) - kept]
+        summary = ''
+        if older:
+            # Latest first, so truncation drops the oldest questions
+            summary = truncate_tokens('Earlier the user asked (latest first): '
+                                      + '; '.join(q for q, _ in reversed(older)), self.summary_tokens)
+        return history, summary
+
+    def append(self, session_id, question, answer):
+        with self._lock:
+            self._touch(session_id, create=True).turns.append((question, answer))
+
+    # Stored turns of a session as (question, answer) pairs, or None
+    def turns(self, session_id):
+        with self._lock:
+            conversation = self._touch(session_id, create=False)
+            return list(conversation.turns) if conversation is not None else None
+
+    def end(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'idle_ttl': self.idle_ttl,
+                'history_tokens': self.history_tokens,
+                'created': self.created,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
@@ -0,0 +1,29 @@
+"""
+gunicorn settings for production.
+
+    gunicorn -c gunicorn.conf.py                                                    (sync workers)
+    gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi:application  (async mode)
+
+The app is loaded and warmed once in the master (preload_app) and the workers
+are forked from it, so they start with the Q&A data, its indexes and the
+imported libraries already in memory, shared copy-on-write.
+"""
+
+import gc
+import os
+
+wsgi_app = 'app:create_app(warm=True)'
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+preload_app = True
+# Answers may wait on the API for up to a minute (see upstream.py)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+keepalive = 5
+
+
+# Runs in the master after the app was preloaded, before any worker is
+# forked. Freezing the objects that exist now keeps the garbage collector
+# from writing to them in the workers, which would copy their pages.
+def when_ready(server):
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,200 @@
+import heapq
+import os
+import threading
+import time
+import logging
+from qa_index import normalize_question
+
+logger = logging.getLogger(__name__)
+
+HIT = 'hit'
+MISS = 'miss'
+
+
+# Space-Saving top-k counter: keeps at most `capacity` keys. A new key
+# arriving when full takes the place of the key with the lowest count and
+# inherits that count (recorded as its error), so every count is at most
+# `error` above the true count and any key seen more than total/capacity
+# times is guaranteed to be kept. The minimum is found with a heap whose
+# stale entries are skipped lazily.
+class SpaceSaving:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counts = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            entry = self.counts.get(key)
+            if entry is not None and entry[0] == count:
+                return key, count
+
+    # Count one occurrence of key; returns the key evicted to make room, if any
+    def add(self, key):
+        evicted = None
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += 1
+        elif len(self.counts) < self.capacity:
+            entry = self.counts[key] = [1, 0]
+        else:
+            evicted, lowest = self._pop_min()
+            del self.counts[evicted]
+            entry = self.counts[key] = [lowest + 1, lowest]
+        heapq.heappush(self._heap, (entry[0], key))
+        # Every add pushes an entry; drop the stale ones before the heap outgrows the keys
+        if len(self._heap) > 4 * max(self.capacity, 1):
+            self._heap = [(count, key) for key, (count, _) in self.counts.items()]
+            heapq.heapify(self._heap)
+        return evicted
+
+    # The `limit` keys with the highest counts as (key, count, error)
+    def top(self, limit):
+        ranked = heapq.nlargest(limit, self.counts.items(), key=lambda item: (item[1][0], -item[1][1]))
+        return [(key, count, error) for key, (count, error) in ranked]
+
+
+# Most frequent questions, normalized, counted separately for custom Q&A
+# hits and misses in `capacity` entries each, so memory stays bounded
+# however many distinct questions are asked. For misses the latest
+# question, persona context and max_tokens it was asked with are kept too,
+# so its answer can be precomputed (see PrecomputeJob).
+class HotQuestions:
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.sketches = {HIT: SpaceSaving(capacity), MISS: SpaceSaving(capacity)}
+        self.totals = {HIT: 0, MISS: 0}
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    # Count a question; `request` is (question, context, max_tokens) to
+    # precompute a missed question's answer with, or None when it can't be
+    def record(self, question, hit, request=None):
+        key = normalize_question(question)
+        if not key:
+            return
+        kind = HIT if hit else MISS
+        with self._lock:
+            self.totals[kind] += 1
+            evicted = self.sketches[kind].add(key)
+            if kind == MISS:
+                self.samples.pop(evicted, None)
+                if request is not None:
+                    self.samples[key] = request
+
+    # Top questions of a kind as [{'question', 'count', 'error'}]
+    def top(self, kind, limit):
+        with self._lock:
+            ranked = self.sketches[kind].top(limit)
+        return [{'question': key, 'count': count, 'error': error} for key, count, error in ranked]
+
+    # Top misses that can be precomputed, as (normalized question, count, request)
+    def hottest_misses(self, limit, min_count=1):
+        with self._lock:
+            ranked = self.sketches[MISS].top(len(self.sketches[MISS]))
+            hottest = []
+            for key, count, _ in ranked:
+                if len(hottest) >= limit or count < min_count:
+                    break
+                if key in self.samples:
+                    hottest.append((key, count, self.samples[key]))
+            return hottest
+
+    def clear(self):
+        with self._lock:
+            self.sketches = {HIT: SpaceSaving(self.capacity), MISS: SpaceSaving(self.capacity)}
+            self.totals = {HIT: 0, MISS: 0}
+            self.samples.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'hits': self.totals[HIT],
+                'misses': self.totals[MISS],
+                'tracked_hits': len(self.sketches[HIT]),
+                'tracked_misses': len(self.sketches[MISS]),
+            }
+
+
+# Background job that answers the hottest missed questions ahead of time:
+# every `interval` seconds, up to `top_n` misses asked at least `min_count`
+# times are passed to precompute(question, context, max_tokens), which
+# returns True when it stored a new answer and False when there was nothing
+# to do. The thread is started lazily in the process that uses it, so a
+# job created before gunicorn forks its workers runs in each worker.
+class PrecomputeJob:
+    def __init__(self, hot, precompute, interval=300, top_n=20, min_count=3):
+        self.hot = hot
+        self.precompute = precompute
+        self.interval = interval
+        self.top_n = top_n
+        self.min_count = min_count
+        self.runs = 0
+        self.precomputed = 0
+        self.failed = 0
+        self.last_run = None
+        self._pid = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def ensure_running(self):
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, args=(self._pid,), name='precompute-answers', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _loop(self, pid):
+        while os.getpid() == pid and not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error('Error precomputing answers: %s', e)
+
+    # One pass over the hottest misses; returns how many answers were stored.
+    # An error stops the pass, so a failing API is not asked top_n times.
+    def run_once(self):
+        with self._run_lock:
+            stored = 0
+            for key, count, (question, context, max_tokens) in self.hot.hottest_misses(self.top_n, self.min_count):
+                try:
+                    if self.precompute(question, context, max_tokens):
+                        stored += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning("Could not precompute an answer for '%s' (asked %s times): %s", key, count, e)
+                    break
+            self.runs += 1
+            self.precomputed += stored
+            self.last_run = time.time()
+        if stored:
+            logger.info('Precomputed answers for %s hot questions', stored)
+        return stored
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'interval': self.interval,
+            'top_n': self.top_n,
+            'min_count': self.min_count,
+            'runs': self.runs,
+            'precomputed': self.precomputed,
+            'failed': self.failed,
+            'last_run': self.last_run,
+        }
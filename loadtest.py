@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Load test: how many kiosks can one instance serve?
+
+Runs --concurrency simulated kiosks against a running server for --duration
+seconds. Each kiosk keeps one keep-alive connection and sends a weighted mix
+of requests (--mix): questions answered from the custom Q&A (answer_hit,
+exact and reworded), questions that go to the upstream API (answer_miss),
+Q&A listing and CRUD calls and image uploads. Before the run the test seeds
+its own Q&A entries through /bulk_qa; everything it created is removed again
+afterwards, so it can be pointed at a staging instance.
+
+With --server the command is started here (on a free port) with
+PERPLEXITY_BASE_URL pointing at the bundled stub upstream (upstream_stub.py),
+whose latency and error rate are set with --stub-latency, --stub-jitter and
+--stub-error-rate. That makes runs of different server settings comparable:
+
+    python loadtest.py --server "gunicorn -c gunicorn.conf.py" --concurrency 50
+    python loadtest.py --server "gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi:application"
+
+Against a server started elsewhere use --url, and --stub-port to run the stub
+where that server's PERPLEXITY_BASE_URL points. The report lists throughput,
+error count and p50/p95/p99 latency per operation; --slo turns targets such
+as "answer_hit:p95=200" into an exit status, and --output saves the report.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+from bench_data import media_body, miss_question, paraphrase, synthetic_qa
+from upstream_stub import StubUpstream
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = ('answer_hit=50,answer_miss=15,list_qas=10,add_qa=5,update_qa=5,delete_qa=5,'
+               'upload_image=5,list_images=5')
+# Smallest valid GIF (1x1); random bytes after its trailer make each upload
+# distinct without making it unreadable
+GIF_PIXEL = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+             b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+# Entries seeded at a time for delete_qa to remove
+DELETE_BATCH = 100
+TIMEOUT = 120
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def expect(response, check=None):
+    if response.status_code >= 400:
+        raise RequestFailed(f"HTTP {response.status_code}")
+    if check is not None and not check(response):
+        raise RequestFailed(f"unexpected response: {response.text[:200]}")
+    return response
+
+
+# "name=weight,..." -> [(name, weight)]
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+# "operation:p95=200,..." -> [(operation, percentile, milliseconds)]
+def parse_slos(text):
+    slos = []
+    for part in filter(None, (p.strip() for p in (text or '').split(','))):
+        target, _, limit = part.partition('=')
+        name, _, percentile = target.partition(':')
+        if name not in OPERATIONS and name != 'all' or percentile not in ('p50', 'p95', 'p99', 'max'):
+            raise ValueError(f"Invalid SLO {part!r}, expected e.g. answer_hit:p95=200")
+        slos.append((name, percentile, float(limit)))
+    return slos
+
+
+# Nearest-rank percentile of an ascending list
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+# Latencies and failures per operation, shared by all kiosk threads
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.error_samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, error=None):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds * 1000)
+            if error is not None:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                self.error_samples.setdefault(name, str(error))
+
+    # Per-operation and overall summary for a run that took `elapsed` seconds
+    def summary(self, elapsed):
+        def stats(latencies, errors):
+            ordered = sorted(latencies)
+            return {
+                'requests': len(ordered),
+                'errors': errors,
+                'throughput_rps': round(len(ordered) / elapsed, 2),
+                'p50_ms': round(percentile(ordered, 50), 2),
+                'p95_ms': round(percentile(ordered, 95), 2),
+                'p99_ms': round(percentile(ordered, 99), 2),
+                'max_ms': round(ordered[-1], 2),
+            }
+
+        with self._lock:
+            operations = {name: {**stats(latencies, self.errors.get(name, 0)),
+                                 **({'first_error': self.error_samples[name]} if name in self.error_samples else {})}
+                          for name, latencies in sorted(self.latencies.items())}
+            everything = [ms for latencies in self.latencies.values() for ms in latencies]
+            total = stats(everything, sum(self.errors.values())) if everything else None
+        return {'operations': operations, 'all': total}
+
+
+# Q&A entries and uploads created by one run, all tagged so they can be
+# found and removed afterwards
+class Workload:
+    def __init__(self, base_url, seed_count, upload_size, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.tag = f"loadtest{uuid.uuid4().hex[:8]}"
+        self.upload_size = upload_size
+        self.entries = [self.tagged(qa) for qa in synthetic_qa(seed_count, seed=seed)]
+        self.deletable = []
+        self.uploads = []
+        self.counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def tagged(self, qa):
+        return {'id': str(uuid.uuid4()), 'question': f"{qa['question']} {self.tag}",
+                'answer': f"{qa['answer']} ({self.tag})"}
+
+    def upsert(self, session, entries):
+        body = '\n'.join(json.dumps({'op': 'upsert', **qa}) for qa in entries)
+        response = session.post(self.url('/bulk_qa'), data=body.encode('utf-8'),
+                                headers={'Content-Type': 'application/x-ndjson'}, timeout=TIMEOUT)
+        expect(response, lambda r: r.json().get('status') == 'success')
+
+    def setup(self, session):
+        self.upsert(session, self.entries)
+
+    # Remove every Q&A entry carrying the tag and every uploaded image
+    def cleanup(self, session):
+        listing = expect(session.get(self.url('/get_qas?fields=id,question'), timeout=TIMEOUT)).json()
+        ids = [qa['id'] for qa in listing.get('qas', []) if self.tag in qa.get('question', '')]
+        if ids:
+            body = '\n'.join(json.dumps({'op': 'delete', 'id': qa_id}) for qa_id in ids)
+            expect(session.post(self.url('/bulk_qa'), data=body.encode('utf-8'),
+                                headers={'Content-Type': 'application/x-ndjson'}, timeout=TIMEOUT))
+        for name in self.uploads:
+            session.delete(self.url(f"/delete_image/{name}"), timeout=TIMEOUT)
+        return len(ids), len(self.uploads)
+
+    def ask(self, session, path, question, sources):
+        response = expect(session.post(self.url(path), json={'question': question}, timeout=TIMEOUT))
+        if path.endswith('_stream'):
+            events = [line[6:] for line in response.text.splitlines() if line.startswith('data: ')]
+            body = json.loads(events[-1]) if events else {}
+        else:
+            body = response.json()
+        # Failed answers come back as 200 with an apology and no source
+        if body.get('source') not in sources:
+            raise RequestFailed(f"answer without source {sources}: {body.get('answer', '')[:100]}")
+
+    def answer_hit(self, session, rng):
+        question = rng.choice(self.entries)['question']
+        if rng.random() < 0.3:
+            question = paraphrase(question, rng)
+        self.ask(session, '/get_answer', question, ('custom',))
+
+    # A question nobody asked before, so it is neither in the Q&A nor cached
+    def fresh_miss(self, rng):
+        return f"{miss_question(next(self.counter), rng)} {self.tag}"
+
+    def answer_miss(self, session, rng):
+        self.ask(session, '/get_answer', self.fresh_miss(rng), ('perplexity',))
+
+    def answer_stream_miss(self, session, rng):
+        self.ask(session, '/get_answer_stream', self.fresh_miss(rng), ('perplexity',))
+
+    def list_qas(self, session, rng):
+        expect(session.get(self.url(f"/get_qas?limit=50&offset={rng.randrange(len(self.entries))}"),
+                           timeout=TIMEOUT))
+
+    def add_qa(self, session, rng):
+        expect(session.post(self.url('/add_qa'), timeout=TIMEOUT, data={
+            'question': f"added question {next(self.counter)} {self.tag}", 'answer': f"added answer {self.tag}"}))
+
+    # Keeps the question, so answer_hit still finds the entry
+    def update_qa(self, session, rng):
+        qa = rng.choice(self.entries)
+        expect(session.put(self.url(f"/update_qa/{qa['id']}"), timeout=TIMEOUT, json={
+            'question': qa['question'], 'answer': f"updated answer {next(self.counter)} ({self.tag})"}))
+
+    # Deletes entries seeded for the purpose, seeding a new batch when needed
+    def delete_qa(self, session, rng):
+        with self._lock:
+            qa_id = self.deletable.pop() if self.deletable else None
+        if qa_id is None:
+            batch = [self.tagged({'question': f"deletable question {next(self.counter)}", 'answer': 'deletable'})
+                     for _ in range(DELETE_BATCH)]
+            self.upsert(session, batch)
+            with self._lock:
+                self.deletable.extend(qa['id'] for qa in batch)
+            raise Reseeded()
+        expect(session.delete(self.url(f"/delete_qa/{qa_id}"), timeout=TIMEOUT))
+
+    def upload_image(self, session, rng):
+        body = GIF_PIXEL + media_body(next(self.counter), self.upload_size, seed=self.tag)
+        response = expect(session.post(self.url('/upload_image'), timeout=TIMEOUT,
+                                       files={'image': (f"{self.tag}.gif", body, 'image/gif')}))
+        data = response.json()
+        if not data.get('duplicate'):
+            with self._lock:
+                self.uploads.append(data['filename'])
+
+    def list_images(self, session, rng):
+        expect(session.get(self.url('/get_images?limit=50'), timeout=TIMEOUT))
+
+
+# Raised by delete_qa when it only refilled its pool; not recorded
+class Reseeded(Exception):
+    pass
+
+
+OPERATIONS = {name: getattr(Workload, name) for name in (
+    'answer_hit', 'answer_miss', 'answer_stream_miss', 'list_qas', 'add_qa', 'update_qa', 'delete_qa',
+    'upload_image', 'list_images')}
+
+
+# One kiosk: one connection, operations drawn from the mix until `deadline`.
+# Requests finishing before `record_after` (the warm-up) are not recorded.
+def kiosk(workload, recorder, mix, deadline, record_after, think_time, seed):
+    rng = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.monotonic()
+            error = None
+            try:
+                OPERATIONS[name](workload, session, rng)
+            except Reseeded:
+                continue
+            except (RequestFailed, requests.RequestException, ValueError) as e:
+                error = e
+            end = time.monotonic()
+            if end >= record_after and end <= deadline:
+                recorder.record(name, end - start, error)
+            if think_time:
+                time.sleep(rng.uniform(0, 2 * think_time))
+
+
+def run_load(workload, mix, concurrency, duration, warmup, think_time):
+    recorder = Recorder()
+    start = time.monotonic()
+    record_after = start + warmup
+    deadline = record_after + duration
+    threads = [threading.Thread(target=kiosk, daemon=True,
+                                args=(workload, recorder, mix, deadline, record_after, think_time, n))
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(duration)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_healthy(base_url, process=None, timeout=60):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{base_url}/health did not answer within {timeout}s")
+
+
+# Start `command` with PORT and the stub as its upstream; output goes to
+# a log file so a crash can be looked into
+def start_server(command, port, stub_url, log_path):
+    env = {
+        **os.environ,
+        'PORT': str(port),
+        'PERPLEXITY_BASE_URL': stub_url,
+        'PERPLEXITY_API_KEY': os.getenv('PERPLEXITY_API_KEY') or 'loadtest',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        'METRICS_DIR': tempfile.mkdtemp(prefix='tina-loadtest-metrics-'),
+    }
+    log = open(log_path, 'w')
+    return subprocess.Popen(shlex.split(command), cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def print_report(report):
+    print(f"\n{'operation':<20} {'requests':>9} {'errors':>7} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = list(report['operations'].items())
+    if report['all']:
+        rows.append(('all', report['all']))
+    for name, s in rows:
+        print(f"{name:<20} {s['requests']:>9} {s['errors']:>7} {s['throughput_rps']:>9.1f} "
+              f"{s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+    for name, s in report['operations'].items():
+        if 'first_error' in s:
+            print(f"  {name}: first error: {s['first_error']}")
+
+
+# SLO targets that were missed, as messages
+def failed_slos(report, slos):
+    failures = []
+    for name, which, limit in slos:
+        stats = report['all'] if name == 'all' else report['operations'].get(name)
+        if stats is None:
+            failures.append(f"{name}: no requests")
+        elif stats[f"{which}_ms"] > limit:
+            failures.append(f"{name} {which} {stats[f'{which}_ms']:.1f} ms > {limit:.1f} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive a realistic request mix against the app')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='server to test (ignored with --server)')
+    parser.add_argument('--server', help='command starting the server, run here with the stub as upstream')
+    parser.add_argument('--concurrency', type=int, default=20, help='simulated kiosks')
+    parser.add_argument('--duration', type=float, default=30, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds run before measuring')
+    parser.add_argument('--think-time', type=float, default=0, help='mean pause between a kiosk\'s requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='operation=weight,...')
+    parser.add_argument('--seed-qa', type=int, default=500, help='Q&A entries seeded for answer hits')
+    parser.add_argument('--upload-size', type=int, default=64 * 1024, help='bytes per uploaded image')
+    parser.add_argument('--stub-port', type=int, help='run the stub upstream on this port (implied by --server)')
+    parser.add_argument('--stub-latency', type=float, default=1.0)
+    parser.add_argument('--stub-jitter', type=float, default=0.5)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    parser.add_argument('--slo', help='targets like answer_hit:p95=200,all:p99=3000')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        slos = parse_slos(args.slo)
+    except ValueError as e:
+        parser.error(str(e))
+
+    stub = server = None
+    base_url = args.url
+    try:
+        if args.server or args.stub_port is not None:
+            stub = StubUpstream(args.stub_latency, host='127.0.0.1', port=args.stub_port or 0,
+                                jitter=args.stub_jitter, error_rate=args.stub_error_rate).start()
+            print(f"Stub upstream on {stub.url} (latency {args.stub_latency}s + up to {args.stub_jitter}s, "
+                  f"error rate {args.stub_error_rate:.0%})")
+        if args.server:
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            log_path = os.path.join(tempfile.gettempdir(), f"tina-loadtest-server-{port}.log")
+            server = start_server(args.server, port, stub.url, log_path)
+            print(f"Started {args.server!r} on {base_url} (output in {log_path})")
+        wait_until_healthy(base_url, server)
+
+        workload = Workload(base_url, args.seed_qa, args.upload_size)
+        with requests.Session() as session:
+            workload.setup(session)
+        print(f"Running {args.concurrency} kiosks for {args.warmup:g}s warm-up + {args.duration:g}s against {base_url}")
+        try:
+            report = run_load(workload, mix, args.concurrency, args.duration, args.warmup, args.think_time)
+        finally:
+            with requests.Session() as session:
+                removed, uploads = workload.cleanup(session)
+            print(f"Removed {removed} Q&A entries and {uploads} uploads created by the test")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if stub is not None:
+            stub.stop()
+
+    report['config'] = {
+        'url': base_url,
+        'server': args.server,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'think_time_s': args.think_time,
+        'mix': dict(mix),
+        'stub': {'latency_s': args.stub_latency, 'jitter_s': args.stub_jitter,
+                 'error_rate': args.stub_error_rate} if stub else None,
+        'upstream_errors_sent': stub.errors_sent if stub else None,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Wrote {args.output}")
+
+    failures = failed_slos(report, slos)
+    for failure in failures:
+        print(f"❌ SLO missed: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    from flask import g, has_request_context
+except ImportError:  # logging also works outside the web app
+    has_request_context = None
+
+# Records waiting for the writer thread; beyond this they are dropped rather
+# than blocking the request that logged them
+QUEUE_SIZE = 10000
+# Request ID for code outside a Flask request context (the async routes)
+request_id_var = contextvars.ContextVar('request_id', default=None)
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(request_id)s - %(message)s'
+# Standard LogRecord attributes; anything else was passed with extra= and is
+# included in JSON output
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+
+# One JSON object per line with the time, level, logger, message, request ID
+# and any extra= fields (e.g. duration_ms)
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Tags records with the ID of the request being handled (from flask.g or
+# request_id_var), captured in the logging thread before the record is queued
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            request_id = None
+            if has_request_context is not None and has_request_context():
+                request_id = g.get('request_id')
+            record.request_id = request_id or request_id_var.get() or '-'
+        return True
+
+
+# Keeps only a fraction of the INFO records logged with extra={'sample': True};
+# other records always pass
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not getattr(record, 'sample', False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class _Listener(QueueListener):
+    # The stop sentinel waits for room instead of failing on a full queue
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# QueueHandler that never blocks: a full queue drops the record and counts
+# it. Records are queued as they are, so the message is formatted (and any
+# exception rendered by the formatter) in the writer thread rather than in
+# the request. The writer thread is (re)started in whichever process logs,
+# so it also runs in gunicorn workers forked after the app was imported.
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, handler):
+        super().__init__(queue.Queue(QUEUE_SIZE))
+        self.handler = handler
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Records queued before a fork belong to the parent
+            self.queue = queue.Queue(QUEUE_SIZE)
+            self._listener = _Listener(self.queue, self.handler, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    # QueueHandler.prepare would format the message here and fold exc_info
+    # into it; the writer thread's formatter does both instead
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # Write out everything queued so far and stop the writer thread
+    def stop(self):
+        listener = self._listener
+        if listener is not None and self._pid == os.getpid():
+            self._listener = None
+            self._pid = None
+            listener.stop()
+
+
+# Route the root logger through a queue drained by a background thread.
+# fmt is "text" or "json"; sample_rate applies to records logged with
+# extra={'sample': True}. Returns the queue handler.
+def configure_logging(level='INFO', fmt='text', sample_rate=1.0, stream=None):
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        handler.setFormatter(JSONFormatter())
+    elif fmt == 'text':
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        raise ValueError(f"Unknown LOG_FORMAT: {fmt}")
+    queue_handler = NonBlockingQueueHandler(handler)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    return queue_handler
+
+
+# Milliseconds since a time.perf_counter() start, for duration_ms fields
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 3)
@@ -0,0 +1,215 @@
+import json
+import mimetypes
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+ITEM_COLUMNS = 'stored_name, id, number, size, mime_type, uploaded_at, sha256, original_name, derivatives'
+
+
+# Catalog of uploaded media files of one kind ("video" or "image") kept in a
+# SQLite table next to the app, so listings, name allocation and display
+# numbering never need to scan the upload folder. Display numbers are handed
+# out once per kind and never reused, so "Video 3" stays "Video 3" when an
+# earlier video is deleted. If the catalog has never been built for a kind
+# (e.g. the database file is missing) it is rebuilt from the folder contents.
+# New files are stored content-addressed (named after their SHA-256), so the
+# same content uploaded twice is only stored once.
+class MediaCatalog:
+    def __init__(self, db_path, kind, folder, allowed_extensions, timeout=5.0):
+        self.db_path = db_path
+        self.kind = kind
+        self.folder = folder
+        self.allowed_extensions = allowed_extensions
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ready = False
+        self._setup_lock = threading.Lock()
+
+    # Create the table (and rebuild the catalog from the folder if it was never
+    # built) on first use rather than on import, so importing the app touches
+    # no files
+    def _setup(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""CREATE TABLE IF NOT EXISTS media (
+                kind TEXT NOT NULL,
+                stored_name TEXT NOT NULL,
+                id TEXT NOT NULL UNIQUE,
+                number INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mime_type TEXT,
+                uploaded_at REAL NOT NULL,
+                sha256 TEXT,
+                original_name TEXT,
+                derivatives TEXT,
+                PRIMARY KEY (kind, stored_name)
+            )""")
+            # Catalogs created by older versions lack the newer columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(media)")}
+            for column in ('sha256', 'original_name', 'derivatives'):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE media ADD COLUMN {column} TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS media_number ON media (kind, number)")
+            conn.execute("CREATE INDEX IF NOT EXISTS media_sha256 ON media (kind, sha256)")
+            conn.execute("CREATE TABLE IF NOT EXISTS media_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            built = conn.execute("SELECT value FROM media_meta WHERE key = ?", (f"{self.kind}_built",)).fetchone()
+            if not built:
+                self._rebuild(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    # One connection per thread, reopened after a fork
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        if not self._ready:
+            with self._setup_lock:
+                if not self._ready:
+                    self._setup(conn)
+                    self._ready = True
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _meta(self, conn, key):
+        row = conn.execute("SELECT value FROM media_meta WHERE key = ?", (f"{self.kind}_{key}",)).fetchone()
+        return row[0] if row else 0
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO media_meta (key, value) VALUES (?, ?)", (f"{self.kind}_{key}", value))
+
+    def _bump_version(self, conn):
+        self._set_meta(conn, 'version', self._meta(conn, 'version') + 1)
+
+    def _allowed(self, filename):
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.allowed_extensions
+
+    # Index the files already in the folder, oldest first
+    def _rebuild(self, conn):
+        conn.execute("DELETE FROM media WHERE kind = ?", (self.kind,))
+        files = []
+        if os.path.isdir(self.folder):
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and self._allowed(entry.name):
+                    st = entry.stat()
+                    files.append((st.st_mtime, entry.name, st.st_size))
+        files.sort()
+        for number, (mtime, name, size) in enumerate(files, 1):
+            conn.execute("INSERT INTO media VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?, NULL)",
+                         (self.kind, name, uuid.uuid4().hex, number, size, mimetypes.guess_type(name)[0], mtime, name))
+        self._set_meta(conn, 'next_number', len(files) + 1)
+        self._set_meta(conn, 'built', 1)
+        self._bump_version(conn)
+        logger.info('Rebuilt %s catalog from %s: %s files', self.kind, self.folder, len(files))
+
+    def rebuild(self):
+        with self._transaction() as conn:
+            self._rebuild(conn)
+
+    def _row_to_item(self, row):
+        stored_name, media_id, number, size, mime_type, uploaded_at, sha256, original_name, derivatives = row
+        return {
+            'id': stored_name,
+            'media_id': media_id,
+            'stored_name': stored_name,
+            'number': number,
+            'size': size,
+            'mime_type': mime_type,
+            'uploaded_at': uploaded_at,
+            'sha256': sha256,
+            'original_name': original_name,
+            'derivatives': json.loads(derivatives) if derivatives else None,
+        }
+
+    def _find_hash(self, conn, sha256):
+        row = conn.execute(f"SELECT {ITEM_COLUMNS} FROM media WHERE kind = ? AND sha256 = ?",
+                           (self.kind, sha256)).fetchone()
+        return self._row_to_item(row) if row else None
+
+    # Catalogued file with this content, if any
+    def find_by_hash(self, sha256):
+        return self._find_hash(self._conn(), sha256)
+
+    # Move a fully written file at `path` into the folder under its content
+    # hash and catalog it with the next display number. If the same content is
+    # already catalogued the file is dropped instead. Returns (item, duplicate).
+    def adopt(self, path, original_name, sha256):
+        ext = os.path.splitext(original_name)[1].lower()
+        with self._transaction() as conn:
+            existing = self._find_hash(conn, sha256)
+            if existing is not None:
+                os.remove(path)
+                return existing, True
+            stored_name = f"{sha256}{ext}"
+            size = os.path.getsize(path)
+            shutil.move(path, os.path.join(self.folder, stored_name))
+            number = self._meta(conn, 'next_number') or 1
+            conn.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                         (self.kind, stored_name, uuid.uuid4().hex, number, size,
+                          mimetypes.guess_type(stored_name)[0], time.time(), sha256, original_name))
+            self._set_meta(conn, 'next_number', number + 1)
+            self._bump_version(conn)
+        return self.get(stored_name), False
+
+    # Record the generated derivatives (thumbnails etc.) of a file
+    def set_derivatives(self, stored_name, derivatives):
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE media SET derivatives = ? WHERE kind = ? AND stored_name = ?",
+                                  (json.dumps(derivatives), self.kind, stored_name))
+            if cursor.rowcount:
+                self._bump_version(conn)
+            return cursor.rowcount > 0
+
+    def get(self, stored_name):
+        row = self._conn().execute(
+            f"SELECT {ITEM_COLUMNS} FROM media WHERE kind = ? AND stored_name = ?",
+            (self.kind, stored_name)).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def remove(self, stored_name):
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM media WHERE kind = ? AND stored_name = ?", (self.kind, stored_name))
+            if cursor.rowcount:
+                self._bump_version(conn)
+            return cursor.rowcount > 0
+
+    # One page of items in upload order, plus the total count
+    def page(self, offset=0, limit=None):
+        conn = self._conn()
+        rows = conn.execute(
+            f"SELECT {ITEM_COLUMNS} FROM media WHERE kind = ? "
+            "ORDER BY number LIMIT ? OFFSET ?",
+            (self.kind, -1 if limit is None else limit, offset)).fetchall()
+        total = conn.execute("SELECT COUNT(*) FROM media WHERE kind = ?", (self.kind,)).fetchone()[0]
+        return [self._row_to_item(row) for row in rows], total
+
+    # Changes on every upload or delete, in every worker
+    def version(self):
+        return self._meta(self._conn(), 'version')
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Media delivery: fingerprinted URLs, Range requests and precompressed assets.
+
+Files are served from /media/<fingerprint>/<path>, where the fingerprint is
+derived from the file content, so the response can be cached forever
+(Cache-Control: immutable). Single ranges are served straight from the file
+(zero-copy sendfile under gunicorn), multiple ranges as multipart/byteranges.
+Text assets get .br/.gz sidecars written by this script, which are picked by
+Accept-Encoding. Behind nginx or Apache the body can be handed off with
+X-Accel-Redirect or X-Sendfile instead.
+
+Usage (write .gz/.br sidecars): python media_delivery.py static
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import threading
+import uuid
+from flask import Response, request
+from werkzeug.http import quote_etag
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz sidecars are written without it
+    brotli = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+FINGERPRINT_LENGTH = 16
+# Text assets worth precompressing
+TEXT_EXTENSIONS = {'.css', '.js', '.html', '.svg', '.json', '.txt', '.map'}
+# Sidecar suffix per Content-Encoding, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+# More ranges than this (after merging) are answered with the whole file
+MAX_RANGES = 16
+BLOCK_SIZE = 64 * 1024
+
+_CONTENT_ADDRESSED = re.compile(r'^([0-9a-f]{64})(-[\w-]+)?$')
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+# Content fingerprint of a file, cached per (mtime, size). Uploads named after
+# their SHA-256, and derivatives named <sha256>-<variant>, are fingerprinted
+# from the name without reading them.
+def fingerprint(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if _CONTENT_ADDRESSED.match(stem):
+        return stem[:FINGERPRINT_LENGTH]
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+    value = hasher.hexdigest()[:FINGERPRINT_LENGTH]
+    with _fingerprints_lock:
+        _fingerprints[path] = (key, value)
+    return value
+
+
+# Precompressed sidecar to send for this request, as (path, encoding)
+def choose_variant(path):
+    if os.path.splitext(path)[1].lower() not in TEXT_EXTENSIONS:
+        return path, None
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.exists(path + suffix):
+            sidecar = path + suffix
+            # A sidecar older than its source is stale
+            if os.path.getmtime(sidecar) >= os.path.getmtime(path):
+                return sidecar, encoding
+    return path, None
+
+
+# Byte ranges of a Range header as (start, stop) pairs clipped to the file,
+# dropping unsatisfiable ones. Unlike werkzeug's parser this accepts ranges
+# out of order or overlapping, which players do send. None if malformed.
+def parse_ranges(header, length):
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for item in spec.split(','):
+        first, dash, last = item.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:
+                start, stop = max(length - int(last), 0), length
+            else:
+                start = int(first)
+                stop = min(int(last) + 1, length) if last else length
+                if last and int(last) < start:
+                    return None
+        except ValueError:
+            return None
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+# Satisfiable byte ranges of the request as sorted, merged (start, stop)
+# pairs; None when the whole file should be sent, [] when no range can be
+# satisfied
+def requested_ranges(length, etag):
+    header = request.headers.get('Range')
+    if not header or request.method not in ('GET', 'HEAD'):
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range.strip() != etag:
+        return None
+    ranges = parse_ranges(header, length)
+    if ranges is None:
+        return None
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def _read_range(f, start, stop):
+    f.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        block = f.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+
+# Body for bytes [start, stop) of an open file. Under a server with
+# wsgi.file_wrapper (gunicorn) the file is handed over as is, seeked to start;
+# the server sends Content-Length bytes from there with sendfile.
+def _file_body(f, start, stop, length):
+    if 'wsgi.file_wrapper' in request.environ or stop == length:
+        f.seek(start)
+        return wrap_file(request.environ, f, BLOCK_SIZE)
+
+    def generate():
+        with f:
+            yield from _read_range(f, start, stop)
+    return generate()
+
+
+def _multipart_body(path, ranges, length, mimetype, boundary):
+    def generate():
+        with open(path, 'rb') as f:
+            for start, stop in ranges:
+                yield _part_header(boundary, mimetype, start, stop, length)
+                yield from _read_range(f, start, stop)
+                yield b'\r\n'
+            yield f"--{boundary}--\r\n".encode('ascii')
+    return generate()
+
+
+def _part_header(boundary, mimetype, start, stop, length):
+    return (f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n").encode('ascii')
+
+
+# Response for a file on disk with Range, conditional and precompressed
+# variant support. `offload` is None, "x-accel" (nginx; `accel_path` is the
+# internal location of the file) or "x-sendfile" (Apache/lighttpd).
+def send_media(path, cache_control=IMMUTABLE, offload=None, accel_path=None):
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    headers = {'Cache-Control': cache_control, 'Accept-Ranges': 'bytes'}
+    if offload == 'x-accel':
+        # nginx does Range, conditionals and gzip_static itself
+        headers['X-Accel-Redirect'] = accel_path
+        return Response(status=200, mimetype=mimetype, headers=headers)
+
+    source_path = path
+    path, encoding = choose_variant(path)
+    if os.path.splitext(source_path)[1].lower() in TEXT_EXTENSIONS:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    etag = quote_etag(fingerprint(source_path) + (f"-{encoding}" if encoding else ''))
+    headers['ETag'] = etag
+
+    if request.if_none_match.contains_raw(etag):
+        return Response(status=304, headers=headers)
+    if offload == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(status=200, mimetype=mimetype, headers=headers)
+
+    length = os.path.getsize(path)
+    ranges = requested_ranges(length, etag)
+    if ranges is not None and not ranges:
+        headers['Content-Range'] = f"bytes */{length}"
+        return Response(status=416, headers=headers)
+    if not ranges:
+        response = Response(_file_body(open(path, 'rb'), 0, length, length), status=200,
+                            mimetype=mimetype, headers=headers, direct_passthrough=True)
+        response.content_length = length
+        return response
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+        response = Response(_file_body(open(path, 'rb'), start, stop, length), status=206,
+                            mimetype=mimetype, headers=headers, direct_passthrough=True)
+        response.content_length = stop - start
+        return response
+    boundary = uuid.uuid4().hex
+    content_length = sum(len(_part_header(boundary, mimetype, start, stop, length)) + stop - start + 2
+                         for start, stop in ranges) + len(boundary) + 6
+    response = Response(_multipart_body(path, ranges, length, mimetype, boundary), status=206,
+                        content_type=f"multipart/byteranges; boundary={boundary}", headers=headers,
+                        direct_passthrough=True)
+    response.content_length = content_length
+    return response
+
+
+# Write .gz (and .br with brotli installed) next to every text asset whose
+# sidecar is missing or older than the asset
+def compress_assets(roots):
+    written = 0
+    for root in roots:
+        for folder, _, files in os.walk(root):
+            for name in files:
+                if os.path.splitext(name)[1].lower() not in TEXT_EXTENSIONS:
+                    continue
+                path = os.path.join(folder, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                for encoding, suffix in ENCODINGS:
+                    if encoding == 'br' and brotli is None:
+                        continue
+                    sidecar = path + suffix
+                    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+                        continue
+                    if encoding == 'br':
+                        compressed = brotli.compress(data, quality=11)
+                    else:
+                        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                    with open(sidecar, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+    return written
+
+
+def main():
+    roots = sys.argv[1:] or ['static']
+    written = compress_assets(roots)
+    print(f"✅ Wrote {written} precompressed files under {', '.join(roots)}")
+    if brotli is None:
+        print("⚠️ brotli is not installed; only .gz files were written")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Background derivative pipeline for uploaded images and the header animation.
+
+Resizing runs in a process pool (spawned, so it never forks a request worker
+mid-request) and never blocks the request that queued it. Job state lives in
+the media catalog database, so every gunicorn worker sees the same queue and
+a derivative is only produced once even if several workers ask for it.
+
+Usage (build the header animation now): python media_jobs.py static/images/your-gif.gif
+"""
+
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 320
+RESPONSIVE_WIDTHS = (640, 1280, 1920)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+# Jobs not finished after this many seconds are assumed lost with their process
+JOB_TIMEOUT = 600
+
+
+# Pillow is optional and only imported by the pool processes that use it;
+# jobs fail with a clear error without it
+def _pillow_installed():
+    return importlib.util.find_spec('PIL') is not None
+
+
+def _require_pillow():
+    if not _pillow_installed():
+        raise RuntimeError('Pillow is not installed')
+
+
+def _save_pair(image, output_folder, name):
+    from PIL import Image
+    webp_name = f"{name}.webp"
+    jpeg_name = f"{name}.jpg"
+    image.save(os.path.join(output_folder, webp_name), 'WEBP', quality=WEBP_QUALITY, method=4)
+    # JPEG has no alpha channel; flatten transparent images onto white
+    flat = image
+    if image.mode == 'RGBA':
+        flat = Image.new('RGB', image.size, (255, 255, 255))
+        flat.paste(image, mask=image.getchannel('A'))
+    flat.convert('RGB').save(os.path.join(output_folder, jpeg_name), 'JPEG', quality=JPEG_QUALITY,
+                             optimize=True, progressive=True)
+    return {'webp': webp_name, 'jpeg': jpeg_name, 'width': image.width, 'height': image.height}
+
+
+# Thumbnail and responsive widths of one image as WebP and JPEG, named
+# <basename>-thumb / <basename>-w<width>. Only widths smaller than the
+# original are produced. Runs in a pool process.
+def make_image_derivatives(source, output_folder, basename):
+    _require_pillow()
+    from PIL import Image, ImageOps
+    os.makedirs(output_folder, exist_ok=True)
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        thumbnail = image.copy()
+        thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+        derivatives = {'thumbnail': _save_pair(thumbnail, output_folder, f"{basename}-thumb"), 'widths': []}
+        for width in RESPONSIVE_WIDTHS:
+            if width >= image.width:
+                break
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+            derivatives['widths'].append(_save_pair(resized, output_folder, f"{basename}-w{width}"))
+    return derivatives
+
+
+# Animated WebP of an animated GIF, plus an MP4 when ffmpeg is available.
+# Returns the names written into output_folder. Runs in a pool process.
+def make_animation_derivatives(source, output_folder, basename):
+    _require_pillow()
+    from PIL import Image, ImageSequence
+    os.makedirs(output_folder, exist_ok=True)
+    webp_name = f"{basename}.webp"
+    with Image.open(source) as gif:
+        frames = []
+        durations = []
+        for frame in ImageSequence.Iterator(gif):
+            durations.append(frame.info.get('duration', 100))
+            frames.append(frame.convert('RGBA'))
+        tmp_path = os.path.join(output_folder, f".{webp_name}.{os.getpid()}.tmp")
+        frames[0].save(tmp_path, 'WEBP', save_all=True, append_images=frames[1:], duration=durations,
+                       loop=gif.info.get('loop', 0), quality=WEBP_QUALITY, method=4)
+        os.replace(tmp_path, os.path.join(output_folder, webp_name))
+    derivatives = {'webp': webp_name, 'mp4': None}
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        mp4_name = f"{basename}.mp4"
+        tmp_path = os.path.join(output_folder, f".{os.getpid()}.{mp4_name}")
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-i', source, '-movflags', 'faststart',
+                        '-pix_fmt', 'yuv420p', '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-an', tmp_path],
+                       check=True, timeout=JOB_TIMEOUT)
+        os.replace(tmp_path, os.path.join(output_folder, mp4_name))
+        derivatives['mp4'] = mp4_name
+    return derivatives
+
+
+TASKS = {
+    'image': make_image_derivatives,
+    'animation': make_animation_derivatives,
+}
+
+
+# Queue of derivative jobs. `submit` claims a (task, key) job in the shared
+# job table and runs it in the process pool; `on_done(result)` is called in
+# this process when it succeeds. A job that is queued or done is not claimed
+# again, except when it has been queued for longer than JOB_TIMEOUT.
+class DerivativeJobs:
+    def __init__(self, db_path, workers=1, executor=None, timeout=5.0):
+        self.db_path = db_path
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = executor
+        self._executor_pid = os.getpid() if executor else None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = 0
+        self._ready = False
+        self._setup_lock = threading.Lock()
+
+    # Create the jobs table on first use rather than on import
+    def _setup(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""CREATE TABLE IF NOT EXISTS media_jobs (
+                task TEXT NOT NULL,
+                key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (task, key)
+            )""")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    # One connection per thread, reopened after a fork
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        if not self._ready:
+            with self._setup_lock:
+                if not self._ready:
+                    self._setup(conn)
+                    self._ready = True
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    # The pool is created on first use in each process, so gunicorn workers
+    # each get their own and the master never starts one
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _claim(self, task, key):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state, updated_at FROM media_jobs WHERE task = ? AND key = ?",
+                               (task, key)).fetchone()
+            if row and row[0] == 'done':
+                return False
+            if row and row[0] == 'queued' and now - row[1] < JOB_TIMEOUT:
+                return False
+            conn.execute("INSERT OR REPLACE INTO media_jobs VALUES (?, ?, 'queued', NULL, ?, ?)",
+                         (task, key, now, now))
+            return True
+
+    def _set_state(self, task, key, state, error=None):
+        with self._transaction() as conn:
+            conn.execute("UPDATE media_jobs SET state = ?, error = ?, updated_at = ? WHERE task = ? AND key = ?",
+                         (state, error, time.time(), task, key))
+
+    # Queue TASKS[task](*args) unless the job is already queued or done.
+    # Returns True when a new job was queued.
+    def submit(self, task, key, args, on_done=None):
+        if not self._claim(task, key):
+            return False
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._pool().submit(TASKS[task], *args)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+            self._set_state(task, key, 'failed', str(e))
+            raise
+
+        def finished(future):
+            with self._lock:
+                self._pending -= 1
+            try:
+                result = future.result()
+                if on_done is not None:
+                    on_done(result)
+                self._set_state(task, key, 'done')
+                logger.info('Derivative job %s %s done', task, key)
+            except Exception as e:
+                logger.error('Derivative job %s %s failed: %s', task, key, e)
+                self._set_state(task, key, 'failed', str(e))
+
+        future.add_done_callback(finished)
+        return True
+
+    # False when Pillow is missing and every job would fail
+    @property
+    def available(self):
+        return _pillow_installed()
+
+    def state(self, task, key):
+        row = self._conn().execute("SELECT state FROM media_jobs WHERE task = ? AND key = ?", (task, key)).fetchone()
+        return row[0] if row else None
+
+    # Forget a job so it can run again (e.g. after its source was deleted)
+    def forget(self, task, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM media_jobs WHERE task = ? AND key = ?", (task, key))
+
+    # Job counts by state for all workers, plus this process's pool and the
+    # most recent jobs
+    def stats(self, recent=20):
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT state, COUNT(*) FROM media_jobs GROUP BY state").fetchall())
+        rows = conn.execute("SELECT task, key, state, error, created_at, updated_at FROM media_jobs "
+                            "ORDER BY updated_at DESC LIMIT ?", (recent,)).fetchall()
+        with self._lock:
+            pending = self._pending
+        return {
+            'available': self.available,
+            'workers': self.workers,
+            'pending_in_process': pending,
+            'counts': {state: counts.get(state, 0) for state in ('queued', 'done', 'failed')},
+            'recent': [
+                {'task': task, 'key': key, 'state': state, 'error': error, 'created_at': created_at,
+                 'updated_at': updated_at}
+                for task, key, state, error, created_at, updated_at in rows
+            ],
+        }
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python media_jobs.py <animated.gif>")
+        return 1
+    source = sys.argv[1]
+    folder = os.path.join(os.path.dirname(source), 'derived')
+    result = make_animation_derivatives(source, folder, os.path.splitext(os.path.basename(source))[0])
+    for name in filter(None, result.values()):
+        path = os.path.join(folder, name)
+        print(f"✅ {path}: {os.path.getsize(path)} bytes (from {os.path.getsize(source)})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
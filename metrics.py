@@ -0,0 +1,224 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self.registry.check_process()
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.changed()
+
+    def snapshot(self):
+        return {json.dumps(key): value for key, value in self.values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def render(self, values):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, json.loads(key))} {_format_number(value)}"
+
+
+# Cumulative histogram; stored per label set as [bucket counts..., sum, count]
+class Histogram:
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, amount, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self.registry.check_process()
+        with self.registry.lock:
+            value = self.values.get(key)
+            if value is None:
+                value = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value[i] += 1
+                    break
+            value[-2] += amount
+            value[-1] += 1
+        self.registry.changed()
+
+    # Time the block and observe its duration with the given labels
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        return {json.dumps(key): list(value) for key, value in self.values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self, values):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, value in sorted(values.items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, value):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', repr(float(bound))))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', '+Inf'))} {value[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(value[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {value[-1]}"
+
+
+# Metrics of this process, shared with the other gunicorn workers through a
+# snapshot file per process in `directory`. A background thread rewrites this
+# process's file at most every flush_interval seconds after a change, and
+# render() adds up every file, so a scrape served by any worker reports the
+# totals of all of them. Files of exited workers are kept so counters never
+# go backwards; a worker that reuses a PID carries the old file's values on.
+class Registry:
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), f"tina-metrics-{os.getppid()}")
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.metrics = []
+        self._pid = None
+        self._dirty = threading.Event()
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(self, name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"metrics_{pid}.json")
+
+    # First change in a process (including a freshly forked worker, whose
+    # inherited values belong to its parent) starts that process's flusher
+    def _start(self):
+        pid = os.getpid()
+        with self.lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                for metric in self.metrics:
+                    metric.values.clear()
+            self._pid = pid
+            self._dirty = threading.Event()
+            os.makedirs(self.directory, exist_ok=True)
+            try:
+                with open(self._path(pid)) as f:
+                    previous = json.load(f)
+            except (FileNotFoundError, ValueError):
+                previous = {}
+            for metric in self.metrics:
+                for key, value in previous.get(metric.name, {}).items():
+                    metric.values[tuple(json.loads(key))] = value
+        threading.Thread(target=self._flush_loop, args=(pid,), daemon=True).start()
+        atexit.register(self.flush)
+
+    def check_process(self):
+        if self._pid != os.getpid():
+            self._start()
+
+    def changed(self):
+        self._dirty.set()
+
+    def _flush_loop(self, pid):
+        while os.getpid() == pid:
+            self._dirty.wait()
+            time.sleep(self.flush_interval)
+            self._dirty.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Error writing metrics: %s', e)
+
+    def _snapshot(self):
+        with self.lock:
+            return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        path = self._path(self._pid)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp_path, path)
+
+    # Totals over every process in Prometheus text exposition format
+    def render(self):
+        totals = {metric.name: {} for metric in self.metrics}
+        snapshots = []
+        own = self._path(os.getpid())
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith('metrics_') and entry.name.endswith('.json') and entry.path != own:
+                    try:
+                        with open(entry.path) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+        if self._pid == os.getpid():
+            snapshots.append(self._snapshot())
+        for metric in self.metrics:
+            merged = totals[metric.name]
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, {}).items():
+                    merged[key] = metric.merge(merged.get(key), value)
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(totals[metric.name]))
+        return '\n'.join(lines) + '\n'
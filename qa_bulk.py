@@ -0,0 +1,114 @@
+import codecs
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BulkRowError(Exception):
+    pass
+
+
+# Read NDJSON from a binary stream: one JSON object per line, blank lines
+# ignored. Yields (row_number, row) where row is a BulkRowError for lines
+# that are not valid JSON, so one bad line does not stop the import.
+def iter_ndjson(stream):
+    row_number = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        row_number += 1
+        try:
+            yield row_number, json.loads(line)
+        except ValueError as e:
+            yield row_number, BulkRowError(f"Invalid JSON: {str(e)}")
+
+
+# Read a JSON array from a binary stream one element at a time, so large
+# uploads are never held in memory as a whole document. A syntax error ends
+# the stream with a BulkRowError for the row where it happened.
+def iter_json_array(stream):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    row_number = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    while True:
+        skip = ' \t\r\n,' if started else ' \t\r\n'
+        while pos < len(buffer) and buffer[pos] in skip:
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                if started:
+                    yield row_number + 1, BulkRowError("Unexpected end of JSON array")
+                return
+            fill()
+            continue
+        if not started:
+            if buffer[pos] != '[':
+                yield 1, BulkRowError("Body must be a JSON array or NDJSON")
+                return
+            started = True
+            pos += 1
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except ValueError as e:
+            # The element may just be cut off at the end of the buffer
+            if not eof:
+                fill()
+                continue
+            yield row_number + 1, BulkRowError(f"Invalid JSON: {str(e)}")
+            return
+        # A number at the end of the buffer may continue in the next chunk
+        if end == len(buffer) and not eof and not isinstance(value, (dict, list, str)):
+            fill()
+            continue
+        row_number += 1
+        pos = end
+        yield row_number, value
+
+
+# Pick the parser from the request content type
+def iter_bulk_rows(stream, content_type):
+    if content_type and 'ndjson' in content_type:
+        return iter_ndjson(stream)
+    return iter_json_array(stream)
+
+
+# Validate one bulk row and turn it into (op, data): ('insert', qa),
+# ('upsert', qa) or ('delete', qa_id). Questions are stored lowercased like
+# add_qa does. The op defaults to upsert when an id is given, else insert.
+def prepare_row(row):
+    if not isinstance(row, dict):
+        raise BulkRowError("Row must be a JSON object")
+    qa_id = row.get('id')
+    if qa_id is not None and not isinstance(qa_id, str):
+        raise BulkRowError("id must be a string")
+    op = row.get('op') or ('upsert' if qa_id else 'insert')
+    if op == 'delete':
+        if not qa_id:
+            raise BulkRowError("delete requires an id")
+        return op, qa_id
+    if op not in ('insert', 'upsert'):
+        raise BulkRowError(f"Unknown op: {op}")
+    question = str(row.get('question', '')).lower().strip()
+    answer = str(row.get('answer', '')).strip()
+    if not question or not answer:
+        raise BulkRowError("Question and answer cannot be empty")
+    if op == 'upsert' and not qa_id:
+        raise BulkRowError("upsert requires an id")
+    return op, {'id': qa_id, 'question': question, 'answer': answer}
@@ -0,0 +1,140 @@
+import re
+
+# Speech recognition often inserts hesitation sounds into the transcript
+FILLER_WORDS = {'um', 'umm', 'uh', 'uhh', 'uhm', 'er', 'erm', 'ah', 'hmm', 'mm'}
+
+# Whole-word contractions that the suffix rules below get wrong or miss,
+# plus common forms transcribed without the apostrophe
+CONTRACTIONS = {
+    "can't": 'cannot',
+    "won't": 'will not',
+    "shan't": 'shall not',
+    "let's": 'let us',
+    "ain't": 'is not',
+    'whats': 'what is',
+    'wheres': 'where is',
+    'whos': 'who is',
+    'hows': 'how is',
+    'thats': 'that is',
+    'im': 'i am',
+    'youre': 'you are',
+    'dont': 'do not',
+    'doesnt': 'does not',
+    'didnt': 'did not',
+    'isnt': 'is not',
+    'arent': 'are not',
+}
+
+# "'s" is only expanded after words where it means "is"; elsewhere it is
+# usually possessive and is dropped along with the other punctuation
+IS_CONTRACTION_WORDS = {
+    'what', 'who', 'where', 'when', 'why', 'how', 'that', 'it', 'there',
+    'here', 'he', 'she',
+}
+
+SUFFIX_CONTRACTIONS = [
+    ("n't", ' not'),
+    ("'re", ' are'),
+    ("'ll", ' will'),
+    ("'ve", ' have'),
+    ("'d", ' would'),
+    ("'m", ' am'),
+]
+
+_APOSTROPHES_RE = re.compile(r"[‘’ʼ`]")
+_PUNCTUATION_RE = re.compile(r"[^\w\s']+")
+
+
+def _expand_contraction(word):
+    if word in CONTRACTIONS:
+        return CONTRACTIONS[word]
+    if "'" not in word:
+        return word
+    if word.endswith("'s") and word[:-2] in IS_CONTRACTION_WORDS:
+        return word[:-2] + ' is'
+    for suffix, replacement in SUFFIX_CONTRACTIONS:
+        if word.endswith(suffix) and len(word) > len(suffix):
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+# Normalize a question so phrasings that differ only in case, punctuation,
+# spacing, filler words, contractions or a trailing "please" share one key
+def normalize_question(text):
+    text = _APOSTROPHES_RE.sub("'", text.lower())
+    text = _PUNCTUATION_RE.sub(' ', text)
+    words = []
+    for word in text.split():
+        word = _expand_contraction(word.strip("'"))
+        if "'" in word:
+            word = word.replace("'", '')
+        if ' ' in word:
+            words.extend(w for w in word.split() if w not in FILLER_WORDS)
+        elif word and word not in FILLER_WORDS:
+            words.append(word)
+    while words and words[-1] == 'please':
+        words.pop()
+    return ' '.join(words)
+
+
+# In-memory indexes over the Q&A entries: by ID (which also keeps insertion
+# order) and by normalized question. Both are maintained incrementally.
+class QAIndex:
+    def __init__(self, entries=()):
+        self.by_id = {}
+        self.by_question = {}
+        self.rebuild(entries)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def rebuild(self, entries):
+        self.by_id = {}
+        self.by_question = {}
+        for qa in entries:
+            self.add(qa)
+
+    def add(self, qa):
+        self.by_id[qa['id']] = qa
+        self.by_question.setdefault(normalize_question(qa['question']), []).append(qa['id'])
+
+    def remove(self, qa):
+        del self.by_id[qa['id']]
+        self._unlink_question(qa)
+
+    # Swap an entry in place so it keeps its position in the listing, and
+    # in its normalized-question bucket, which stays in listing order
+    def replace(self, old, new):
+        self.by_id[new['id']] = new
+        old_key = normalize_question(old['question'])
+        new_key = normalize_question(new['question'])
+        if old_key == new_key and old['id'] == new['id']:
+            return
+        self._unlink_question(old)
+        ids = self.by_question.setdefault(new_key, [])
+        ids.append(new['id'])
+        if len(ids) > 1:
+            # Rare: the new question duplicates another entry's
+            position = {qa_id: i for i, qa_id in enumerate(self.by_id)}
+            ids.sort(key=position.__getitem__)
+
+    def _unlink_question(self, qa):
+        key = normalize_question(qa['question'])
+        ids = self.by_question.get(key, [])
+        if qa['id'] in ids:
+            ids.remove(qa['id'])
+        if not ids:
+            self.by_question.pop(key, None)
+
+    def entries(self):
+        return list(self.by_id.values())
+
+    def get(self, qa_id):
+        return self.by_id.get(qa_id)
+
+    # First entry (in insertion order) whose normalized question matches
+    def find(self, question):
+        ids = self.by_question.get(normalize_question(question))
+        if not ids:
+            return None
+        return self.by_id[ids[0]]
@@ -0,0 +1,209 @@
+import numpy as np
+from qa_index import normalize_question
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Character n-gram size used alongside word unigrams and bigrams
+CHAR_NGRAM = 3
+# A search first scores the question's rarest terms over their full posting
+# lists, adding terms by increasing document frequency until about this many
+# postings have been read. The remaining, common terms (stop words, frequent
+# trigrams) are only scored for the TOP_CANDIDATES best entries so far.
+CANDIDATE_POSTINGS = 50000
+TOP_CANDIDATES = 50
+
+
+# Split a question into the terms we index: word unigrams, word bigrams and
+# character trigrams of each word (padded so short words still produce one).
+# Prefixes keep the three vocabularies apart.
+def tokenize(text):
+    words = normalize_question(text).split()
+    terms = ['w:' + w for w in words]
+    terms += ['b:' + a + ' ' + b for a, b in zip(words, words[1:])]
+    for w in words:
+        padded = f" {w} "
+        terms += ['c:' + padded[i:i + CHAR_NGRAM] for i in range(len(padded) - CHAR_NGRAM + 1)]
+    return terms
+
+
+def _term_counts(terms):
+    counts = {}
+    for term in terms:
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+# Append-only posting list for one term, stored as growable NumPy arrays.
+# Removing a document only lowers df, the number of live documents: its
+# slot stays in the list and searches ignore dead slots, so removal costs
+# nothing per posting. QASearchIndex compacts all lists by rebuilding once
+# most slots are dead.
+class _Postings:
+    __slots__ = ('slots', 'tfs', 'size', 'df')
+
+    def __init__(self, slots=(), tfs=()):
+        self.slots = np.array(slots, dtype=np.int32) if len(slots) else np.empty(4, dtype=np.int32)
+        self.tfs = np.array(tfs, dtype=np.float32) if len(tfs) else np.empty(4, dtype=np.float32)
+        self.size = len(slots)
+        self.df = len(slots)
+
+    def append(self, slot, tf):
+        if self.size == len(self.slots):
+            self.slots = np.resize(self.slots, self.size * 2)
+            self.tfs = np.resize(self.tfs, self.size * 2)
+        self.slots[self.size] = slot
+        self.tfs[self.size] = tf
+        self.size += 1
+        self.df += 1
+
+
+# Inverted index with BM25 scoring for fuzzy / paraphrase matching of custom
+# questions. Implements the same add/remove/replace/rebuild interface as
+# QAIndex so QAStore keeps it up to date incrementally.
+class QASearchIndex:
+    def __init__(self, entries=()):
+        self.rebuild(entries)
+
+    def __len__(self):
+        return len(self._slot_by_id)
+
+    # Bulk load: collect postings in plain lists and convert each to NumPy
+    # arrays once, which is much faster than appending entry by entry
+    def rebuild(self, entries):
+        self._slot_by_id = {}
+        self._entries = []
+        self._terms = []
+        lengths = []
+        collected = {}
+        for qa in entries:
+            if qa['id'] in self._slot_by_id:
+                continue
+            counts = _term_counts(tokenize(qa['question']))
+            slot = len(self._entries)
+            self._slot_by_id[qa['id']] = slot
+            self._entries.append(qa)
+            self._terms.append(counts)
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                slots, tfs = collected.setdefault(term, ([], []))
+                slots.append(slot)
+                tfs.append(tf)
+        self._postings = {term: _Postings(slots, tfs) for term, (slots, tfs) in collected.items()}
+        self._lengths = np.zeros(max(16, len(lengths)), dtype=np.float32)
+        self._lengths[:len(lengths)] = lengths
+        self._alive = np.zeros(len(self._lengths), dtype=bool)
+        self._alive[:len(lengths)] = True
+        self._total_length = float(sum(lengths))
+
+    def add(self, qa):
+        if qa['id'] in self._slot_by_id:
+            self.remove(self._entries[self._slot_by_id[qa['id']]])
+        counts = _term_counts(tokenize(qa['question']))
+        slot = len(self._entries)
+        if slot == len(self._lengths):
+            self._lengths = np.resize(self._lengths, slot * 2)
+            self._alive = np.resize(self._alive, slot * 2)
+        length = float(sum(counts.values()))
+        self._lengths[slot] = length
+        self._alive[slot] = True
+        self._total_length += length
+        self._entries.append(qa)
+        self._terms.append(counts)
+        self._slot_by_id[qa['id']] = slot
+        for term, tf in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = _Postings()
+            postings.append(slot, tf)
+
+    def remove(self, qa):
+        slot = self._slot_by_id.pop(qa['id'], None)
+        if slot is None:
+            return
+        for term in self._terms[slot]:
+            postings = self._postings[term]
+            postings.df -= 1
+            if postings.df == 0:
+                del self._postings[term]
+        self._total_length -= self._lengths[slot]
+        self._lengths[slot] = 0
+        self._alive[slot] = False
+        self._entries[slot] = None
+        self._terms[slot] = {}
+        # Slots are never reused; rebuild once most of them are dead
+        if len(self._entries) > 64 and len(self._slot_by_id) * 2 < len(self._entries):
+            self.rebuild([e for e in self._entries if e is not None])
+
+    def replace(self, old, new):
+        self.remove(old)
+        self.add(new)
+
+    def _idf(self, df):
+        n = len(self._slot_by_id)
+        return np.log1p((n - df + 0.5) / (df + 0.5))
+
+    def _term_weight(self, idf, tf, length, avg_length):
+        return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+
+    # Best matching entry for the question as (qa, confidence), where
+    # confidence is the BM25 score divided by the score the question would
+    # get against an identical document, so an exact match scores 1.0.
+    # Returns (None, 0.0) when nothing shares a term with the question.
+    # The rarest terms pick the candidates and common terms are only scored
+    # for those (see CANDIDATE_POSTINGS), so a search reads a bounded part
+    # of the index however large it is. An entry sharing only common terms
+    # with the question can be missed, but it would score too low to match.
+    def search(self, question):
+        if not self._slot_by_id:
+            return None, 0.0
+        counts = _term_counts(tokenize(question))
+        if not counts:
+            return None, 0.0
+        avg_length = self._total_length / len(self._slot_by_id)
+        query_length = float(sum(counts.values()))
+        lengths = self._lengths[:len(self._entries)]
+        best_possible = 0.0
+        terms = []
+        for term, qtf in counts.items():
+            postings = self._postings.get(term)
+            idf = self._idf(postings.df if postings is not None else 0)
+            best_possible += qtf * self._term_weight(idf, qtf, query_length, avg_length)
+            if postings is not None:
+                terms.append((postings.size, term, qtf, idf, postings))
+        if not terms or best_possible <= 0:
+            return None, 0.0
+        terms.sort(key=lambda term: term[0])
+
+        # Rarest terms over their whole posting lists
+        scores = np.zeros(len(self._entries), dtype=np.float64)
+        read = 0
+        rest = []
+        for size, term, qtf, idf, postings in terms:
+            if read and read + size > CANDIDATE_POSTINGS:
+                rest.append((term, qtf, idf))
+                continue
+            read += size
+            slots = postings.slots[:size]
+            # Slots are unique within a posting list, so fancy-index += is safe
+            scores[slots] += qtf * self._term_weight(idf, postings.tfs[:size], lengths[slots], avg_length)
+        scores[~self._alive[:len(self._entries)]] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            return None, 0.0
+        if len(candidates) > TOP_CANDIDATES:
+            candidates = np.sort(candidates[np.argpartition(scores[candidates], -TOP_CANDIDATES)[-TOP_CANDIDATES:]])
+
+        # Common terms only for the best candidates, read from each
+        # candidate's term counts rather than the long posting lists
+        totals = scores[candidates]
+        if rest:
+            rest_terms = [term for term, _, _ in rest]
+            tfs = np.array([[self._terms[slot].get(term, 0) for term in rest_terms] for slot in candidates.tolist()],
+                           dtype=np.float64)
+            qtfs = np.array([qtf for _, qtf, _ in rest])
+            idfs = np.array([idf for _, _, idf in rest])
+            weights = self._term_weight(idfs, tfs, lengths[candidates][:, None], avg_length)
+            totals += (qtfs * weights).sum(axis=1)
+        best = int(np.argmax(totals))
+        return self._entries[candidates[best]], min(1.0, float(totals[best] / best_possible))
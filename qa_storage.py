@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Storage backends for the Q&A store.
+
+Both backends implement the same interface:
+  signature()        cheap token that changes whenever the stored data changes
+  load()             list of entries in insertion order
+  locked()           context manager for an exclusive, re-entrant write section
+  insert/update/delete/replace_all/bulk
+                     apply one change and return the new signature; `entries`
+                     is the full list after the change, passed only to
+                     backends that set rewrites_all
+
+Usage (one-shot migration): python qa_storage.py qa_data.json qa_data.db
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+import logging
+from contextlib import contextmanager
+from qa_index import normalize_question
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, single worker only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# Q&A entries in a JSON file (the original qa_data.json format).
+# Writes go to a temporary file that is renamed over the original, so readers
+# never see a truncated file, and are serialized across processes with an
+# flock on a sidecar lock file.
+class JSONFileBackend:
+    rewrites_all = True
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._local = threading.local()
+
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    @contextmanager
+    def locked(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth or fcntl is None:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._local.depth = 1
+            try:
+                yield
+            finally:
+                self._local.depth = 0
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = os.path.join(directory, f".{os.path.basename(self.path)}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self.signature()
+
+    def insert(self, qa, entries):
+        return self._write(entries)
+
+    def update(self, qa, entries):
+        return self._write(entries)
+
+    def delete(self, qa_id, entries):
+        return self._write(entries)
+
+    def replace_all(self, entries):
+        return self._write(entries)
+
+    def bulk(self, changes, entries):
+        return self._write(entries)
+
+
+# Q&A entries in a SQLite database in WAL mode: readers never block the
+# writer, each add/update/delete touches a single row, and the ID and
+# normalized question columns are indexed. A version counter in the meta
+# table is bumped in every write transaction and serves as the signature.
+class SQLiteBackend:
+    rewrites_all = False
+
+    def __init__(self, path, migrate_from=None, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self.locked():
+            conn = self._conn()
+            conn.execute("""CREATE TABLE IF NOT EXISTS qa (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                question TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                answer TEXT NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS qa_normalized ON qa (normalized)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+            empty = conn.execute("SELECT COUNT(*) FROM qa").fetchone()[0] == 0
+            if migrate_from and empty and os.path.exists(migrate_from):
+                entries = JSONFileBackend(migrate_from).load()
+                for qa in entries:
+                    qa.setdefault('id', str(uuid.uuid4()))
+                self.replace_all(entries)
+                logger.info('Migrated %s Q&A entries from %s to %s', len(entries), migrate_from, path)
+
+    # One connection per thread, reopened after a fork
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.depth = 0
+        return conn
+
+    def signature(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def load(self):
+        rows = self._conn().execute("SELECT id, question, answer FROM qa ORDER BY seq")
+        return [{'id': qa_id, 'question': question, 'answer': answer} for qa_id, question, answer in rows]
+
+    @contextmanager
+    def locked(self):
+        conn = self._conn()
+        depth = self._local.depth
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def insert(self, qa, entries=None):
+        with self.locked():
+            conn = self._conn()
+            conn.execute("INSERT INTO qa (id, question, normalized, answer) VALUES (?, ?, ?, ?)",
+                         (qa['id'], qa['question'], normalize_question(qa['question']), qa['answer']))
+            return self._bump_version(conn)
+
+    def update(self, qa, entries=None):
+        with self.locked():
+            conn = self._conn()
+            conn.execute("UPDATE qa SET question = ?, normalized = ?, answer = ? WHERE id = ?",
+                         (qa['question'], normalize_question(qa['question']), qa['answer'], qa['id']))
+            return self._bump_version(conn)
+
+    def delete(self, qa_id, entries=None):
+        with self.locked():
+            conn = self._conn()
+            conn.execute("DELETE FROM qa WHERE id = ?", (qa_id,))
+            return self._bump_version(conn)
+
+    def replace_all(self, entries):
+        with self.locked():
+            conn = self._conn()
+            conn.execute("DELETE FROM qa")
+            conn.executemany(
+                "INSERT OR REPLACE INTO qa (id, question, normalized, answer) VALUES (?, ?, ?, ?)",
+                [(qa['id'], qa['question'], normalize_question(qa['question']), qa['answer']) for qa in entries],
+            )
+            return self._bump_version(conn)
+
+    # (op, data) changes in one transaction: ('insert', qa), ('update', qa)
+    # or ('delete', qa_id)
+    def bulk(self, changes, entries=None):
+        with self.locked():
+            conn = self._conn()
+            for op, data in changes:
+                if op == 'delete':
+                    conn.execute("DELETE FROM qa WHERE id = ?", (data,))
+                elif op == 'update':
+                    conn.execute("UPDATE qa SET question = ?, normalized = ?, answer = ? WHERE id = ?",
+                                 (data['question'], normalize_question(data['question']), data['answer'], data['id']))
+                else:
+                    conn.execute("INSERT INTO qa (id, question, normalized, answer) VALUES (?, ?, ?, ?)",
+                                 (data['id'], data['question'], normalize_question(data['question']), data['answer']))
+            return self._bump_version(conn)
+
+
+# Backend selected by QA_STORAGE ("json" or "sqlite")
+def backend_from_env(json_path):
+    kind = os.getenv('QA_STORAGE', 'json').lower()
+    if kind == 'sqlite':
+        return SQLiteBackend(os.getenv('QA_DB_FILE', 'qa_data.db'), migrate_from=json_path)
+    if kind != 'json':
+        raise ValueError(f"Unknown QA_STORAGE backend: {kind}")
+    return JSONFileBackend(json_path)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: python qa_storage.py <qa_data.json> <qa_data.db>")
+        return 1
+    json_path, db_path = sys.argv[1:]
+    backend = SQLiteBackend(db_path, migrate_from=json_path)
+    print(f"✅ {db_path} holds {len(backend.load())} Q&A entries")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import itertools
+from contextlib import nullcontext
+import threading
+import uuid
+import logging
+from qa_index import QAIndex
+from qa_search import QASearchIndex
+from qa_storage import JSONFileBackend
+
+logger = logging.getLogger(__name__)
+
+
+# Process-resident Q&A store.
+# The data is loaded once from a storage backend (see qa_storage.py) and kept
+# in memory. Every access asks the backend for its cheap change signature
+# (file stat or version counter) and only reloads when it changed, which is
+# how writes made by other gunicorn workers become visible here.
+# Lookups by ID and by normalized question go through a QAIndex; fuzzy
+# matching goes through a QASearchIndex. Both are updated incrementally.
+# persist_timer(operation), if given, returns a context manager wrapped
+# around every storage write (used for metrics).
+class QAStore:
+    def __init__(self, path=None, backend=None, persist_timer=None):
+        self.backend = backend or JSONFileBackend(path)
+        self.persist_timer = persist_timer
+        self._lock = threading.RLock()
+        self.index = QAIndex()
+        self.search_index = QASearchIndex()
+        self._indexes = [self.index, self.search_index]
+        self._signature = None
+        self._loaded = False
+        # Bumped on every reload or write; cheap "has anything changed" token
+        self.version = 0
+
+    # Reload from storage if it changed since we last looked at it
+    def _refresh(self):
+        signature = self.backend.signature()
+        if self._loaded and signature == self._signature:
+            return
+        self._load(signature)
+
+    def _load(self, signature):
+        try:
+            data = self.backend.load()
+        except Exception as e:
+            logger.error('Error loading Q&A data: %s', e)
+            data = []
+        # Assign IDs to entries missing them
+        modified = False
+        for qa in data:
+            if 'id' not in qa:
+                qa['id'] = str(uuid.uuid4())
+                modified = True
+        if modified:
+            try:
+                with self.backend.locked():
+                    signature = self.backend.replace_all(data)
+                logger.info("Assigned IDs to Q&A entries and saved updated Q&A data")
+            except Exception as e:
+                logger.error('Error saving updated Q&A data with IDs: %s', e)
+        logger.debug('Loaded %s Q&A entries', len(data))
+        for index in self._indexes:
+            index.rebuild(data)
+        self._signature = signature
+        self._loaded = True
+        self.version += 1
+
+    def _persisting(self, operation):
+        return self.persist_timer(operation) if self.persist_timer else nullcontext()
+
+    def all(self):
+        with self._lock:
+            self._refresh()
+            return self.index.entries()
+
+    # Version token for the stored data that is the same in every worker
+    # (the backend signature), suitable for building HTTP ETags
+    def data_version(self):
+        with self._lock:
+            self._refresh()
+            return self._signature
+
+    # One page of entries in insertion order, plus the total count
+    def page(self, offset=0, limit=None):
+        with self._lock:
+            self._refresh()
+            stop = None if limit is None else offset + limit
+            return list(itertools.islice(self.index.by_id.values(), offset, stop)), len(self.index)
+
+    def get(self, qa_id):
+        with self._lock:
+            self._refresh()
+            return self.index.get(qa_id)
+
+    # Match on the normalized form of the question, see normalize_question()
+    def find_by_question(self, question):
+        with self._lock:
+            self._refresh()
+            return self.index.find(question)
+
+    # Best custom answer for a question as (qa, confidence): a normalized
+    # exact match scores 1.0, otherwise the best fuzzy match is returned if
+    # its confidence reaches min_confidence
+    def match(self, question, min_confidence):
+        with self._lock:
+            self._refresh()
+            qa = self.index.find(question)
+            if qa is not None:
+                return qa, 1.0
+            qa, confidence = self.search_index.search(question)
+            if qa is None or confidence < min_confidence:
+                return None, confidence
+            return qa, confidence
+
+    # Writes run inside the backend's exclusive section: pick up other
+    # workers' changes first, persist, and only then update memory, so a
+    # failed write never leaves memory ahead of storage. Remembering the
+    # signature returned by the backend keeps our own write from triggering
+    # a reload on the next access.
+    def add(self, question, answer):
+        with self._lock, self.backend.locked():
+            self._refresh()
+            qa = {'id': str(uuid.uuid4()), 'question': question, 'answer': answer}
+            entries = self.index.entries() + [qa] if self.backend.rewrites_all else None
+            with self._persisting('insert'):
+                self._signature = self.backend.insert(qa, entries)
+            for index in self._indexes:
+                index.add(qa)
+            self.version += 1
+            return qa
+
+    def update(self, qa_id, question, answer):
+        with self._lock, self.backend.locked():
+            self._refresh()
+            old = self.index.get(qa_id)
+            if old is None:
+                return None
+            new = {**old, 'question': question, 'answer': answer}
+            entries = None
+            if self.backend.rewrites_all:
+                entries = [new if qa['id'] == qa_id else qa for qa in self.index.entries()]
+            with self._persisting('update'):
+                self._signature = self.backend.update(new, entries)
+            for index in self._indexes:
+                index.replace(old, new)
+            self.version += 1
+            return new
+
+    def delete(self, qa_id):
+        with self._lock, self.backend.locked():
+            self._refresh()
+            qa = self.index.get(qa_id)
+            if qa is None:
+                return False
+            entries = None
+            if self.backend.rewrites_all:
+                entries = [e for e in self.index.entries() if e['id'] != qa_id]
+            with self._persisting('delete'):
+                self._signature = self.backend.delete(qa_id, entries)
+            for index in self._indexes:
+                index.remove(qa)
+            self.version += 1
+            return True
+
+    # Apply many prepared changes (see qa_bulk.prepare_row) in one storage
+    # transaction with a single persist and index rebuild. `changes` is a list
+    # of (row_number, op, data). Rows that conflict with the current data are
+    # skipped; returns the applied counts and a list of (row_number, message).
+    def bulk(self, changes):
+        counts = {'inserted': 0, 'updated': 0, 'deleted': 0}
+        errors = []
+        with self._lock, self.backend.locked():
+            self._refresh()
+            entries = dict(self.index.by_id)
+            applied = []
+            for row_number, op, data in changes:
+                if op == 'delete':
+                    if entries.pop(data, None) is None:
+                        errors.append((row_number, f"Q&A not found: {data}"))
+                        continue
+                    counts['deleted'] += 1
+                    applied.append(('delete', data))
+                    continue
+                qa = dict(data)
+                if op == 'insert' and qa['id'] is not None and qa['id'] in entries:
+                    errors.append((row_number, f"Q&A already exists: {qa['id']}"))
+                    continue
+                if qa['id'] is None:
+                    qa['id'] = str(uuid.uuid4())
+                if qa['id'] in entries:
+                    counts['updated'] += 1
+                    applied.append(('update', qa))
+                else:
+                    counts['inserted'] += 1
+                    applied.append(('insert', qa))
+                entries[qa['id']] = qa
+            if applied:
+                entries = list(entries.values())
+                with self._persisting('bulk'):
+                    self._signature = self.backend.bulk(applied, entries if self.backend.rewrites_all else None)
+                for index in self._indexes:
+                    index.rebuild(entries)
+                self.version += 1
+        return counts, errors
+
+    # Replace the whole data set (used by save_qa_data)
+    def replace(self, entries):
+        with self._lock, self.backend.locked():
+            entries = list(entries)
+            with self._persisting('replace'):
+                self._signature = self.backend.replace_all(entries)
+            for index in self._indexes:
+                index.rebuild(entries)
+            self._loaded = True
+            self.version += 1
@@ -0,0 +1,282 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+import logging
+from collections import deque
+from upstream import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+# Whether an error means the upstream API is unhealthy: timeouts, connection
+# errors, and UpstreamErrors without an HTTP status (network failures) or
+# with 429 or a 5xx. Other errors (bad input, a 4xx the request caused) say
+# nothing about the API and leave the breaker alone.
+def is_upstream_failure(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, UpstreamError):
+        return error.status is None or error.status == 429 or error.status >= 500
+    return isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError))
+
+
+# Circuit breaker: after failure_threshold failures in a row the circuit
+# opens and calls fail at once for reset_timeout seconds. Then one probe
+# call is let through (half-open); its success closes the circuit again and
+# its failure reopens it for another reset_timeout.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, listener=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.listener = listener
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        logger.warning('Upstream circuit breaker %s -> %s', self.state, state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+        if self.listener:
+            self.listener('state', state)
+
+    # Whether a call may go ahead now
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self._probing):
+                self._probing = self.state == HALF_OPEN
+                return True
+            self.rejected += 1
+        if self.listener:
+            self.listener('rejected', self.state)
+        return False
+
+    # Report how a call that was let through ended
+    def record_outcome(self, error):
+        if error is None:
+            self.record_success()
+        elif is_upstream_failure(error):
+            self.record_failure()
+        else:
+            self.record_cancelled()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    # A call that was let through ended without telling whether the upstream
+    # is healthy (cancelled, or failed because of the request itself)
+    def record_cancelled(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._probing = False
+                self._set_state(OPEN)
+
+    def stats(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 3)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'retry_in': retry_in,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
+
+
+# Guards calls to the upstream API with a circuit breaker and hedging: when
+# a call has not finished after the hedge_percentile of recent successful
+# call durations, a second identical call is started and whichever succeeds
+# first is used. Hedges are limited to hedge_max_ratio of all calls so a
+# slow upstream does not get twice the load, and only start once
+# hedge_min_samples durations are known. hedge_percentile=0 turns hedging off.
+class UpstreamGuard:
+    def __init__(self, breaker=None, hedge_percentile=95, hedge_min_samples=20, hedge_max_ratio=0.1,
+                 window=256, listener=None):
+        self.breaker = breaker or CircuitBreaker(listener=listener)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.listener = listener
+        self.durations = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    # hedge_percentile of the recent durations, None until there are enough
+    def _hedge_after(self):
+        if not self.hedge_percentile or len(self.durations) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.durations)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    # Seconds to wait before hedging this call, or None to not hedge it
+    def hedge_delay(self):
+        with self._lock:
+            self.calls += 1
+            if self.hedged + 1 > self.hedge_max_ratio * self.calls:
+                return None
+            return self._hedge_after()
+
+    def _start_hedge(self):
+        with self._lock:
+            self.hedged += 1
+
+    def _finish(self, start, hedge_won):
+        with self._lock:
+            self.durations.append(time.monotonic() - start)
+            if hedge_won:
+                self.hedge_wins += 1
+        if self.listener and hedge_won is not None:
+            self.listener('hedge', 'won' if hedge_won else 'lost')
+
+    def _check(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError('Upstream circuit breaker is open')
+
+    # Call fn() (a blocking upstream call) under the breaker, hedged
+    def call(self, fn):
+        self._check()
+        start = time.monotonic()
+        delay = self.hedge_delay()
+        try:
+            if delay is None:
+                result, hedge_won = fn(), None
+            else:
+                result, hedge_won = self._hedged(fn, delay)
+        except Exception as e:
+            self.breaker.record_outcome(e)
+            raise
+        self.breaker.record_success()
+        self._finish(start, hedge_won)
+        return result
+
+    # Attempts run in their own threads (with the caller's context, so log
+    # lines keep the request ID); a losing attempt finishes in the background
+    def _hedged(self, fn, delay):
+        results = queue.Queue()
+
+        def attempt(hedge):
+            try:
+                results.put((hedge, fn(), None))
+            except Exception as e:
+                results.put((hedge, None, e))
+
+        def start(hedge):
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(attempt, hedge), daemon=True).start()
+
+        start(False)
+        attempts = 1
+        try:
+            outcome = results.get(timeout=delay)
+        except queue.Empty:
+            self._start_hedge()
+            start(True)
+            attempts = 2
+            outcome = results.get()
+        hedge, result, error = outcome
+        if error is not None and attempts == 2:
+            hedge, result, error = results.get()
+        if error is not None:
+            raise error
+        return result, (hedge if attempts == 2 else None)
+
+    # Await factory() (a coroutine function for an upstream call) under the
+    # breaker, hedged; the losing attempt is cancelled
+    async def call_async(self, factory):
+        self._check()
+        start = time.monotonic()
+        delay = self.hedge_delay()
+        try:
+            if delay is None:
+                result, hedge_won = await factory(), None
+            else:
+                result, hedge_won = await self._hedged_async(factory, delay)
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        except Exception as e:
+            self.breaker.record_outcome(e)
+            raise
+        self.breaker.record_success()
+        self._finish(start, hedge_won)
+        return result
+
+    async def _hedged_async(self, factory, delay):
+        first = asyncio.ensure_future(factory())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result(), None
+        self._start_hedge()
+        second = asyncio.ensure_future(factory())
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), task is second
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # Breaker bookkeeping for a streamed call, which is not hedged: check
+    # before it starts, then report how it ended (error is None when it
+    # succeeded; the client going away is reported as stream_cancelled)
+    def stream_started(self):
+        self._check()
+
+    def stream_finished(self, error=None):
+        self.breaker.record_outcome(error)
+
+    def stream_cancelled(self):
+        self.breaker.record_cancelled()
+
+    def stats(self):
+        with self._lock:
+            hedge_after = self._hedge_after()
+            hedging = {
+                'percentile': self.hedge_percentile,
+                'hedge_after': round(hedge_after, 4) if hedge_after is not None else None,
+                'max_ratio': self.hedge_max_ratio,
+                'calls': self.calls,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+            }
+        return {'breaker': self.breaker.stats(), 'hedging': hedging}
@@ -0,0 +1,80 @@
+import hashlib
+import json
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback
+    orjson = None
+
+# Largest page a listing route will return in one response
+MAX_PAGE_SIZE = 1000
+
+
+class BadRequest(Exception):
+    pass
+
+
+# Serialize to compact JSON bytes, with orjson when it is installed
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _int_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+
+
+# Read ?limit=, ?offset= and ?fields= from the query string.
+# limit is None when the caller did not ask for paging.
+def listing_args():
+    limit = _int_arg('limit', None)
+    offset = _int_arg('offset', 0)
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if offset < 0:
+        raise BadRequest('offset must not be negative')
+    fields = request.args.get('fields')
+    fields = [f for f in fields.split(',') if f] if fields else None
+    return limit, offset, fields
+
+
+# Keep only the requested fields of each item
+def select_fields(items, fields):
+    if not fields:
+        return items
+    return [{k: item[k] for k in fields if k in item} for item in items]
+
+
+# Paging metadata for a listing response
+def page_info(total, limit, offset, count):
+    next_offset = offset + count
+    return {
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'next_offset': next_offset if limit is not None and next_offset < total else None,
+    }
+
+
+# JSON response with a strong ETag derived from the data version and the
+# query string. A matching If-None-Match (also the weak form the compression
+# hook sends with compressed bodies) gets 304 Not Modified without the
+# body ever being built; `build` is only called on a miss.
+def versioned_json(version, build):
+    digest = hashlib.sha1(repr((request.path, version, sorted(request.args.items(multi=True)))).encode('utf-8'))
+    etag = digest.hexdigest()
+    headers = {'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(dumps(build()), mimetype='application/json', headers=headers)
+    response.set_etag(etag)
+    return response
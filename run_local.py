@@ -6,7 +6,7 @@ Usage: python run_local.py
 
 import os
 import sys
-from app import app
+from app import create_app
 
 if __name__ == '__main__':
     # Set development environment
@@ -18,7 +18,7 @@ if __name__ == '__main__':
     print("Press Ctrl+C to stop")
     
     try:
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        create_app(warm=True).run(host='0.0.0.0', port=5000, debug=True)
     except KeyboardInterrupt:
         print("\nShutting down gracefully...")
         sys.exit(0)
\ No newline at end of file
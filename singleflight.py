@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Coalesces concurrent calls that share a key: the first caller (the leader)
+# runs the function, later callers with the same key wait for its outcome
+# instead of repeating the work. Exceptions raised by the leader are re-raised
+# in every waiting caller; a waiter gives up after `timeout` seconds.
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for in-flight call")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'executed': self.executed, 'coalesced': self.coalesced}
+
+
+# SingleFlight for coroutines running in one event loop: later callers await
+# the leader's result instead of blocking a thread on it
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, timeout=None):
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for in-flight call")
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.executed += 1
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieve it so an exception nobody waited for is not reported
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+    def in_flight(self):
+        return len(self._calls)
+
+    def stats(self):
+        return {'in_flight': len(self._calls), 'executed': self.executed, 'coalesced': self.coalesced}
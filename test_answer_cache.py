@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for the upstream answer cache
+"""
+
+import time
+from answer_cache import AnswerCache, answer_cache_key
+
+def test_lru_eviction_and_counters():
+    """The least recently used entry is evicted first"""
+    cache = AnswerCache(max_entries=2, ttl=60)
+    cache.put('a', 'answer a')
+    cache.put('b', 'answer b')
+    assert cache.get('a') == 'answer a'
+    cache.put('c', 'answer c')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'answer a'
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['hits'] == 2 and stats['misses'] == 1
+    assert stats['evictions'] == 1
+
+def test_entries_expire():
+    """Entries are dropped once their TTL has passed"""
+    cache = AnswerCache(max_entries=10, ttl=60)
+    cache.put('a', 'answer a', ttl=-1)
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+def test_contains_counts_no_lookup():
+    """Membership checks skip expired entries and leave the counters alone"""
+    cache = AnswerCache(max_entries=10, ttl=60)
+    cache.put('a', 'answer a')
+    cache.put('b', 'answer b', ttl=-1)
+    assert 'a' in cache and 'b' not in cache and 'c' not in cache
+    assert cache.stats()['hits'] == 0 and cache.stats()['misses'] == 0
+
+def test_persists_across_instances(tmp_path):
+    """A saved cache is reloaded, without its expired entries"""
+    path = str(tmp_path / 'cache.json')
+    cache = AnswerCache(max_entries=10, ttl=60, path=path)
+    cache.put('a', 'answer a')
+    cache.put('b', 'answer b', ttl=0.01)
+    time.sleep(0.02)
+    cache.save()
+
+    reloaded = AnswerCache(max_entries=10, ttl=60, path=path)
+    assert reloaded.get('a') == 'answer a'
+    assert reloaded.get('b') is None
+    assert len(reloaded) == 1
+
+def test_cache_key():
+    """Keys follow the normalized question and persona, and skip conversations"""
+    persona = {'name': 'Teena', 'role': 'robot'}
+    key = answer_cache_key('What is AI?', persona, 15, 'model')
+    assert key == answer_cache_key('what is ai', persona, 15, 'model')
+    assert key != answer_cache_key('what is ai', {**persona, 'name': 'Tina'}, 15, 'model')
+    assert key != answer_cache_key('what is ai', persona, 50, 'model')
+    assert answer_cache_key('what is ai', {'chat_history': ['hi']}, 15, 'model') is None
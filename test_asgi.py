@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Tests for the async serving mode against a stub upstream with latency
+"""
+
+import asyncio
+import json
+import time
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('a2wsgi')
+
+import app as app_module
+import asgi
+from singleflight import AsyncSingleFlight
+from upstream import AsyncPerplexityClient
+from upstream_stub import StubUpstream
+
+LATENCY = 0.5
+
+@pytest.fixture
+def stub(app_state, monkeypatch):
+    with StubUpstream(latency=LATENCY) as server:
+        monkeypatch.setattr(asgi, 'upstream_client',
+                            AsyncPerplexityClient(base_url=server.url, api_key='test', backoff=0.01))
+        monkeypatch.setattr(asgi, 'upstream_calls', AsyncSingleFlight())
+        yield server
+
+async def call(method, path, body=None, headers=()):
+    """Send one request through the ASGI app and return (status, headers, body)"""
+    data = json.dumps(body).encode() if body is not None else b''
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'test'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(data)).encode()), *headers],
+        'client': ('127.0.0.1', 1234), 'server': ('test', 80),
+    }
+    sent = False
+    messages = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': data, 'more_body': False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.application(scope, receive, send)
+    start = messages[0]
+    response_headers = {key.decode(): value.decode() for key, value in start['headers']}
+    return start['status'], response_headers, b''.join(m.get('body', b'') for m in messages[1:])
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await asgi.upstream_client.close()
+    return asyncio.run(main())
+
+def test_concurrent_answers_overlap(stub):
+    """Ten slow upstream calls finish in about the time of one"""
+    async def ask_all():
+        return await asyncio.gather(*(call('POST', '/get_answer', {'question': f"question {i}"})
+                                      for i in range(10)))
+
+    start = time.perf_counter()
+    responses = run(ask_all())
+    elapsed = time.perf_counter() - start
+    assert elapsed < LATENCY * 3
+    assert stub.requests_seen == 10
+    for i, (status, headers, body) in enumerate(responses):
+        assert status == 200
+        assert json.loads(body) == {'answer': f"echo: question {i}", 'source': 'perplexity'}
+        assert len(headers['x-request-id']) == 32
+
+def test_other_routes_served_while_answers_wait(stub):
+    """/health and the Q&A routes are not queued behind upstream calls"""
+    async def scenario():
+        answers = [asyncio.ensure_future(call('POST', '/get_answer', {'question': f"slow {i}"}))
+                   for i in range(5)]
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        health = await call('GET', '/health')
+        listing = await call('GET', '/get_qas')
+        waited = time.perf_counter() - start
+        await asyncio.gather(*answers)
+        return health, listing, waited, [task.done() for task in answers]
+
+    health, listing, waited, done = run(scenario())
+    assert health[0] == 200 and json.loads(health[2])['status'] == 'healthy'
+    assert listing[0] == 200
+    assert waited < LATENCY
+    assert all(done)
+
+def test_local_matching_runs_off_the_event_loop(stub, monkeypatch):
+    """A slow custom Q&A match does not hold up other answers on the loop"""
+    local_answer = app_module.local_answer
+
+    def slow_local_answer(question, context, max_tokens):
+        if question.startswith('slow'):
+            time.sleep(0.3)
+        return local_answer(question, context, max_tokens)
+
+    monkeypatch.setattr(app_module, 'local_answer', slow_local_answer)
+    app_module.qa_store.add('what is your name', 'my name is Tina')
+
+    async def scenario():
+        start = time.perf_counter()
+        slow = [asyncio.ensure_future(call('POST', '/get_answer', {'question': f"slow {i}"})) for i in range(3)]
+        await asyncio.sleep(0)
+        fast = await call('POST', '/get_answer', {'question': 'what is your name'})
+        waited = time.perf_counter() - start
+        await asyncio.gather(*slow)
+        return fast, waited
+
+    fast, waited = run(scenario())
+    assert json.loads(fast[2])['source'] == 'custom'
+    assert waited < 0.2
+
+def test_identical_questions_share_one_call(stub):
+    """Concurrent identical questions are coalesced; the answer is cached"""
+    async def ask_same():
+        return await asyncio.gather(*(call('POST', '/get_answer', {'question': 'same question'})
+                                      for _ in range(5)))
+
+    responses = run(ask_same())
+    assert stub.requests_seen == 1
+    assert {json.loads(body)['answer'] for _, _, body in responses} == {'echo: same question'}
+    status, _, body = run(call('POST', '/get_answer', {'question': 'same question'}))
+    assert json.loads(body)['source'] == 'cache'
+    assert stub.requests_seen == 1
+
+def test_stream_route_and_fallbacks(stub):
+    """Streamed answers arrive as delta events; failures use the usual fallbacks"""
+    status, headers, body = run(call('POST', '/get_answer_stream', {'question': 'stream me'},
+                                     headers=[(b'x-request-id', b'req-1')]))
+    events = [block.split('\n')[0] for block in body.decode().strip().split('\n\n')]
+    assert headers['content-type'] == 'text/event-stream'
+    assert headers['x-request-id'] == 'req-1'
+    assert events == ['event: delta', 'event: delta', 'event: answer']
+
+    stub.failures = [500, 500, 500]
+    status, _, body = run(call('POST', '/get_answer', {'question': 'broken upstream'}))
+    assert json.loads(body) == {'answer': app_module.UPSTREAM_FAILED_ANSWER}
+
+    app_module.qa_store.add('What is your name?', 'Teena')
+    status, _, body = run(call('POST', '/get_answer', {'question': 'What is your name?'}))
+    assert json.loads(body)['source'] == 'custom'
+
+def test_conversation_sessions(stub):
+    """Async answers keep server-side history like the Flask routes"""
+    async def converse():
+        first = json.loads((await call('POST', '/get_answer', {'question': 'hello', 'session_id': ''}))[2])
+        second = await call('POST', '/get_answer', {'question': 'and then?', 'session_id': first['session_id']})
+        return first, json.loads(second[2])
+
+    first, second = run(converse())
+    assert second['session_id'] == first['session_id']
+    assert app_module.conversations.turns(first['session_id']) == [
+        ('hello', 'echo: hello'), ('and then?', 'echo: and then?')]
+
+def test_batch_answers(stub):
+    """A batch's misses are asked concurrently on the event loop"""
+    app_module.qa_store.add('What is your name?', 'Teena')
+    questions = ['What is your name?'] + [f"batch question {i}" for i in range(6)]
+    start = time.perf_counter()
+    status, _, body = run(call('POST', '/get_answers', {'questions': questions}))
+    elapsed = time.perf_counter() - start
+    body = json.loads(body)
+    assert status == 200 and body['upstream_calls'] == 6
+    assert [item['source'] for item in body['answers']] == ['custom'] + ['perplexity'] * 6
+    assert body['answers'][3]['answer'] == 'echo: batch question 2'
+    assert elapsed < LATENCY * 3
+    status, _, body = run(call('POST', '/get_answers', {'questions': 'nope'}))
+    assert status == 400
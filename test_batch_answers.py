@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the batch answer endpoint
+"""
+
+import threading
+import time
+import pytest
+import app as app_module
+
+class SlowUpstream:
+    """Answers after a delay, failing on questions containing "fail", and
+    records how many calls ran at the same time"""
+    model = 'test-model'
+    api_key = 'test'
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def ask(self, question, context, max_tokens):
+        with self._lock:
+            self.calls.append(question)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if 'fail' in question:
+                raise RuntimeError('upstream broke')
+            return f"answer to {question} as {context.get('name', 'Teena')}"
+        finally:
+            with self._lock:
+                self.running -= 1
+
+@pytest.fixture
+def upstream():
+    return SlowUpstream()
+
+@pytest.fixture
+def qa_pairs():
+    return [('what is your name', 'my name is Tina')]
+
+def test_batch_answers_in_order_with_sources(client):
+    """Hits are local, misses go upstream once each and concurrently, order is kept"""
+    questions = ['What is your name?', 'Where is the library?', 'where is the library', 'What time is it?',
+                 'Will this fail?', 'what is your name']
+    start = time.perf_counter()
+    response = client.post('/get_answers', json={'questions': questions, 'context': {'name': 'Robo'}})
+    elapsed = time.perf_counter() - start
+    body = response.get_json()
+    assert response.status_code == 200 and body['status'] == 'success'
+    assert [item['question'] for item in body['answers']] == [q.lower() for q in questions]
+    assert [item['source'] for item in body['answers']] == ['custom', 'perplexity', 'perplexity', 'perplexity',
+                                                            'error', 'custom']
+    assert body['answers'][1]['answer'] == 'answer to where is the library? as Robo'
+    assert body['answers'][4]['answer'] == app_module.UPSTREAM_FAILED_ANSWER
+    assert 'upstream broke' in body['answers'][4]['error']
+    assert all(item['latency_ms'] >= 0 for item in body['answers'])
+    assert body['answers'][1]['latency_ms'] >= 150 > body['answers'][0]['latency_ms']
+    # "where is the library?" and "where is the library" are one upstream request
+    assert body['upstream_calls'] == 3 and len(client.upstream.calls) == 3
+    assert elapsed < 0.45
+
+def test_batch_concurrency_is_bounded(client):
+    """No more than BATCH_UPSTREAM_CONCURRENCY misses are asked at once"""
+    app_module.app.config['BATCH_UPSTREAM_CONCURRENCY'] = 2
+    client.upstream.delay = 0.05
+    try:
+        body = client.post('/get_answers', json={'questions': [f"question {n}" for n in range(6)]}).get_json()
+    finally:
+        app_module.app.config['BATCH_UPSTREAM_CONCURRENCY'] = 8
+    assert [item['source'] for item in body['answers']] == ['perplexity'] * 6
+    assert client.upstream.max_running == 2
+
+def test_batch_uses_and_fills_answer_cache(client):
+    """Answers from a batch are cached for single requests and later batches"""
+    client.post('/get_answers', json={'questions': ['tell me a joke']})
+    single = client.post('/get_answer', json={'question': 'tell me a joke'}).get_json()
+    assert single['source'] == 'cache'
+    body = client.post('/get_answers', json={'questions': ['tell me a joke']}).get_json()
+    assert body['answers'][0]['source'] == 'cache' and body['upstream_calls'] == 0
+
+def test_invalid_batches(client):
+    """Malformed or oversized batches are rejected; empty items fail alone"""
+    assert client.post('/get_answers', json={'questions': 'not a list'}).status_code == 400
+    assert client.post('/get_answers', json={'questions': []}).status_code == 400
+    assert client.post('/get_answers', json={'questions': [1, 2]}).status_code == 400
+    too_many = ['q'] * (app_module.app.config['BATCH_MAX_QUESTIONS'] + 1)
+    assert client.post('/get_answers', json={'questions': too_many}).status_code == 400
+    assert client.post('/get_answers', json={'questions': ['hi'], 'session_id': 'abc'}).status_code == 400
+    assert client.post('/get_answers', json={'questions': ['hi'],
+                                             'context': {'chat_history': [['hi', 'hello']]}}).status_code == 400
+    assert client.post('/get_answers', json={'questions': ['hi'], 'context': 'Robo'}).status_code == 400
+    body = client.post('/get_answers', json={'questions': ['  ', 'what is your name']}).get_json()
+    assert [item['source'] for item in body['answers']] == ['error', 'custom']
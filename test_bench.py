@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for the benchmark data generators and a tiny microbenchmark run
+"""
+
+import argparse
+import os
+import random
+import bench_micro
+from bench_data import paraphrase, question_mix, synthetic_media_dir, synthetic_qa
+from qa_search import QASearchIndex
+
+def test_synthetic_qa_is_deterministic_and_distinct():
+    """The same seed gives the same corpus; questions never repeat"""
+    entries = synthetic_qa(5000, seed=3)
+    assert entries == synthetic_qa(5000, seed=3)
+    assert len({e['question'] for e in entries}) == 5000
+    assert len({e['id'] for e in entries}) == 5000
+
+def test_paraphrases_still_match():
+    """Paraphrased questions fuzzy-match their original above the default threshold"""
+    entries = synthetic_qa(1000, seed=1)
+    index = QASearchIndex(entries)
+    rng = random.Random(0)
+    found = 0
+    for e in entries[:50]:
+        qa, confidence = index.search(paraphrase(e['question'], rng))
+        found += qa is not None and qa['id'] == e['id'] and confidence >= 0.7
+    assert found >= 48
+
+def test_question_mix_and_media_dir(tmp_path):
+    """Question mixes follow the requested shares; media files are content-addressed"""
+    kinds = [kind for _, kind in question_mix(synthetic_qa(100), 1000, exact=0.5, fuzzy=0.2)]
+    assert 400 < kinds.count('exact') < 600 and 100 < kinds.count('fuzzy') < 300
+    names = synthetic_media_dir(str(tmp_path), 10, size=64)
+    assert sorted(names) == sorted(os.listdir(tmp_path))
+    assert all(len(name) == 64 + len('.jpg') for name in names)
+
+def test_bench_size_runs(monkeypatch, tmp_path):
+    """A tiny run produces a result for every benchmark"""
+    monkeypatch.setattr(bench_micro, 'WORK_DIR', str(tmp_path))
+    args = argparse.Namespace(storage='json', repeat=3, write_repeat=2, media=True, filter=None)
+    results = bench_micro.bench_size(30, args)
+    names = {r['benchmark'] for r in results}
+    assert {'core/match_fuzzy', 'route/get_answer_miss', 'route/get_images_all', 'route/delete_qa'} <= names
+    assert all(r['size'] == 30 and r['median_us'] > 0 for r in results)
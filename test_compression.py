@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for response compression and the precomputed index page
+"""
+
+import gzip
+import pytest
+from flask import Flask, Response, jsonify
+import app as app_module
+import compression
+from compression import Compressor
+from qa_store import QAStore
+
+def make_app(compressor):
+    app = Flask(__name__)
+    app.after_request(compressor.after_request)
+
+    @app.route('/json')
+    def large_json():
+        return jsonify({'items': ['answer'] * 500})
+
+    @app.route('/small')
+    def small_json():
+        return jsonify({'ok': True})
+
+    @app.route('/page')
+    def page():
+        response = Response('<p>hello</p>' * 500, mimetype='text/html')
+        response.set_etag('page-v1')
+        return response
+
+    @app.route('/stream')
+    def stream():
+        return Response((chunk for chunk in ['data: x\n\n'] * 500), mimetype='text/plain')
+
+    return app
+
+def test_gzip_negotiation_and_threshold():
+    """Large JSON is gzipped for clients that accept it; small bodies are not"""
+    client = make_app(Compressor(min_size=1024)).test_client()
+    response = client.get('/json', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert b'"answer"' in gzip.decompress(response.data)
+    assert 'Content-Encoding' not in client.get('/json').headers
+    assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+
+def test_brotli_preferred_when_available():
+    """brotli wins over gzip when both are accepted"""
+    brotli = pytest.importorskip('brotli')
+    client = make_app(Compressor()).test_client()
+    response = client.get('/json', headers={'Accept-Encoding': 'gzip, deflate, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert b'"answer"' in brotli.decompress(response.data)
+
+def test_gzip_only_without_brotli(monkeypatch):
+    """Without brotli installed only gzip is offered"""
+    monkeypatch.setattr(compression, 'brotli', None)
+    client = make_app(Compressor()).test_client()
+    assert client.get('/json', headers={'Accept-Encoding': 'br, gzip'}).headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in client.get('/json', headers={'Accept-Encoding': 'br'}).headers
+
+def test_etag_bodies_are_cached_and_streams_untouched():
+    """Responses with an ETag are compressed once; streamed bodies pass through"""
+    compressor = Compressor()
+    client = make_app(compressor).test_client()
+    first = client.get('/page', headers={'Accept-Encoding': 'gzip'})
+    second = client.get('/page', headers={'Accept-Encoding': 'gzip'})
+    assert first.data == second.data
+    assert first.headers['ETag'] == 'W/"page-v1"'
+    assert compressor.stats()['cache_hits'] == 1
+    assert compressor.stats()['cache_entries'] == 1
+    stream = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in stream.headers
+
+def test_cache_is_bounded():
+    """The compressed-body cache evicts least recently used entries"""
+    compressor = Compressor(cache_bytes=400)
+    for i in range(10):
+        compressor._store((f"etag{i}", 'gzip'), b'x' * 100)
+    assert compressor.stats()['cache_bytes'] <= 400
+    assert compressor._cached(('etag9', 'gzip')) is not None
+    assert compressor._cached(('etag0', 'gzip')) is None
+
+def test_index_page_etag_and_compression():
+    """The landing page is served from memory with an ETag, compressed"""
+    client = app_module.app.test_client()
+    response = client.get('/')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    compressed = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == response.data
+    assert client.get('/', headers={'If-None-Match': compressed.headers['ETag']}).status_code == 304
+
+def test_weak_etag_revalidates_listing(monkeypatch, tmp_path):
+    """A listing's compressed (weak) ETag still gets 304 Not Modified"""
+    store = QAStore(str(tmp_path / 'qa.json'))
+    for i in range(40):
+        store.add(f"question number {i}?", f"answer number {i}")
+    monkeypatch.setattr(app_module, 'qa_store', store)
+    client = app_module.app.test_client()
+    response = client.get('/get_qas', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'].startswith('W/')
+    assert client.get('/get_qas', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Tests for server-side conversation sessions
+"""
+
+import pytest
+import app as app_module
+import conversations
+from conversations import ConversationStore, estimate_tokens
+from upstream import build_messages
+
+class RecordingUpstream:
+    """Answers every question and keeps the contexts it was asked with"""
+    model = 'test-model'
+    api_key = 'test'
+
+    def __init__(self):
+        self.contexts = []
+
+    def ask(self, question, context, max_tokens):
+        self.contexts.append(context)
+        return f"answer to {question}"
+
+@pytest.fixture
+def upstream():
+    return RecordingUpstream()
+
+@pytest.fixture
+def qa_pairs():
+    return [('what is your name', 'my name is Tina')]
+
+@pytest.fixture
+def client(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'conversations', ConversationStore(history_tokens=40))
+    return client
+
+def test_window_keeps_recent_turns_within_budget():
+    """Newest turns fill the budget; older ones become a summary"""
+    store = ConversationStore(history_tokens=30)
+    for n in range(10):
+        store.append('s', f"question number {n}", f"answer number {n}")
+    history, summary = store.window('s')
+    assert sum(estimate_tokens(turn['content']) for turn in history) <= 30
+    assert history[-1] == {'role': 'assistant', 'content': 'answer number 9'}
+    assert history[0]['role'] == 'user'
+    assert summary.startswith('Earlier the user asked (latest first): question number')
+    assert 'question number 0' not in [turn['content'] for turn in history]
+
+def test_long_turn_is_truncated():
+    """A single turn over the budget is shortened rather than dropped"""
+    store = ConversationStore(history_tokens=20)
+    store.append('s', 'tell me everything ' * 20, 'here is everything ' * 20)
+    history, summary = store.window('s')
+    assert len(history) == 2 and summary == ''
+    assert all(turn['content'].endswith('…') for turn in history)
+    assert sum(estimate_tokens(turn['content']) for turn in history) <= 20
+
+def test_idle_sessions_expire_and_size_is_bounded(monkeypatch):
+    """Idle sessions are dropped; the least recently used go past max_sessions"""
+    now = [1000.0]
+    monkeypatch.setattr(conversations.time, 'monotonic', lambda: now[0])
+    store = ConversationStore(max_sessions=2, idle_ttl=60)
+    store.append('a', 'q', 'a')
+    store.append('b', 'q', 'a')
+    store.append('c', 'q', 'a')
+    assert store.turns('a') is None and store.stats()['evicted'] == 1
+    now[0] += 30
+    store.turns('b')
+    now[0] += 45
+    assert store.turns('c') is None and store.turns('b') is not None
+    assert store.stats()['expired'] == 1
+
+def test_session_replaces_client_history(client):
+    """With a session ID the stored window is sent upstream, not the client's chat_history"""
+    first = client.post('/get_answer', json={'question': 'Hello there', 'session_id': None}).get_json()
+    session_id = first['session_id']
+    assert first['source'] == 'perplexity'
+    custom = client.post('/get_answer', json={'question': 'What is your name?', 'session_id': session_id})
+    assert custom.get_json() == {'answer': 'my name is Tina', 'source': 'custom', 'score': 1.0,
+                                 'session_id': session_id}
+    client.post('/get_answer', json={'question': 'And where are you?', 'session_id': session_id,
+                                     'context': {'chat_history': ['ignored'] * 1000}})
+    history = client.upstream.contexts[-1]['chat_history']
+    assert history == [
+        {'role': 'user', 'content': 'hello there'}, {'role': 'assistant', 'content': 'answer to hello there'},
+        {'role': 'user', 'content': 'what is your name?'}, {'role': 'assistant', 'content': 'my name is Tina'},
+    ]
+    assert len(app_module.conversations.turns(session_id)) == 3
+
+def test_prompt_size_stays_flat(client):
+    """Long conversations send no more history than the token budget"""
+    sizes = []
+    for n in range(30):
+        client.post('/get_answer', json={'question': f"Question {n} about the museum", 'session_id': 'kiosk-7'})
+        context = client.upstream.contexts[-1]
+        sizes.append(len(build_messages('next', context, 15)[0]['content']))
+    assert max(sizes[10:]) - min(sizes[10:]) < 40
+    assert 'Earlier the user asked' in build_messages('next', context, 15)[0]['content']
+
+def test_requests_without_session_are_unchanged(client):
+    """Clients that send chat_history themselves get no session"""
+    body = client.post('/get_answer', json={'question': 'Hi', 'context': {'chat_history': ['x']}}).get_json()
+    assert 'session_id' not in body
+    assert client.upstream.contexts[-1]['chat_history'] == ['x']
+    assert len(app_module.conversations) == 0
+
+def test_end_conversation(client):
+    """Ending a session forgets its history"""
+    client.post('/get_answer', json={'question': 'Hello', 'session_id': 'kiosk-1'})
+    assert client.delete('/conversations/kiosk-1').status_code == 200
+    assert client.delete('/conversations/kiosk-1').status_code == 404
+    assert app_module.conversations.turns('kiosk-1') is None
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for hot-question tracking and answer precomputation
+"""
+
+import random
+import time
+from collections import Counter
+import pytest
+import app as app_module
+from hot_questions import HotQuestions, PrecomputeJob, SpaceSaving
+
+class CountingUpstream:
+    """Answers every question and records what it was asked"""
+    model = 'test-model'
+    api_key = 'test'
+
+    def __init__(self):
+        self.calls = []
+
+    def ask(self, question, context, max_tokens):
+        self.calls.append((question, context.get('name'), max_tokens))
+        return f"answer to {question} as {context.get('name', 'Teena')}"
+
+@pytest.fixture
+def upstream():
+    return CountingUpstream()
+
+@pytest.fixture
+def qa_pairs():
+    return [('what is your name', 'my name is Tina')]
+
+@pytest.fixture
+def client(client, monkeypatch):
+    hot = HotQuestions(capacity=50)
+    monkeypatch.setattr(app_module, 'hot_questions', hot)
+    monkeypatch.setattr(app_module, 'precompute_job',
+                        PrecomputeJob(hot, app_module.precompute_answer, interval=0, top_n=2, min_count=2))
+    return client
+
+def test_space_saving_keeps_heavy_hitters_in_bounded_memory():
+    """Frequent keys survive a long tail of rare ones, with counts within their error"""
+    rng = random.Random(7)
+    stream = [f"hot {n % 5}" for n in range(2000)] + [f"rare {rng.randrange(5000)}" for _ in range(3000)]
+    rng.shuffle(stream)
+    sketch = SpaceSaving(50)
+    for key in stream:
+        sketch.add(key)
+    true_counts = Counter(stream)
+    assert len(sketch) == 50
+    top = sketch.top(5)
+    assert sorted(key for key, _, _ in top) == [f"hot {n}" for n in range(5)]
+    for key, count, error in sketch.top(50):
+        assert count - error <= true_counts[key] <= count
+
+def test_questions_are_normalized_and_split_by_hit():
+    """Variants of one question count together; hits and misses are kept apart"""
+    hot = HotQuestions(capacity=10)
+    for question in ['Where is the library?', "where's the library", 'WHERE IS THE LIBRARY']:
+        hot.record(question, hit=False)
+    hot.record('what is your name', hit=True)
+    hot.record('   ', hit=False)
+    assert hot.top('miss', 5) == [{'question': 'where is the library', 'count': 3, 'error': 0}]
+    assert [item['question'] for item in hot.top('hit', 5)] == ['what is your name']
+    assert hot.stats()['misses'] == 3 and hot.stats()['hits'] == 1
+
+def test_hot_questions_endpoint(client):
+    """Answer routes feed the counts listed at /hot_questions"""
+    for question in ['Where is the cafeteria?'] * 3 + ['Tell me a joke'] * 2 + ['What is your name?']:
+        client.post('/get_answer', json={'question': question})
+    client.post('/get_answers', json={'questions': ['where is the cafeteria', 'what is your name']})
+    body = client.get('/hot_questions').get_json()
+    assert body['kind'] == 'miss'
+    assert [(item['question'], item['count']) for item in body['questions']] == [
+        ('where is the cafeteria', 4), ('tell me a joke', 2)]
+    body = client.get('/hot_questions?kind=hit&fields=question').get_json()
+    assert body['questions'] == [{'question': 'what is your name'}]
+    assert client.get('/hot_questions?limit=1').get_json()['questions'][0]['question'] == 'where is the cafeteria'
+    assert client.get('/hot_questions?kind=other').status_code == 400
+    assert client.get('/hot_questions?limit=0').status_code == 400
+
+def test_precompute_turns_hot_misses_into_cache_hits(client):
+    """Misses asked often enough are answered ahead of time, with their persona"""
+    for _ in range(2):
+        client.post('/get_answer', json={'question': 'Where is the cafeteria?', 'context': {'name': 'Robo'},
+                                         'session_id': 'kiosk-1'})
+    client.post('/get_answer', json={'question': 'How tall is the tower?'})
+    # As if the answers from these first calls had expired
+    app_module.answer_cache.clear()
+    client.upstream.calls.clear()
+    assert client.post('/hot_questions/precompute').get_json()['precomputed'] == 1
+    assert client.upstream.calls == [('where is the cafeteria?', 'Robo', 15)]
+    body = client.post('/get_answer', json={'question': 'where is the cafeteria',
+                                            'context': {'name': 'Robo'}}).get_json()
+    assert body == {'answer': 'answer to where is the cafeteria? as Robo', 'source': 'cache'}
+    assert client.post('/hot_questions/precompute').get_json()['precomputed'] == 0
+    assert len(client.upstream.calls) == 1
+
+def test_precompute_skips_questions_now_in_custom_qa(client):
+    """A hot miss that an admin has since added to the custom Q&A is not precomputed"""
+    for _ in range(3):
+        client.post('/get_answer', json={'question': 'Who built you?'})
+    app_module.qa_store.add('who built you', 'I Robotics')
+    client.upstream.calls.clear()
+    assert app_module.precompute_job.run_once() == 0
+    assert client.upstream.calls == []
+
+def test_background_job_stops_a_pass_on_errors():
+    """The job runs on its own thread and gives up a pass after the first failure"""
+    hot = HotQuestions()
+    for question in ['first question', 'first question', 'second question', 'second question']:
+        hot.record(question, hit=False, request=(question, {}, 15))
+    asked = []
+
+    def precompute(question, context, max_tokens):
+        asked.append(question)
+        raise RuntimeError('upstream down')
+
+    job = PrecomputeJob(hot, precompute, interval=0.02, top_n=5, min_count=2)
+    job.ensure_running()
+    job.ensure_running()
+    deadline = time.monotonic() + 2
+    while job.runs < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    job.stop()
+    assert job.runs >= 2 and job.failed == job.runs
+    assert set(asked) == {'first question'}
+    assert not PrecomputeJob(hot, precompute, interval=0).enabled
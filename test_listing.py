@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for paginated, ETag-cached listing routes
+"""
+
+import pytest
+import app as app_module
+from media_catalog import MediaCatalog
+from qa_store import QAStore
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    store = QAStore(str(tmp_path / 'qa.json'))
+    store.replace([{'id': str(i), 'question': f"question {i}", 'answer': f"answer {i}"} for i in range(5)])
+    monkeypatch.setattr(app_module, 'qa_store', store)
+    images = tmp_path / 'images'
+    images.mkdir()
+    for name in ['a.png', 'b.jpg', 'notes.txt']:
+        (images / name).write_bytes(b'x')
+    monkeypatch.setattr(app_module, 'image_catalog', MediaCatalog(
+        str(tmp_path / 'media.db'), 'image', str(images), app_module.ALLOWED_IMAGE_EXTENSIONS))
+    return app_module.app.test_client()
+
+def test_qas_pagination_and_fields(client):
+    """limit/offset page through the Q&As and fields trims each item"""
+    data = client.get('/get_qas?limit=2&offset=2&fields=id,question').get_json()
+    assert data['qas'] == [{'id': '2', 'question': 'question 2'}, {'id': '3', 'question': 'question 3'}]
+    assert (data['total'], data['next_offset']) == (5, 4)
+
+    data = client.get('/get_qas?limit=2&offset=4').get_json()
+    assert [qa['id'] for qa in data['qas']] == ['4']
+    assert data['next_offset'] is None
+
+    # Without paging arguments the full list is returned as before
+    assert len(client.get('/get_qas').get_json()['qas']) == 5
+    assert client.get('/get_qas?limit=0').status_code == 400
+    assert client.get('/get_qas?offset=abc').status_code == 400
+
+def test_qas_etag_revalidation(client):
+    """Unchanged polls get 304; a write changes the ETag"""
+    response = client.get('/get_qas')
+    etag = response.headers['ETag']
+    assert client.get('/get_qas', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/get_qas?limit=1', headers={'If-None-Match': etag}).status_code == 200
+
+    app_module.qa_store.add('new question', 'new answer')
+    response = client.get('/get_qas', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_images_listing(client):
+    """Media listings page and revalidate the same way"""
+    data = client.get('/get_images?limit=1&offset=1').get_json()
+    assert data['total'] == 2
+    assert data['images'][0]['display_name'] == 'Image 2'
+    etag = client.get('/get_images').headers['ETag']
+    assert client.get('/get_images', headers={'If-None-Match': etag}).status_code == 304
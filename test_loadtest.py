@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for the load-test harness and the stub upstream's error rate
+"""
+
+import threading
+import pytest
+from werkzeug.serving import make_server
+import app as app_module
+import loadtest
+from upstream import PerplexityClient, UpstreamError
+from upstream_stub import StubUpstream
+
+@pytest.fixture
+def upstream():
+    with StubUpstream(latency=0.01) as stub:
+        yield PerplexityClient(base_url=stub.url, api_key='test', backoff=0.01)
+
+@pytest.fixture
+def server(app_state):
+    """The app on a local port with a fresh Q&A file and the stub as upstream"""
+    http = make_server('127.0.0.1', 0, app_state.app, threaded=True)
+    thread = threading.Thread(target=http.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{http.server_port}"
+    http.shutdown()
+
+def test_parse_mix_and_slos():
+    """Mixes and SLO targets are parsed; unknown names are rejected"""
+    assert loadtest.parse_mix('answer_hit=3,list_qas') == [('answer_hit', 3.0), ('list_qas', 1.0)]
+    assert loadtest.parse_slos('answer_hit:p95=200, all:p99=1000') == [
+        ('answer_hit', 'p95', 200.0), ('all', 'p99', 1000.0)]
+    with pytest.raises(ValueError):
+        loadtest.parse_mix('answer_everything=1')
+    with pytest.raises(ValueError):
+        loadtest.parse_slos('answer_hit:p90=200')
+
+def test_percentiles_and_slo_check():
+    """Nearest-rank percentiles; missed targets are reported"""
+    ordered = list(range(1, 101))
+    assert [loadtest.percentile(ordered, p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    recorder = loadtest.Recorder()
+    for ms in range(1, 101):
+        recorder.record('answer_hit', ms / 1000, error='boom' if ms == 100 else None)
+    report = recorder.summary(10)
+    stats = report['operations']['answer_hit']
+    assert (stats['requests'], stats['errors'], stats['throughput_rps']) == (100, 1, 10.0)
+    assert stats['first_error'] == 'boom'
+    assert loadtest.failed_slos(report, [('answer_hit', 'p95', 100)]) == []
+    assert len(loadtest.failed_slos(report, [('answer_hit', 'p99', 50), ('add_qa', 'p50', 10)])) == 2
+
+def test_run_load_and_cleanup(server):
+    """A short run drives every Q&A operation without errors and leaves no entries behind"""
+    workload = loadtest.Workload(server, seed_count=50, upload_size=16)
+    mix = loadtest.parse_mix('answer_hit=4,answer_miss=2,answer_stream_miss=1,list_qas=1,'
+                             'add_qa=1,update_qa=1,delete_qa=1')
+    with loadtest.requests.Session() as session:
+        workload.setup(session)
+        assert len(app_module.qa_store.all()) == 50
+        report = loadtest.run_load(workload, mix, concurrency=4, duration=1.0, warmup=0, think_time=0)
+        assert report['all']['errors'] == 0
+        assert set(report['operations']) == {name for name, _ in mix}
+        workload.cleanup(session)
+    assert app_module.qa_store.all() == []
+
+def test_stub_error_rate():
+    """A share of stub responses are errors, which the client retries"""
+    with StubUpstream(error_rate=1.0, seed=1) as stub:
+        client = PerplexityClient(base_url=stub.url, api_key='test', max_retries=1, backoff=0.01)
+        with pytest.raises(UpstreamError):
+            client.ask('hello', {}, 15)
+        assert stub.requests_seen == 2 and stub.errors_sent == 2
+        stub.error_rate = 0.0
+        assert client.ask('hello', {}, 15) == 'echo: hello'
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for the queued, structured logging pipeline
+"""
+
+import io
+import json
+import logging
+import threading
+import time
+import pytest
+import app as app_module
+from logging_setup import configure_logging, NonBlockingQueueHandler
+
+@pytest.fixture
+def log_stream():
+    """Route the root logger to a buffer; restore the app's handler afterwards"""
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    stream = io.StringIO()
+    yield stream
+    for handler in list(root.handlers):
+        if isinstance(handler, NonBlockingQueueHandler):
+            handler.stop()
+        root.removeHandler(handler)
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+
+def read_lines(handler, stream):
+    handler.stop()
+    return [line for line in stream.getvalue().splitlines() if line]
+
+def test_json_output_with_extra_fields(log_stream):
+    """JSON lines carry level, message, request ID and extra= fields"""
+    handler = configure_logging('INFO', 'json', stream=log_stream)
+    logging.getLogger('test').info('answered %s', 'q', extra={'duration_ms': 1.5})
+    entry = json.loads(read_lines(handler, log_stream)[0])
+    assert entry['level'] == 'INFO'
+    assert entry['message'] == 'answered q'
+    assert entry['duration_ms'] == 1.5
+    assert entry['request_id'] == '-'
+
+def test_request_id_is_logged_and_echoed(log_stream, client, monkeypatch):
+    """Each request gets an ID that is logged and returned in X-Request-ID"""
+    # Keep the first request from calling create_app(), which would replace this handler
+    monkeypatch.setattr(app_module, 'app_initialized', True)
+    handler = configure_logging('INFO', 'json', stream=log_stream)
+    response = client.get('/get_qas', headers={'X-Request-ID': 'abc-123'})
+    assert response.headers['X-Request-ID'] == 'abc-123'
+    generated = client.get('/get_qas', headers={'X-Request-ID': 'bad id'}).headers['X-Request-ID']
+    assert len(generated) == 32
+    entries = [json.loads(line) for line in read_lines(handler, log_stream)]
+    access = [entry for entry in entries if entry['message'].startswith('GET /get_qas')]
+    assert [entry['request_id'] for entry in access] == ['abc-123', generated]
+    assert all(entry['route'] == '/get_qas' and entry['duration_ms'] >= 0 for entry in access)
+
+def test_sampling_only_drops_sampled_info(log_stream):
+    """A zero sample rate drops sampled info lines but keeps everything else"""
+    handler = configure_logging('INFO', 'text', sample_rate=0.0, stream=log_stream)
+    log = logging.getLogger('test')
+    log.info('hot path', extra={'sample': True})
+    log.warning('sampled warning', extra={'sample': True})
+    log.info('plain info')
+    lines = read_lines(handler, log_stream)
+    assert len(lines) == 2
+    assert 'sampled warning' in lines[0] and 'plain info' in lines[1]
+
+def test_full_queue_drops_instead_of_blocking(log_stream, monkeypatch):
+    """Logging never waits for a slow writer; overflow is counted"""
+    monkeypatch.setattr('logging_setup.QUEUE_SIZE', 2)
+
+    class SlowStream(io.StringIO):
+        def write(self, text):
+            time.sleep(0.2)
+            return super().write(text)
+
+    handler = configure_logging('INFO', 'text', stream=SlowStream())
+    start = time.perf_counter()
+    for i in range(50):
+        logging.getLogger('test').info('line %s', i)
+    assert time.perf_counter() - start < 0.2
+    assert handler.dropped > 0
+    handler.stop()
+
+def test_messages_are_formatted_lazily(log_stream):
+    """Arguments of disabled levels are never formatted"""
+    handler = configure_logging('INFO', 'text', stream=log_stream)
+
+    class Expensive:
+        def __str__(self):
+            raise AssertionError('formatted a debug message')
+
+    logging.getLogger('test').debug('data: %s', Expensive())
+    assert read_lines(handler, log_stream) == []
+
+def test_formatting_happens_in_the_writer_thread(log_stream):
+    """Messages are formatted off the logging thread; exceptions keep their own field"""
+    handler = configure_logging('INFO', 'json', stream=log_stream)
+    formatted_in = []
+
+    class Traced:
+        def __str__(self):
+            formatted_in.append(threading.current_thread().name)
+            return 'traced'
+
+    logging.getLogger('test').info('value %s', Traced())
+    try:
+        raise ValueError('bad value')
+    except ValueError:
+        logging.getLogger('test').exception('boom %s', 1)
+    lines = [json.loads(line) for line in read_lines(handler, log_stream)]
+    assert formatted_in and threading.current_thread().name not in formatted_in
+    assert lines[0]['message'] == 'value traced'
+    assert lines[1]['message'] == 'boom 1'
+    assert 'ValueError: bad value' in lines[1]['exception']
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for the media catalog and the upload routes that use it
+"""
+
+import hashlib
+import io
+import os
+import pytest
+import app as app_module
+from chunked_upload import ChunkedUploads
+from media_catalog import MediaCatalog
+
+@pytest.fixture
+def videos(tmp_path, monkeypatch):
+    folder = tmp_path / 'videos'
+    folder.mkdir()
+    catalog = MediaCatalog(str(tmp_path / 'media.db'), 'video', str(folder), app_module.ALLOWED_VIDEO_EXTENSIONS)
+    monkeypatch.setattr(app_module, 'video_catalog', catalog)
+    monkeypatch.setattr(app_module, 'chunked_uploads', ChunkedUploads(str(tmp_path / 'parts'), 1024 * 1024))
+    monkeypatch.setitem(app_module.app.config, 'VIDEO_UPLOAD_FOLDER', str(folder))
+    return catalog
+
+def upload(client, name, content=b'video bytes'):
+    return client.post('/upload_video', data={'video': (io.BytesIO(content), name)},
+                       content_type='multipart/form-data').get_json()
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+def test_uploads_are_content_addressed_with_stable_numbers(videos):
+    """Identical content is stored once and display numbers survive deletes"""
+    client = app_module.app.test_client()
+    first = upload(client, 'clip.mp4')
+    again = upload(client, 'copy.mp4')
+    assert (first['filename'], first['display_name'], first['duplicate']) == (f"{sha256(b'video bytes')}.mp4", 'Video 1', False)
+    assert (again['filename'], again['duplicate']) == (first['filename'], True)
+
+    second = upload(client, 'other.webm', b'other bytes')
+    assert second['display_name'] == 'Video 2'
+    assert client.delete(f"/delete_video/{first['filename']}").status_code == 200
+    assert client.delete(f"/delete_video/{first['filename']}").status_code == 404
+    third = upload(client, 'clip.mp4')
+    assert third['display_name'] == 'Video 3'
+
+    listing = client.get('/get_videos').get_json()['videos']
+    assert [v['display_name'] for v in listing] == ['Video 2', 'Video 3']
+    assert listing[0]['original_name'] == 'other.webm'
+    assert listing[0]['size'] == len(b'other bytes')
+    assert listing[0]['mime_type'] == 'video/webm'
+    assert sorted(os.listdir(videos.folder)) == sorted([second['filename'], third['filename']])
+
+def test_chunked_upload_resumes_from_offset(videos):
+    """Chunks append at the acknowledged offset and the upload can resume"""
+    client = app_module.app.test_client()
+    content = os.urandom(100000)
+    started = client.post('/uploads', json={'kind': 'video', 'filename': 'big.mp4', 'size': len(content)})
+    assert started.status_code == 201
+    upload_id = started.get_json()['upload_id']
+
+    response = client.patch(f"/uploads/{upload_id}", data=content[:40000], headers={'Upload-Offset': '0'})
+    assert response.get_json()['offset'] == 40000
+    # A retried chunk at a stale offset is refused with the offset to resume from
+    response = client.patch(f"/uploads/{upload_id}", data=content[:40000], headers={'Upload-Offset': '0'})
+    assert (response.status_code, response.get_json()['offset']) == (409, 40000)
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 409
+
+    # Another worker (no cached hasher) picks the upload up
+    app_module.chunked_uploads._hashers.clear()
+    assert client.get(f"/uploads/{upload_id}").get_json()['offset'] == 40000
+    response = client.patch(f"/uploads/{upload_id}", data=content[40000:], headers={'Upload-Offset': '40000'})
+    assert response.get_json()['offset'] == len(content)
+
+    done = client.post(f"/uploads/{upload_id}/finalize").get_json()
+    assert (done['filename'], done['complete'], done['duplicate']) == (f"{sha256(content)}.mp4", True, False)
+    with open(os.path.join(videos.folder, done['filename']), 'rb') as f:
+        assert f.read() == content
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+    # Declaring the hash of stored content skips the upload entirely
+    repeat = client.post('/uploads', json={'kind': 'video', 'filename': 'again.mp4', 'size': len(content),
+                                           'sha256': sha256(content)}).get_json()
+    assert (repeat['complete'], repeat['duplicate'], repeat['filename']) == (True, True, done['filename'])
+
+def test_chunked_upload_rejects_bad_input(videos):
+    """Oversized chunks, wrong hashes and unknown uploads are refused"""
+    client = app_module.app.test_client()
+    assert client.post('/uploads', json={'kind': 'video', 'filename': 'x.exe', 'size': 1}).status_code == 400
+    assert client.post('/uploads', json={'kind': 'video', 'filename': 'x.mp4', 'size': 10 ** 9}).status_code == 413
+    assert client.patch('/uploads/../../etc', data=b'x', headers={'Upload-Offset': '0'}).status_code in (404, 405)
+    assert client.get('/uploads/not-an-id').status_code == 404
+
+    upload_id = client.post('/uploads', json={'kind': 'video', 'filename': 'x.mp4', 'size': 4,
+                                              'sha256': sha256(b'good')}).get_json()['upload_id']
+    response = client.patch(f"/uploads/{upload_id}", data=b'toolong', headers={'Upload-Offset': '0'})
+    assert (response.status_code, response.get_json()['offset']) == (400, 0)
+    client.patch(f"/uploads/{upload_id}", data=b'evil', headers={'Upload-Offset': '0'})
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 422
+    assert os.listdir(videos.folder) == []
+    assert os.listdir(app_module.chunked_uploads.folder) == []
+
+def test_rebuilds_from_disk_when_missing(tmp_path):
+    """A fresh catalog indexes what is already in the folder"""
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    (folder / 'old.png').write_bytes(b'12345')
+    (folder / 'new.jpg').write_bytes(b'1')
+    (folder / 'temp').write_bytes(b'x')
+    os.utime(folder / 'old.png', (1, 1))
+
+    catalog = MediaCatalog(str(tmp_path / 'media.db'), 'image', str(folder), {'png', 'jpg'})
+    items, total = catalog.page()
+    assert total == 2
+    assert [(i['stored_name'], i['number'], i['size']) for i in items] == [('old.png', 1, 5), ('new.jpg', 2, 1)]
+    (tmp_path / 'upload.png').write_bytes(b'png')
+    item, duplicate = catalog.adopt(str(tmp_path / 'upload.png'), 'upload.png', sha256(b'png'))
+    assert (item['number'], duplicate) == (3, False)
+
+    # Reopening an existing catalog does not rescan
+    (folder / 'later.png').write_bytes(b'1')
+    assert MediaCatalog(str(tmp_path / 'media.db'), 'image', str(folder), {'png', 'jpg'}).page()[1] == 3
+
+def test_paging_and_version(videos, tmp_path):
+    """Pages come from the catalog and the version moves on every change"""
+    version = videos.version()
+    for i in range(5):
+        path = tmp_path / f"clip{i}.mp4"
+        path.write_bytes(bytes([i]))
+        videos.adopt(str(path), path.name, sha256(bytes([i])))
+    assert videos.version() > version
+    items, total = videos.page(offset=3, limit=10)
+    assert total == 5
+    assert [i['original_name'] for i in items] == ['clip3.mp4', 'clip4.mp4']
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for fingerprinted media delivery with Range and precompressed variants
+"""
+
+import gzip
+import os
+import pytest
+import app as app_module
+from media_delivery import IMMUTABLE, compress_assets, fingerprint
+
+CONTENT = bytes(range(256)) * 40
+
+@pytest.fixture
+def media(tmp_path, monkeypatch):
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'clip.gif').write_bytes(CONTENT)
+    (tmp_path / 'styles.css').write_text('body { color: red; }\n' * 50)
+    monkeypatch.setitem(app_module.app.config, 'MEDIA_ROOT', str(tmp_path))
+    return tmp_path
+
+def url(name):
+    with app_module.app.test_request_context():
+        return app_module.asset_url(name)
+
+def test_fingerprinted_url_is_immutable(media):
+    """The asset URL carries the content fingerprint and is cached forever"""
+    client = app_module.app.test_client()
+    gif_url = url('images/clip.gif')
+    assert gif_url == f"/media/{fingerprint(str(media / 'images' / 'clip.gif'))}/images/clip.gif"
+    response = client.get(gif_url)
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Cache-Control'] == IMMUTABLE
+    assert response.headers['Content-Type'] == 'image/gif'
+    assert client.get(gif_url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # An outdated fingerprint gets the current file without long-lived caching
+    assert client.get('/media/0000000000000000/images/clip.gif').headers['Cache-Control'] == 'no-cache'
+    assert client.get(f"/media/x/../{media.name}/styles.css").status_code == 404
+    assert client.get('/media/x/missing.gif').status_code == 404
+    assert url('missing.gif') == '/static/missing.gif'
+
+def test_single_and_multiple_ranges(media):
+    """Single ranges are sliced, several ranges come as multipart/byteranges"""
+    client = app_module.app.test_client()
+    gif_url = url('images/clip.gif')
+    response = client.get(gif_url, headers={'Range': 'bytes=100-199'})
+    assert (response.status_code, response.data) == (206, CONTENT[100:200])
+    assert response.headers['Content-Range'] == f"bytes 100-199/{len(CONTENT)}"
+
+    response = client.get(gif_url, headers={'Range': 'bytes=-10'})
+    assert response.data == CONTENT[-10:]
+    response = client.get(gif_url, headers={'Range': f"bytes={len(CONTENT) - 5}-"})
+    assert response.data == CONTENT[-5:]
+
+    response = client.get(gif_url, headers={'Range': 'bytes=0-9,20-29,5-12'})
+    assert response.status_code == 206
+    boundary = response.headers['Content-Type'].split('boundary=')[1]
+    assert int(response.headers['Content-Length']) == len(response.data)
+    parts = response.data.split(f"--{boundary}".encode())[1:-1]
+    assert len(parts) == 2
+    assert parts[0].endswith(b'\r\n\r\n' + CONTENT[0:13] + b'\r\n')
+    assert b'Content-Range: bytes 20-29/' in parts[1]
+
+    assert client.get(gif_url, headers={'Range': f"bytes={len(CONTENT)}-"}).status_code == 416
+    # A Range for an older version is ignored
+    response = client.get(gif_url, headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+    assert (response.status_code, len(response.data)) == (200, len(CONTENT))
+
+def test_precompressed_sidecars(media):
+    """Text assets are sent from their .gz sidecar when the client accepts it"""
+    client = app_module.app.test_client()
+    assert compress_assets([str(media)]) >= 1
+    assert not os.path.exists(media / 'images' / 'clip.gif.gz')
+    css_url = url('styles.css')
+    response = client.get(css_url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == (media / 'styles.css').read_bytes()
+    plain = client.get(css_url)
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['ETag'] != response.headers['ETag']
+
+def test_offload_modes(media, monkeypatch):
+    """Behind nginx or Apache only the headers are sent"""
+    client = app_module.app.test_client()
+    gif_url = url('images/clip.gif')
+    monkeypatch.setitem(app_module.app.config, 'MEDIA_OFFLOAD', 'x-accel')
+    response = client.get(gif_url)
+    assert response.headers['X-Accel-Redirect'] == '/protected-media/images/clip.gif'
+    assert response.data == b''
+    monkeypatch.setitem(app_module.app.config, 'MEDIA_OFFLOAD', 'x-sendfile')
+    response = client.get(gif_url)
+    assert response.headers['X-Sendfile'] == str(media / 'images' / 'clip.gif')
+    assert response.data == b''
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the background derivative pipeline
+"""
+
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import app as app_module
+import media_jobs
+from media_catalog import MediaCatalog
+from media_jobs import DerivativeJobs
+
+@pytest.fixture
+def jobs(tmp_path):
+    executor = ThreadPoolExecutor(2)
+    yield DerivativeJobs(str(tmp_path / 'media.db'), executor=executor)
+    executor.shutdown(wait=True)
+
+def test_jobs_run_once_and_report_status(jobs, monkeypatch):
+    """A job is claimed once across callers and its result is delivered"""
+    release = threading.Event()
+    results = []
+    monkeypatch.setitem(media_jobs.TASKS, 'echo', lambda value: release.wait(5) and value)
+
+    assert jobs.submit('echo', 'a', ('result',), on_done=results.append)
+    assert not jobs.submit('echo', 'a', ('result',))
+    assert jobs.stats()['counts']['queued'] == 1
+    release.set()
+    jobs._executor.shutdown(wait=True)
+
+    assert results == ['result']
+    assert jobs.state('echo', 'a') == 'done'
+    assert not jobs.submit('echo', 'a', ('result',))
+    stats = jobs.stats()
+    assert stats['counts'] == {'queued': 0, 'done': 1, 'failed': 0}
+    assert stats['recent'][0]['key'] == 'a'
+
+def test_failed_jobs_can_run_again(jobs, monkeypatch):
+    """Failures are recorded with their error and the job can be retried"""
+    def fail():
+        raise ValueError('broken image')
+    monkeypatch.setitem(media_jobs.TASKS, 'fail', fail)
+    jobs.submit('fail', 'x', ())
+    jobs._executor.shutdown(wait=True)
+    assert jobs.state('fail', 'x') == 'failed'
+    assert jobs.stats()['recent'][0]['error'] == 'broken image'
+
+    jobs._executor = ThreadPoolExecutor(1)
+    assert jobs.submit('fail', 'x', ())
+    jobs.forget('fail', 'x')
+    assert jobs.state('fail', 'x') is None
+
+def test_image_derivatives(tmp_path):
+    """Thumbnails and smaller responsive widths are written as WebP and JPEG"""
+    Image = pytest.importorskip('PIL.Image')
+    source = tmp_path / 'photo.png'
+    Image.new('RGBA', (1500, 1000), (200, 10, 10, 128)).save(source)
+    derivatives = media_jobs.make_image_derivatives(str(source), str(tmp_path / 'out'), 'photo')
+    assert (derivatives['thumbnail']['width'], derivatives['thumbnail']['height']) == (320, 213)
+    assert [w['width'] for w in derivatives['widths']] == [640, 1280]
+    with Image.open(tmp_path / 'out' / derivatives['widths'][0]['jpeg']) as jpeg:
+        assert jpeg.size == (640, 427)
+
+def test_animation_derivative(tmp_path):
+    """An animated GIF becomes an animated WebP with the same frames"""
+    Image = pytest.importorskip('PIL.Image')
+    frames = [Image.new('RGB', (64, 64), (i * 40, 0, 0)) for i in range(5)]
+    source = tmp_path / 'header.gif'
+    frames[0].save(source, save_all=True, append_images=frames[1:], duration=80, loop=0)
+    result = media_jobs.make_animation_derivatives(str(source), str(tmp_path / 'derived'), 'header')
+    with Image.open(tmp_path / 'derived' / result['webp']) as webp:
+        assert webp.n_frames == 5
+
+def test_upload_exposes_derivatives(tmp_path, monkeypatch):
+    """get_images lists derivative URLs once the job has finished"""
+    Image = pytest.importorskip('PIL.Image')
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    catalog = MediaCatalog(str(tmp_path / 'media.db'), 'image', str(folder), app_module.ALLOWED_IMAGE_EXTENSIONS)
+    executor = ThreadPoolExecutor(1)
+    monkeypatch.setattr(app_module, 'image_catalog', catalog)
+    monkeypatch.setattr(app_module, 'derivative_jobs', DerivativeJobs(str(tmp_path / 'media.db'), executor=executor))
+    monkeypatch.setattr(app_module, 'DERIVATIVES_FOLDER', str(tmp_path / 'derivatives'))
+    body = io.BytesIO()
+    Image.new('RGB', (800, 600), (0, 120, 0)).save(body, 'PNG')
+    body.seek(0)
+
+    client = app_module.app.test_client()
+    client.post('/upload_image', data={'image': (body, 'photo.png')}, content_type='multipart/form-data')
+    executor.shutdown(wait=True)
+    image = client.get('/get_images').get_json()['images'][0]
+    assert image['derivatives']['thumbnail']['webp'].endswith('-thumb.webp')
+    assert image['derivatives']['srcset']['jpeg'].endswith(' 640w')
+    assert client.get('/media_jobs').get_json()['jobs']['counts']['done'] == 1
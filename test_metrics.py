@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus metrics registry and the /metrics endpoint
+"""
+
+import multiprocessing
+import app as app_module
+from metrics import Registry
+from qa_store import QAStore
+
+def test_histogram_and_counter_format(tmp_path):
+    """Histograms are cumulative with +Inf, sum and count; labels are escaped"""
+    registry = Registry(str(tmp_path))
+    latency = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    hits = registry.counter('hits_total', 'Hits', ('source',))
+    latency.observe(0.05, route='/a')
+    latency.observe(0.5, route='/a')
+    latency.observe(5, route='/a')
+    hits.inc(source='say "hi"')
+    hits.inc(2, source='say "hi"')
+
+    text = registry.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'latency_seconds_sum{route="/a"} 5.55' in text
+    assert 'latency_seconds_count{route="/a"} 3' in text
+    assert 'hits_total{source="say \\"hi\\""} 3' in text
+
+def worker(directory, amount):
+    registry = Registry(directory)
+    registry.counter('requests_total', 'Requests').inc(amount)
+    registry.flush()
+
+def test_values_add_up_across_processes(tmp_path):
+    """A scrape in one process includes what other processes recorded"""
+    registry = Registry(str(tmp_path))
+    requests = registry.counter('requests_total', 'Requests')
+    requests.inc(1)
+    context = multiprocessing.get_context('fork')
+    for amount in (2, 3):
+        process = context.Process(target=worker, args=(str(tmp_path), amount))
+        process.start()
+        process.join()
+    assert 'requests_total 6' in registry.render()
+
+    # A restarted process with the same PID continues from its old file
+    registry.flush()
+    again = Registry(str(tmp_path))
+    again.counter('requests_total', 'Requests').inc(1)
+    assert 'requests_total 7' in again.render()
+
+def test_answer_and_request_metrics(tmp_path, monkeypatch):
+    """Answers are counted by source and requests timed by route"""
+    store = QAStore(str(tmp_path / 'qa.json'),
+                    persist_timer=lambda operation: app_module.PERSIST_LATENCY.time(operation=operation))
+    monkeypatch.setattr(app_module, 'qa_store', store)
+    client = app_module.app.test_client()
+    client.post('/add_qa', data={'question': 'Who are you', 'answer': 'Teena'})
+    client.post('/get_answer', json={'question': 'who are you'})
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'answers_total{endpoint="get_answer",source="custom"}' in text
+    assert 'http_request_duration_seconds_count{route="/get_answer",method="POST",status="200"}' in text
+    assert 'qa_persist_duration_seconds_count{operation="insert"}' in text
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk Q&A import and export
+"""
+
+import io
+import json
+import app as app_module
+import qa_bulk
+
+def test_json_array_parser_handles_chunk_boundaries(monkeypatch):
+    """Elements split across reads are reassembled, including multi-byte text"""
+    monkeypatch.setattr(qa_bulk, 'CHUNK_SIZE', 3)
+    body = '[{"question": "café", "answer": "a"}, 42, {"id": "x"}]'.encode('utf-8')
+    rows = list(qa_bulk.iter_json_array(io.BytesIO(body)))
+    assert rows == [(1, {'question': 'café', 'answer': 'a'}), (2, 42), (3, {'id': 'x'})]
+
+    rows = list(qa_bulk.iter_json_array(io.BytesIO(b'[{"a": 1}, {"b": ]')))
+    assert rows[0] == (1, {'a': 1})
+    assert isinstance(rows[1][1], qa_bulk.BulkRowError)
+
+def test_bulk_ndjson_reports_row_errors(client):
+    """Valid rows are applied in one go; bad rows are reported by number"""
+    body = '\n'.join([
+        json.dumps({'id': 'a', 'question': 'What is your name', 'answer': 'tina'}),
+        'not json',
+        json.dumps({'question': 'who created you', 'answer': 'i robotics'}),
+        json.dumps({'question': '', 'answer': 'empty'}),
+        json.dumps({'op': 'delete', 'id': 'missing'}),
+    ])
+    response = client.post('/bulk_qa', data=body, content_type='application/x-ndjson')
+    data = response.get_json()
+    assert data['status'] == 'partial'
+    assert (data['inserted'], data['updated'], data['deleted']) == (2, 0, 0)
+    assert [error['row'] for error in data['errors']] == [2, 4, 5]
+    assert app_module.qa_store.find_by_question('what is your name')['id'] == 'a'
+
+    body = json.dumps([
+        {'id': 'a', 'question': 'what is your name', 'answer': 'teena'},
+        {'op': 'delete', 'id': 'a'},
+        {'op': 'insert', 'id': 'b', 'question': 'hey hi', 'answer': 'hello'},
+    ])
+    data = client.post('/bulk_qa', data=body, content_type='application/json').get_json()
+    assert data['status'] == 'success'
+    assert (data['inserted'], data['updated'], data['deleted']) == (1, 1, 1)
+    assert sorted(qa['question'] for qa in app_module.qa_store.all()) == ['hey hi', 'who created you']
+
+def test_export_round_trips(client):
+    """Both export formats can be imported again"""
+    client.post('/bulk_qa', data=json.dumps([
+        {'question': 'what is ai', 'answer': 'artificial intelligence'},
+        {'question': 'tell me a joke', 'answer': 'knock knock'},
+    ]), content_type='application/json')
+    original = app_module.qa_store.all()
+
+    ndjson = client.get('/export_qa').get_data(as_text=True)
+    assert [json.loads(line) for line in ndjson.splitlines()] == original
+
+    exported = client.get('/export_qa?format=json').get_data(as_text=True)
+    assert json.loads(exported) == original
+    data = client.post('/bulk_qa', data=exported, content_type='application/json').get_json()
+    assert (data['inserted'], data['updated']) == (0, 2)
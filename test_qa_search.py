@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for fuzzy custom Q&A matching
+"""
+
+import pytest
+import qa_search
+from qa_search import QASearchIndex
+from qa_store import QAStore
+
+ENTRIES = [
+    {'id': '1', 'question': 'what is your name', 'answer': 'my name is Tina'},
+    {'id': '2', 'question': 'who created you', 'answer': 'i was created by I Robotics'},
+    {'id': '3', 'question': 'tell me about your self', 'answer': 'i am a robot'},
+    {'id': '4', 'question': 'tell me a joke', 'answer': 'knock knock'},
+]
+
+def test_exact_question_scores_one():
+    """A stored question matches itself with full confidence"""
+    index = QASearchIndex(ENTRIES)
+    qa, confidence = index.search('who created you')
+    assert qa['id'] == '2'
+    assert confidence == pytest.approx(1.0)
+
+def test_paraphrase_ranks_the_right_entry():
+    """Near-miss transcripts still find the intended entry"""
+    index = QASearchIndex(ENTRIES)
+    qa, confidence = index.search('tell me about yourself')
+    assert qa['id'] == '3'
+    assert 0 < confidence < 1
+    assert index.search('completely unrelated words')[1] < 0.3
+    assert index.search('') == (None, 0.0)
+
+def test_index_updates_incrementally():
+    """add/replace/remove change what search returns"""
+    index = QASearchIndex(ENTRIES)
+    index.add({'id': '5', 'question': 'where are you located', 'answer': 'coimbatore'})
+    assert index.search('where are you located')[0]['id'] == '5'
+
+    index.replace(ENTRIES[3], {**ENTRIES[3], 'question': 'say something funny'})
+    assert index.search('say something funny')[0]['id'] == '4'
+
+    index.remove(ENTRIES[1])
+    qa, _ = index.search('who created you')
+    assert qa is None or qa['id'] != '2'
+    assert len(index) == 4
+
+def test_removed_entries_never_match():
+    """Removed entries stay out of results until and after the index compacts"""
+    entries = [{'id': str(n), 'question': f"where is room {n}", 'answer': str(n)} for n in range(100)]
+    index = QASearchIndex(entries)
+    for qa in entries[:40]:
+        index.replace(qa, {**qa, 'question': f"when does class {qa['id']} start"})
+    index.remove(entries[50])
+    assert index.search('where is room 50')[0]['id'] != '50'
+    assert index.search('where is room 7')[0]['question'] != 'where is room 7'
+    assert index.search('when does class 7 start')[0]['id'] == '7'
+    for qa in entries[41:80]:
+        index.remove(qa)
+    assert len(index) == 61 and len(index._entries) < 100
+    assert index.search('where is room 90')[0]['id'] == '90'
+
+def test_common_terms_only_scored_for_candidates(monkeypatch):
+    """With a small candidate budget the best entry is still found with the full score"""
+    entries = [{'id': str(n), 'question': f"what is the price of the ticket number {n}", 'answer': str(n)}
+               for n in range(300)]
+    entries.append({'id': 'x', 'question': 'what is the price of the museum guide', 'answer': 'free'})
+    full = QASearchIndex(entries).search('what is the price of the museum guide please')
+    monkeypatch.setattr(qa_search, 'CANDIDATE_POSTINGS', 10)
+    monkeypatch.setattr(qa_search, 'TOP_CANDIDATES', 5)
+    qa, confidence = QASearchIndex(entries).search('what is the price of the museum guide please')
+    assert qa['id'] == 'x' == full[0]['id']
+    assert confidence == pytest.approx(full[1])
+
+def test_store_match_applies_threshold(tmp_path):
+    """QAStore.match prefers exact hits and rejects weak fuzzy ones"""
+    store = QAStore(str(tmp_path / 'qa.json'))
+    store.replace(ENTRIES)
+    assert store.match("What's your name?", 0.7) == (ENTRIES[0], 1.0)
+    assert store.match('who created you please', 0.7)[0]['id'] == '2'
+    qa, confidence = store.match('what is your age', 0.99)
+    assert qa is None and confidence < 0.99
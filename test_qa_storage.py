@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the Q&A storage backends
+"""
+
+import json
+import multiprocessing
+import os
+import pytest
+from qa_storage import JSONFileBackend, SQLiteBackend
+from qa_store import QAStore
+
+def make_backend(kind, tmp_path):
+    if kind == 'json':
+        return JSONFileBackend(str(tmp_path / 'qa.json'))
+    return SQLiteBackend(str(tmp_path / 'qa.db'))
+
+@pytest.mark.parametrize('kind', ['json', 'sqlite'])
+def test_crud_is_visible_to_other_stores(kind, tmp_path):
+    """A second store on the same storage sees every write"""
+    writer = QAStore(backend=make_backend(kind, tmp_path))
+    reader = QAStore(backend=make_backend(kind, tmp_path))
+    assert reader.all() == []
+
+    first = writer.add('what is your name', 'tina')
+    second = writer.add('who created you', 'i robotics')
+    assert [qa['id'] for qa in reader.all()] == [first['id'], second['id']]
+
+    writer.update(first['id'], 'what is your name', 'teena')
+    assert reader.get(first['id'])['answer'] == 'teena'
+    assert [qa['id'] for qa in reader.all()] == [first['id'], second['id']]
+
+    writer.delete(second['id'])
+    assert reader.find_by_question('who created you') is None
+    assert len(reader.all()) == 1
+
+def test_json_writes_are_atomic(tmp_path):
+    """The JSON file is replaced, never rewritten in place, and no temp files remain"""
+    path = tmp_path / 'qa.json'
+    store = QAStore(str(path))
+    store.add('hey hi', 'hello')
+    inode = os.stat(path).st_ino
+    store.add('what is ai', 'artificial intelligence')
+    assert os.stat(path).st_ino != inode
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['qa.json', 'qa.json.lock']
+    with open(path) as f:
+        assert len(json.load(f)) == 2
+
+def test_sqlite_migrates_from_json(tmp_path):
+    """The first start with SQLite imports the JSON file once"""
+    json_path = str(tmp_path / 'qa.json')
+    with open(json_path, 'w') as f:
+        json.dump([{'id': '1', 'question': 'hey hi', 'answer': 'hello'},
+                   {'question': 'what is ai', 'answer': 'artificial intelligence'}], f)
+    db_path = str(tmp_path / 'qa.db')
+
+    backend = SQLiteBackend(db_path, migrate_from=json_path)
+    entries = backend.load()
+    assert [qa['question'] for qa in entries] == ['hey hi', 'what is ai']
+    assert all(qa['id'] for qa in entries)
+
+    # Later changes to the JSON file are not imported again
+    with open(json_path, 'w') as f:
+        json.dump([], f)
+    assert len(SQLiteBackend(db_path, migrate_from=json_path).load()) == 2
+
+def add_many(kind, tmp_path, prefix, count):
+    store = QAStore(backend=make_backend(kind, tmp_path))
+    for i in range(count):
+        store.add(f"{prefix} question {i}", 'answer')
+
+@pytest.mark.parametrize('kind', ['json', 'sqlite'])
+def test_concurrent_workers_do_not_lose_writes(kind, tmp_path):
+    """Several processes adding at once end up with every entry"""
+    make_backend(kind, tmp_path)
+    workers = [multiprocessing.Process(target=add_many, args=(kind, tmp_path, f"worker {n}", 20))
+               for n in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(QAStore(backend=make_backend(kind, tmp_path)).all()) == 60
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the process-resident Q&A store
+"""
+
+import json
+from qa_index import QAIndex, normalize_question
+from qa_store import QAStore
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def test_loads_once_and_assigns_ids(tmp_path):
+    """Entries without IDs get one, and the backfill is written back"""
+    path = tmp_path / 'qa.json'
+    write_json(path, [{'question': 'what is your name', 'answer': 'tina'}])
+    store = QAStore(str(path))
+
+    entries = store.all()
+    assert len(entries) == 1
+    assert entries[0]['id']
+    with open(path) as f:
+        assert json.load(f)[0]['id'] == entries[0]['id']
+
+def test_writes_persist_and_are_served_from_memory(tmp_path):
+    """add/update/delete hit the file and the in-memory copy"""
+    path = tmp_path / 'qa.json'
+    store = QAStore(str(path))
+
+    qa = store.add('who created you', 'i robotics')
+    assert store.find_by_question('who created you')['answer'] == 'i robotics'
+    assert store.update(qa['id'], 'who built you', 'i robotics')['question'] == 'who built you'
+    assert store.find_by_question('who created you') is None
+    assert store.update('missing', 'q', 'a') is None
+
+    reopened = QAStore(str(path))
+    assert [e['question'] for e in reopened.all()] == ['who built you']
+
+    assert store.delete(qa['id'])
+    assert not store.delete(qa['id'])
+    assert store.all() == []
+
+def test_reloads_when_file_changes(tmp_path):
+    """A write from another process is picked up on the next access"""
+    path = tmp_path / 'qa.json'
+    write_json(path, [{'id': '1', 'question': 'hey hi', 'answer': 'hello'}])
+    store = QAStore(str(path))
+    assert store.find_by_question('hey hi')['answer'] == 'hello'
+    version = store.version
+
+    # Untouched file: no reload
+    store.all()
+    assert store.version == version
+
+    other = QAStore(str(path))
+    other.add('what time is it', 'late')
+    assert store.find_by_question('what time is it')['answer'] == 'late'
+    assert store.version > version
+
+def test_normalize_question():
+    """Transcript noise maps onto the stored question form"""
+    assert normalize_question("What's your name?") == 'what is your name'
+    assert normalize_question('  um,  who   created you, please ') == 'who created you'
+    assert normalize_question("I can't hear you") == 'i cannot hear you'
+    assert normalize_question("You're the robot's friend") == 'you are the robots friend'
+    assert normalize_question('Hey  hi!') == 'hey hi'
+
+def test_index_is_maintained_incrementally():
+    """ID and question lookups follow add/replace/remove"""
+    first = {'id': '1', 'question': 'what is your name', 'answer': 'tina'}
+    second = {'id': '2', 'question': 'who created you', 'answer': 'i robotics'}
+    index = QAIndex([first, second])
+    assert index.find("uh what's your name") is first
+    assert index.get('2') is second
+
+    renamed = {**first, 'question': 'what are you called'}
+    index.replace(first, renamed)
+    assert index.find('what is your name') is None
+    assert index.find('What are you called?') is renamed
+    assert [qa['id'] for qa in index.entries()] == ['1', '2']
+
+    index.remove(second)
+    assert index.get('2') is None
+    assert index.find('who created you') is None
+
+def test_duplicate_questions_keep_insertion_order():
+    """find() keeps returning the earliest entry when duplicates are updated"""
+    first = {'id': '1', 'question': 'where is the library', 'answer': 'upstairs'}
+    second = {'id': '2', 'question': 'Where is the library?', 'answer': 'first floor'}
+    third = {'id': '3', 'question': 'where is the gym', 'answer': 'outside'}
+    index = QAIndex([first, second, third])
+    updated = {**first, 'answer': 'second floor'}
+    index.replace(first, updated)
+    assert index.find('where is the library') is updated
+    moved = {**third, 'question': 'where is the library'}
+    index.replace(third, moved)
+    index.replace(second, {**second, 'question': 'where is the cafeteria'})
+    index.replace(moved, {**moved, 'answer': 'in the basement'})
+    assert index.find('where is the library') is updated
+    assert index.by_question['where is the library'] == ['1', '3']
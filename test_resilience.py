@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Tests for the upstream circuit breaker, hedged requests and fallback answers
+"""
+
+import asyncio
+import threading
+import time
+import pytest
+import app as app_module
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, UpstreamGuard, is_upstream_failure
+from upstream import UpstreamError
+
+class FlakyUpstream:
+    """Fails while `down` is set, otherwise answers at once"""
+    model = 'test-model'
+    api_key = 'test'
+
+    def __init__(self):
+        self.down = False
+        self.calls = 0
+
+    def ask(self, question, context, max_tokens):
+        self.calls += 1
+        if 'reject me' in question:
+            raise UpstreamError('Upstream returned HTTP 400', 400)
+        if self.down:
+            raise UpstreamError('Upstream returned HTTP 503', 503)
+        return f"answer to {question}"
+
+    def stream(self, question, context, max_tokens):
+        self.calls += 1
+        if self.down:
+            raise UpstreamError('Upstream returned HTTP 503', 503)
+        yield f"answer to {question}"
+
+@pytest.fixture
+def upstream():
+    return FlakyUpstream()
+
+@pytest.fixture
+def qa_pairs():
+    return [('what are the opening hours of the library', 'The library opens at 9'),
+            ('who created you', 'I Robotics'), ('where is the cafeteria', 'Ground floor'),
+            ('how do i pay the fees', 'At the office')]
+
+@pytest.fixture
+def client(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'upstream_guard',
+                        UpstreamGuard(CircuitBreaker(failure_threshold=2, reset_timeout=60), hedge_percentile=0))
+    return client
+
+def test_breaker_opens_probes_and_closes(monkeypatch):
+    """Opens after repeated failures, lets one probe through after the timeout"""
+    now = [100.0]
+    monkeypatch.setattr(resilience.time, 'monotonic', lambda: now[0])
+    events = []
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, listener=lambda *event: events.append(event))
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    now[0] += 10
+    assert breaker.allow() and breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.stats()['retry_in'] == 10
+    now[0] += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+    assert breaker.stats()['times_opened'] == 2 and breaker.stats()['rejected'] == 2
+    assert ('state', 'open') in events and ('rejected', 'open') in events
+
+def test_hedged_call_uses_the_faster_attempt():
+    """A call slower than the hedge threshold gets a second attempt, which wins"""
+    guard = UpstreamGuard(hedge_percentile=50, hedge_min_samples=1, hedge_max_ratio=1.0)
+    guard.durations.append(0.02)
+    attempts = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            attempts.append(1)
+            slow = len(attempts) == 1
+        time.sleep(1.0 if slow else 0.01)
+        return 'slow' if slow else 'fast'
+
+    start = time.perf_counter()
+    assert guard.call(call) == 'fast'
+    assert time.perf_counter() - start < 0.5
+    assert guard.stats()['hedging']['hedged'] == 1 and guard.stats()['hedging']['hedge_wins'] == 1
+
+def test_hedges_are_rationed_and_async_losers_cancelled():
+    """Hedging is capped by hedge_max_ratio; the async loser is cancelled"""
+    guard = UpstreamGuard(hedge_percentile=50, hedge_min_samples=1, hedge_max_ratio=0.5)
+    guard.durations.append(0.01)
+    cancelled = []
+
+    async def slow_then_fast(delays):
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    async def scenario():
+        # The first and third calls are over the 50% hedge budget
+        delays = [0.05, 1.0, 0.01, 0.05]
+        results = [await guard.call_async(lambda: slow_then_fast(delays)) for _ in range(3)]
+        await asyncio.sleep(0)
+        return results
+
+    assert asyncio.run(scenario()) == [0.05, 0.01, 0.05]
+    assert cancelled == [1.0]
+    assert guard.stats()['hedging']['hedged'] == 1
+
+def test_open_breaker_fails_fast_with_fallback(client):
+    """Once open, no API calls are made and the closest custom Q&A answers"""
+    client.upstream.down = True
+    for _ in range(2):
+        body = client.post('/get_answer', json={'question': 'library opening hours'}).get_json()
+        assert body['source'] == 'fallback' and body['fallback'] == 'custom' and body['low_confidence']
+        assert body['answer'] == 'The library opens at 9'
+    calls = client.upstream.calls
+    assert app_module.upstream_guard.breaker.state == 'open'
+    body = client.post('/get_answer', json={'question': 'tell me a joke'}).get_json()
+    assert body == {'answer': app_module.UPSTREAM_FAILED_ANSWER}
+    assert client.upstream.calls == calls
+    status = client.get('/upstream_status').get_json()
+    assert status['breaker']['state'] == 'open' and status['breaker']['rejected'] == 1
+    with pytest.raises(CircuitOpenError):
+        app_module.upstream_guard.call(lambda: 'never called')
+
+def test_fallback_to_answer_cached_without_history(client):
+    """A follow-up in a conversation falls back to the cached standalone answer"""
+    assert client.post('/get_answer', json={'question': 'tell me a joke'}).get_json()['source'] == 'perplexity'
+    session = client.post('/get_answer', json={'question': 'hello', 'session_id': None}).get_json()['session_id']
+    client.upstream.down = True
+    body = client.post('/get_answer', json={'question': 'tell me a joke', 'session_id': session}).get_json()
+    assert body == {'answer': 'answer to tell me a joke', 'source': 'fallback', 'fallback': 'cache',
+                    'low_confidence': True, 'session_id': session}
+
+def test_weak_custom_matches_are_not_used_as_fallbacks(client):
+    """Questions that only share a few words with a custom entry get the apology"""
+    client.upstream.down = True
+    # Score about 0.54 against 'where is the cafeteria' and 0.46 against 'who created you'
+    for question in ['where is the library', 'who are you']:
+        body = client.post('/get_answer', json={'question': question}).get_json()
+        assert body == {'answer': app_module.UPSTREAM_FAILED_ANSWER}
+
+def test_stream_and_batch_fallbacks(client):
+    """Streams and batch items use the same fallbacks"""
+    client.upstream.down = True
+    body = client.post('/get_answer_stream', json={'question': 'library opening hours'}).get_data(as_text=True)
+    assert body.startswith('event: answer') and '"source": "fallback"' in body
+    body = client.post('/get_answers', json={'questions': ['library opening hours', 'tell me a joke']}).get_json()
+    assert [item['source'] for item in body['answers']] == ['fallback', 'error']
+    assert 'error' in body['answers'][0]
+    assert app_module.upstream_guard.breaker.state == 'open'
+
+def test_only_upstream_faults_count_as_failures():
+    """Timeouts, connection errors, 429 and 5xx trip the breaker; request errors do not"""
+    assert all(is_upstream_failure(e) for e in [UpstreamError('timed out'), UpstreamError('busy', 429),
+                                                 UpstreamError('down', 502), TimeoutError(), ConnectionError()])
+    assert not any(is_upstream_failure(e) for e in [UpstreamError('bad request', 400), ValueError('bad'),
+                                                     CircuitOpenError('open')])
+    guard = UpstreamGuard(CircuitBreaker(failure_threshold=1), hedge_percentile=0)
+
+    def bad_input():
+        raise ValueError('invalid literal for int()')
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            guard.call(bad_input)
+    assert guard.breaker.state == 'closed' and guard.breaker.failures == 0
+
+def test_invalid_client_input_leaves_breaker_closed(client):
+    """Bad max_tokens is a 400, and upstream 400s never open the breaker"""
+    for _ in range(5):
+        response = client.post('/get_answer', json={'question': 'tell me a joke', 'max_tokens': 'lots'})
+        assert response.status_code == 400
+    assert client.post('/get_answer_stream', json={'question': 'hi', 'max_tokens': -1}).status_code == 400
+    assert client.post('/get_answers', json={'questions': ['hi'], 'max_tokens': True}).status_code == 400
+    for _ in range(3):
+        client.post('/get_answer', json={'question': 'please reject me'})
+    assert client.upstream.calls == 3
+    status = client.get('/upstream_status').get_json()['breaker']
+    assert status['state'] == 'closed' and status['consecutive_failures'] == 0
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Tests for single-flight coalescing of upstream calls
+"""
+
+import threading
+import time
+import pytest
+from singleflight import SingleFlight, SingleFlightTimeout
+
+def run_concurrently(count, target):
+    results = [None] * count
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_calls_share_one_execution():
+    """Only the leader runs the function; everyone gets its result"""
+    flight = SingleFlight()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'answer'
+
+    results = run_concurrently(8, lambda: flight.do('key', slow, timeout=5))
+    assert results == ['answer'] * 8
+    assert len(calls) == 1
+    assert flight.stats() == {'in_flight': 0, 'executed': 1, 'coalesced': 7}
+
+def test_errors_fan_out_to_waiters():
+    """A failing leader fails every waiter, and the next call starts fresh"""
+    flight = SingleFlight()
+    def failing():
+        time.sleep(0.2)
+        raise ValueError('upstream down')
+
+    results = run_concurrently(4, lambda: flight.do('key', failing, timeout=5))
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.do('key', lambda: 'recovered') == 'recovered'
+
+def test_waiters_time_out():
+    """A waiter stops waiting after its timeout; the leader still finishes"""
+    flight = SingleFlight()
+    started = threading.Event()
+    def slow():
+        started.set()
+        time.sleep(0.3)
+        return 'late'
+
+    leader = threading.Thread(target=lambda: flight.do('key', slow))
+    leader.start()
+    started.wait()
+    with pytest.raises(SingleFlightTimeout):
+        flight.do('key', slow, timeout=0.05)
+    leader.join()
+    assert flight.in_flight() == 0
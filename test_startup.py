@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Tests for the app factory, lazy imports and warm-up
+"""
+
+import json
+import os
+import subprocess
+import sys
+import app as app_module
+from qa_store import QAStore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def test_import_defers_optional_libraries(tmp_path):
+    """Importing the app does not load the HTTP clients or Pillow, nor create any files"""
+    code = ("import sys, json, app; "
+            "print(json.dumps([m in sys.modules for m in ('requests', 'aiohttp', 'PIL')]))")
+    env = dict(os.environ, PYTHONPATH=HERE)
+    output = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True)
+    assert json.loads(output.stdout.strip().splitlines()[-1]) == [False, False, False]
+    assert os.listdir(tmp_path) == []
+
+def test_create_app_warm_up(monkeypatch, tmp_path):
+    """Warm-up loads the Q&A store and renders the landing page"""
+    store = QAStore(str(tmp_path / 'qa.json'))
+    monkeypatch.setattr(app_module, 'qa_store', store)
+    monkeypatch.setattr(app_module, 'index_page', None)
+    assert app_module.create_app(warm=True) is app_module.app
+    assert app_module.create_app() is app_module.app
+    assert store._loaded
+    assert app_module.index_page is not None
+    assert 'requests' in sys.modules
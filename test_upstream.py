@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Tests for the Perplexity upstream client against a local stub server
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import app as app_module
+from answer_cache import AnswerCache
+from upstream import PerplexityClient, UpstreamError
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Status codes to return before answering successfully
+    failures = []
+    requests_seen = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubHandler.requests_seen += 1
+        if StubHandler.failures:
+            self.send_response(StubHandler.failures.pop(0))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if body.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            for word in ['echo: ', 'streamed. ', body['messages'][-1]['content']]:
+                self.wfile.write(f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+        answer = json.dumps({'choices': [{'message': {'content': f"echo: {body['messages'][-1]['content']}"}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    StubHandler.failures = []
+    StubHandler.requests_seen = 0
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_ask_uses_configured_base_url(stub_url):
+    """Answers come back from the stub and the session is reused"""
+    client = PerplexityClient(base_url=stub_url, api_key='test')
+    assert client.ask('hello', {}, 15) == 'echo: hello'
+    session = client._session()
+    assert client.ask('again', {}, 15) == 'echo: again'
+    assert client._session() is session
+
+def test_retries_transient_errors(stub_url):
+    """429 and 5xx are retried with backoff until the retry budget runs out"""
+    client = PerplexityClient(base_url=stub_url, api_key='test', backoff=0.01, max_retries=2)
+    StubHandler.failures = [429, 503]
+    assert client.ask('hello', {}, 15) == 'echo: hello'
+    assert StubHandler.requests_seen == 3
+
+    StubHandler.failures = [500, 500, 500]
+    with pytest.raises(UpstreamError) as excinfo:
+        client.ask('hello', {}, 15)
+    assert excinfo.value.status == 500
+
+def test_client_errors_are_not_retried(stub_url):
+    """A 400 fails straight away"""
+    client = PerplexityClient(base_url=stub_url, api_key='test', backoff=0.01)
+    StubHandler.failures = [400]
+    with pytest.raises(UpstreamError):
+        client.ask('hello', {}, 15)
+    assert StubHandler.requests_seen == 1
+
+def test_timeout_scales_with_max_tokens():
+    """Longer answers get a longer read timeout, up to a cap"""
+    client = PerplexityClient(read_timeout=5, read_timeout_per_token=0.1, max_read_timeout=20)
+    assert client.timeout_for(10) == (client.connect_timeout, 6)
+    assert client.timeout_for(10000)[1] == 20
+
+def test_stream_yields_pieces(stub_url):
+    """Streamed completions are yielded piece by piece"""
+    client = PerplexityClient(base_url=stub_url, api_key='test')
+    assert list(client.stream('hello', {}, 15)) == ['echo: ', 'streamed. ', 'hello']
+
+def test_get_answer_stream_route(stub_url, monkeypatch):
+    """Upstream answers stream as delta events; custom hits as one answer event"""
+    monkeypatch.setattr(app_module, 'upstream_client', PerplexityClient(base_url=stub_url, api_key='test'))
+    monkeypatch.setattr(app_module, 'answer_cache', AnswerCache(max_entries=10))
+    client = app_module.app.test_client()
+
+    body = client.post('/get_answer_stream', json={'question': 'why is the sky blue'}).get_data(as_text=True)
+    events = [block.split('\n')[0] for block in body.strip().split('\n\n')]
+    assert events == ['event: delta'] * 3 + ['event: answer']
+    assert '"source": "perplexity"' in body
+    assert app_module.answer_cache.stats()['entries'] == 1
+
+    response = client.post('/get_answer_stream', json={'question': 'What is your name?'})
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.startswith('event: answer') and '"source": "custom"' in body
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.perplexity.ai'
+DEFAULT_MODEL = 'mistral-7b-instruct'
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# The HTTP client libraries are imported on first use rather than with this
+# module, so starting the app does not pay for them until the first API call
+# (or preload(), see app.warm_up)
+def _requests():
+    import requests
+    import requests.adapters
+    return requests
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError:  # aiohttp is only needed by the async serving mode (asgi.py)
+        raise UpstreamError('aiohttp is not installed')
+    return aiohttp
+
+
+# Chat messages for a question, with the persona taken from the request
+# context. chat_summary (set for server-side conversations, see
+# conversations.py) sums up turns older than the chat history.
+def build_messages(question, context, max_tokens):
+    summary = f"{context['chat_summary']}. " if context.get('chat_summary') else ''
+    return [
+        {
+            'role': 'system',
+            'content': (
+                f"You are {context.get('name', 'Teena')}, a {context.get('role', 'Personal AI robot')} "
+                f"created by {context.get('creator', 'I Robotics')} in {context.get('location', 'Coimbatore')}. "
+                f"{summary}"
+                f"Answer questions based on the following chat history: {json.dumps(context.get('chat_history', []))}. "
+                f"Keep responses concise, up to {max_tokens} tokens."
+            )
+        },
+        {
+            'role': 'user',
+            'content': question
+        }
+    ]
+
+
+# Parse one server-sent event line of a streamed completion. Returns the
+# text it carries (possibly empty), or None at the end of the stream.
+def parse_stream_line(line):
+    if not line or not line.startswith('data:'):
+        return ''
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return None
+    try:
+        choice = json.loads(data)['choices'][0]
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise UpstreamError(f"Unexpected upstream stream event: {str(e)}")
+    return (choice.get('delta') or {}).get('content') or ''
+
+
+def parse_answer(data):
+    try:
+        return data['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError) as e:
+        raise UpstreamError(f"Unexpected upstream response: {str(e)}")
+
+
+# Client for the Perplexity chat completions API.
+# Keeps one pooled keep-alive session per process (recreated after a fork so
+# workers never share sockets), applies connect/read timeouts scaled to the
+# requested max_tokens and retries 429/5xx and connection errors a bounded
+# number of times with jittered exponential backoff.
+class PerplexityClient:
+    def __init__(self, base_url=None, model=DEFAULT_MODEL, api_key=None,
+                 connect_timeout=3.05, read_timeout=5.0, read_timeout_per_token=0.05,
+                 max_read_timeout=60.0, max_retries=2, backoff=0.5, max_backoff=4.0,
+                 pool_size=10):
+        self.base_url = (base_url or os.getenv('PERPLEXITY_BASE_URL') or DEFAULT_BASE_URL).rstrip('/')
+        self.model = model
+        self._api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.read_timeout_per_token = read_timeout_per_token
+        self.max_read_timeout = max_read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self._session_obj = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    # Import the HTTP library now, e.g. before gunicorn forks its workers
+    def preload(self):
+        _requests()
+
+    @property
+    def api_key(self):
+        return self._api_key or os.getenv('PERPLEXITY_API_KEY')
+
+    @property
+    def url(self):
+        return f"{self.base_url}/chat/completions"
+
+    def _session(self):
+        pid = os.getpid()
+        if self._session_obj is None or self._session_pid != pid:
+            with self._lock:
+                if self._session_obj is None or self._session_pid != pid:
+                    requests = _requests()
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session_obj = session
+                    self._session_pid = pid
+        return self._session_obj
+
+    # (connect, read) timeout: longer answers are allowed to take longer
+    def timeout_for(self, max_tokens):
+        read = self.read_timeout + self.read_timeout_per_token * max(0, int(max_tokens or 0))
+        return (self.connect_timeout, min(read, self.max_read_timeout))
+
+    # Full-jitter exponential backoff, or the server's Retry-After if given
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def payload(self, question, context, max_tokens, **extra):
+        return {
+            'model': self.model,
+            'messages': build_messages(question, context, max_tokens),
+            'max_tokens': max_tokens,
+            **extra,
+        }
+
+    def headers(self):
+        api_key = self.api_key
+        if not api_key:
+            raise UpstreamError('Perplexity API key not configured')
+        return {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        }
+
+    # POST to the completions endpoint with retries; returns the response
+    def post(self, payload, max_tokens, stream=False):
+        requests = _requests()
+        headers = self.headers()
+        timeout = self.timeout_for(max_tokens)
+        attempt = 0
+        while True:
+            try:
+                response = self._session().post(self.url, headers=headers, json=payload,
+                                                 timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise UpstreamError(f"Upstream request failed: {str(e)}")
+                delay = self._retry_delay(attempt)
+                logger.warning('Upstream request failed (%s), retrying in %.2fs', e, delay)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    if response.status_code >= 400:
+                        response.close()
+                        raise UpstreamError(f"Upstream returned HTTP {response.status_code}", response.status_code)
+                    return response
+                delay = self._retry_delay(attempt, response)
+                response.close()
+                logger.warning('Upstream returned HTTP %s, retrying in %.2fs', response.status_code, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    # Ask a question and return the answer text
+    def ask(self, question, context, max_tokens):
+        response = self.post(self.payload(question, context, max_tokens), max_tokens)
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise UpstreamError(f"Unexpected upstream response: {str(e)}")
+        return parse_answer(data)
+
+    # Ask a question with a streamed completion and yield the answer text
+    # piece by piece as the upstream sends its server-sent events
+    def stream(self, question, context, max_tokens):
+        response = self.post(self.payload(question, context, max_tokens, stream=True), max_tokens, stream=True)
+        requests = _requests()
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                text = parse_stream_line(line)
+                if text is None:
+                    break
+                if text:
+                    yield text
+        except requests.RequestException as e:
+            raise UpstreamError(f"Upstream stream failed: {str(e)}")
+        finally:
+            response.close()
+
+
+# asyncio counterpart of PerplexityClient for the async serving mode, with
+# the same configuration, timeouts and retry policy. ask() and stream() are
+# awaited, so one event loop overlaps the network waits of many requests.
+# The aiohttp session belongs to the event loop it was created in.
+class AsyncPerplexityClient(PerplexityClient):
+    def __init__(self, pool_size=100, **kwargs):
+        super().__init__(pool_size=pool_size, **kwargs)
+        self._session_loop = None
+
+    def preload(self):
+        _aiohttp()
+
+    def _session(self):
+        aiohttp = _aiohttp()
+        loop = asyncio.get_running_loop()
+        if self._session_obj is None or self._session_loop is not loop or self._session_obj.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session_obj = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session_obj
+
+    def _client_timeout(self, max_tokens):
+        aiohttp = _aiohttp()
+        connect, read = self.timeout_for(max_tokens)
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+    async def post(self, payload, max_tokens, stream=False):
+        aiohttp = _aiohttp()
+        headers = self.headers()
+        timeout = self._client_timeout(max_tokens)
+        attempt = 0
+        while True:
+            try:
+                response = await self._session().post(self.url, headers=headers, json=payload, timeout=timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise UpstreamError(f"Upstream request failed: {str(e) or type(e).__name__}")
+                delay = self._retry_delay(attempt)
+                logger.warning('Upstream request failed (%s), retrying in %.2fs', e, delay)
+            else:
+                if response.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    if response.status >= 400:
+                        response.release()
+                        raise UpstreamError(f"Upstream returned HTTP {response.status}", response.status)
+                    return response
+                delay = self._retry_delay(attempt, response)
+                response.release()
+                logger.warning('Upstream returned HTTP %s, retrying in %.2fs', response.status, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def ask(self, question, context, max_tokens):
+        aiohttp = _aiohttp()
+        response = await self.post(self.payload(question, context, max_tokens), max_tokens)
+        try:
+            data = await response.json(content_type=None)
+        except (ValueError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(f"Unexpected upstream response: {str(e)}")
+        finally:
+            response.release()
+        return parse_answer(data)
+
+    async def stream(self, question, context, max_tokens):
+        aiohttp = _aiohttp()
+        response = await self.post(self.payload(question, context, max_tokens, stream=True), max_tokens,
+                                   stream=True)
+        try:
+            async for raw in response.content:
+                text = parse_stream_line(raw.decode('utf-8').strip())
+                if text is None:
+                    break
+                if text:
+                    yield text
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(f"Upstream stream failed: {str(e) or type(e).__name__}")
+        finally:
+            response.release()
+
+    async def close(self):
+        if self._session_obj is not None and not self._session_obj.closed:
+            await self._session_obj.close()
+        self._session_obj = None
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Perplexity chat completions API.
+
+Answers every question with "echo: <question>" after a configurable delay,
+as a JSON completion or, when the request asks for stream=True, as
+server-sent events. A share of requests (--error-rate) can be answered with
+an error status instead. Point the app at it with PERPLEXITY_BASE_URL to try the
+serving modes or measure them without calling the real API.
+
+Usage: python upstream_stub.py [--port 8001] [--latency 1.0] [--jitter 0.5] [--stream-delay 0.05] [--error-rate 0.05]
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        stub.record()
+        delay = stub.next_latency()
+        if delay:
+            time.sleep(delay)
+        status = stub.next_failure()
+        if status:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        question = body.get('messages', [{}])[-1].get('content', '')
+        if body.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for word in ['echo: ', question]:
+                self.wfile.write(f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n".encode())
+                self.wfile.flush()
+                if stub.stream_delay:
+                    time.sleep(stub.stream_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+        answer = json.dumps({'choices': [{'message': {'content': f"echo: {question}"}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, *args):
+        pass
+
+
+# Stub server running in a background thread. `latency` is the delay before
+# each response plus up to `jitter` more, `stream_delay` the pause between
+# streamed pieces, `failures` a list of status codes to answer with before
+# succeeding and `error_rate` the share of later requests answered with
+# `error_status`.
+class StubUpstream:
+    def __init__(self, latency=0.0, stream_delay=0.0, host='127.0.0.1', port=0,
+                 jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_delay = stream_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.failures = []
+        self.requests_seen = 0
+        self.errors_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self):
+        with self._lock:
+            self.requests_seen += 1
+
+    def next_latency(self):
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def next_failure(self):
+        with self._lock:
+            if self.failures:
+                status = self.failures.pop(0)
+            elif self.error_rate and self._random.random() < self.error_rate:
+                status = self.error_status
+            else:
+                return None
+            self.errors_sent += 1
+            return status
+
+    # Serve in the calling thread until interrupted
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the Perplexity chat completions API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=1.0, help='seconds before each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many extra seconds per response')
+    parser.add_argument('--stream-delay', type=float, default=0.05, help='seconds between streamed pieces')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an error')
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+    stub = StubUpstream(args.latency, args.stream_delay, args.host, args.port,
+                        jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status)
+    print(f"✅ Stub upstream on {stub.url} (latency {args.latency}s, error rate {args.error_rate:.0%}); "
+          f"set PERPLEXITY_BASE_URL={stub.url}")
+    stub.serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())